@@ -71,6 +71,7 @@ class Recorder(core.Core):
     self.action.save()
     self.counter = 0
     self.known_enrollments = {}
+    self.checked_labels = set()
     if self.default_study:
       self.logger.info('start pre-loading known enrolled individuals')
       known_enrollments = self.kb.get_enrolled(self.default_study)
@@ -80,6 +81,22 @@ class Recorder(core.Core):
       self.logger.info('there are %d enrolled individuals in study %s' %
                        (len(self.known_enrollments), self.default_study.label))
 
+  def preload_enrollments(self, labels):
+    """
+    Look up, with a few batched queries, the enrollments of labels
+    that have not been pre-loaded yet, so that retrieve() does not
+    need to query the kb once per record.
+    """
+    missing = [l for l in labels if l not in self.known_enrollments]
+    if not missing:
+      return
+    self.logger.info('start checking %d enrollment labels' % len(missing))
+    self.known_enrollments.update(
+      self.kb.get_enrollments(self.default_study, missing)
+      )
+    self.checked_labels.update(missing)
+    self.logger.info('done checking enrollment labels')
+
   def dump_out(self):
     self.logger.debug('\tthere are %s records to save' %
                       len(self.individuals_to_be_saved))
@@ -90,6 +107,7 @@ class Recorder(core.Core):
     self.kb.save_array(self.enrollments_to_be_saved)
     for i, e in it.izip(self.individuals_to_be_saved,
                         self.enrollments_to_be_saved):
+      self.known_enrollments[e.studyCode] = e
       self.out_stream.writerow({
         'study': e.study.label,
         'label': e.studyCode,
@@ -110,9 +128,9 @@ class Recorder(core.Core):
     study = self.default_study or self.known_studies.setdefault(
       study_label, self.get_study(study_label)
       )
-    e = self.known_enrollments.get(
-      label, self.kb.get_enrollment(study, ind_label=label)
-      )
+    e = self.known_enrollments.get(label)
+    if e is None and label not in self.checked_labels:
+      e = self.kb.get_enrollment(study, ind_label=label)
     return study, e
 
   def retrieve(self, identifier):
@@ -277,6 +295,7 @@ def implementation(logger, host, user, passwd, args, close_handles):
         recorder.logger.critical(msg)
         raise core.ImporterValidationError(msg)
       by_label = make_ind_by_label(records)
+      recorder.preload_enrollments([k[1] for k in by_label])
       import_pedigree(recorder, by_label.itervalues())
       recorder.clean_up()
     except Exception, e:
@@ -30,14 +30,24 @@ class BuildFlowCellSamplesheetApp(Core):
                                                           keep_tokens=keep_tokens,
                                                           study_label=study_label,
                                                           logger=logger)
+        self.kb.queries.register(
+            'flowcell_by_label',
+            'SELECT fc FROM FlowCell fc WHERE fc.label = :flowcell_id',
+            {'flowcell_id': None})
+        self.kb.queries.register(
+            'flowcell_by_label_pattern',
+            'SELECT fc FROM FlowCell fc WHERE fc.label LIKE :pattern',
+            {'pattern': None})
 
     def __get_flowcell(self, flowcell_id, ignore_namespace):
         if ignore_namespace:
-            query = "SELECT fc FROM FlowCell fc WHERE fc.label LIKE '%%|%s'" % flowcell_id
+            pattern = '%%%s%s' % (self.NAMESPACE_DELIMITER, flowcell_id)
+            self.logger.debug('Using pattern: %r' % pattern)
+            flowcells = self.kb.queries.find_all('flowcell_by_label_pattern',
+                                                 {'pattern': pattern})
         else:
-            query = 'SELECT fc FROM FlowCell fc WHERE fc.label = :flowcell_id'
-        self.logger.debug('Using query: %r' % query)
-        flowcells = self.kb.find_all_by_query(query, {'flowcell_id' : flowcell_id})
+            flowcells = self.kb.queries.find_all('flowcell_by_label',
+                                                 {'flowcell_id': flowcell_id})
         self.logger.debug('Query returned %d items' % len(flowcells))
         if len(flowcells) > 1:
             raise IdentifierError(flowcell_id)
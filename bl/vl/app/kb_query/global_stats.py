@@ -31,7 +31,7 @@ class GlobalStats(Core):
 
   def dump(self, study_label, ofile):
     if study_label is None:
-      individuals = self.kb.get_objects(self.kb.Individual)
+      individuals = self.kb.iter_objects(self.kb.Individual)
       study_label = "_ALL_"
     else:
       study = self.kb.get_study(study_label)
@@ -59,10 +59,10 @@ class MapVIDApp(Core):
     known_enrollments = []
     for kst, labs in known_studies.iteritems():
       st = self.kb.get_study(kst)
-      for l in labs:
-        e = self.kb.get_enrollment(st, l)
-        if e:
-          known_enrollments.append(e)
+      if not st:
+        self.logger.error('unknown study %s' % kst)
+        continue
+      known_enrollments.extend(self.kb.get_enrollments(st, labs).itervalues())
       self.logger.debug('Loaded enrollments for study %s' % kst)
     for e in known_enrollments:
       enroll_label = '%s:%s' % (e.study.label, e.studyCode)
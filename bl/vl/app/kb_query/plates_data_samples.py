@@ -43,9 +43,8 @@ class BuildPlateDataSamplesDetails(Core):
         targets = []
         for tt in self.TARGET_TYPES:
             targets.extend(self.kb.get_objects(tt))
-        gdsamples = self.kb.get_objects(self.kb.GenotypeDataSample)
         lookup = {}
-        for gds in gdsamples:
+        for gds in self.kb.iter_objects(self.kb.GenotypeDataSample):
             lookup.setdefault(gds.action.target, []).append(gds)
         self.logger.info('Data Samples lookup table loaded')
         return lookup
@@ -17,11 +17,29 @@ where ``N`` is the number of SNPs in the data set.
 
 Note that most functions in this module operate directly on continuous
 probabilistic representations of genotypes, rather than discrete ones.
+
+Large data sets, e.g., the <nsamples>x2x<nmarkers> arrays written by
+``kb.genomics.materialize``, can be reduced in blocks of samples,
+optionally sharded across a pool of processes, with
+:func:`reduce_genotypes`:
+
+.. code-block:: python
+
+  stats = reduce_genotypes(probs, confs, processes=8)
+  stats.maf(), stats.hwe(), stats.call_rate()
 """
 
+import multiprocessing as mp
+from collections import OrderedDict
+
 import numpy as np
 
 
+CALL_CONFIDENCE_THRESHOLD = 0.05
+REDUCE_BLOCK_SIZE = 1000
+HWE_CACHE_SIZE = 2**22
+
+
 def project_to_discrete_genotype(probs, threshold=0.2):
   """
   Convert a probabilistic genotype description to the classical
@@ -35,15 +53,75 @@ def project_to_discrete_genotype(probs, threshold=0.2):
   The ``threshold`` parameter represents the maximum value of the
   ratio between the second highest and the highest probability for a
   marker, beyond which the discrete call is marked as undefined.
+  Markers with a NaN probability are undefined.
   """
   allprobs = np.vstack((probs, 1.0 - probs.sum(axis=0)))
   encoding = np.argmax(allprobs, axis=0)
   allprobs.sort(axis=0)
   undef_condition = (allprobs[-2] / (allprobs[-1] + 1e-6)) >= threshold
   encoding[undef_condition] = 3
+  encoding[np.isnan(probs).any(axis=0)] = 3
   return encoding
 
 
+def project_to_discrete_genotypes(probs, threshold=0.2, out=None,
+                                  block_size=REDUCE_BLOCK_SIZE):
+  """
+  Batched version of project_to_discrete_genotype, for probs with
+  shape (S, 2, N), e.g., a memory map as the ones written by
+  ``kb.genomics.materialize``.
+
+  Codes are written to out, a (S, N) uint8 array that is allocated if
+  not given, and returned. probs is read block_size samples at a
+  time; the highest and second highest probability of each marker
+  are found with element wise maximum and minimum, without sorting,
+  into work buffers that are reused for all blocks.
+  """
+  S, N = probs.shape[0], probs.shape[-1]
+  if probs.shape[1:] != (2, N):
+    raise ValueError('bad probs shape: %r' % (probs.shape,))
+  if out is None:
+    out = np.empty((S, N), dtype=np.uint8)
+  elif out.shape != (S, N):
+    raise ValueError('bad out shape: %r' % (out.shape,))
+  dtype = probs.dtype if probs.dtype.kind == 'f' else np.float64
+  B = max(1, min(block_size, S))
+  p_ab, top, second, tmp = [np.empty((B, N), dtype=dtype) for _ in xrange(4)]
+  mask, other_mask = [np.empty((B, N), dtype=np.bool) for _ in xrange(2)]
+  for beg in xrange(0, S, B):
+    n = min(B, S - beg)
+    p_aa, p_bb = probs[beg:beg + n, 0], probs[beg:beg + n, 1]
+    ab, hi, lo, t = p_ab[:n], top[:n], second[:n], tmp[:n]
+    m, om = mask[:n], other_mask[:n]
+    codes = out[beg:beg + n]
+    np.add(p_aa, p_bb, out=ab)
+    np.subtract(1.0, ab, out=ab)
+    # argmax, with ties resolved as in project_to_discrete_genotype
+    codes.fill(2)
+    np.greater_equal(p_aa, p_bb, out=m)
+    np.greater_equal(p_aa, ab, out=om)
+    om &= m
+    codes[om] = 0
+    np.logical_not(m, out=m)
+    np.greater_equal(p_bb, ab, out=om)
+    om &= m
+    codes[om] = 1
+    # top two
+    np.maximum(p_aa, p_bb, out=hi)
+    np.minimum(p_aa, p_bb, out=lo)
+    np.minimum(hi, ab, out=t)
+    np.maximum(lo, t, out=lo)
+    np.maximum(hi, ab, out=hi)
+    hi += 1e-6
+    np.divide(lo, hi, out=lo)
+    np.greater_equal(lo, threshold, out=m)
+    codes[m] = 3
+    # p_ab is NaN iff p_aa or p_bb is
+    np.isnan(ab, out=m)
+    codes[m] = 3
+  return out
+
+
 def count_homozygotes(it):
   """
   Compute the levels of AA and BB homozigosity.
@@ -56,14 +134,15 @@ def count_homozygotes(it):
   input stream, whose rows contain the homozigosity levels for,
   respectively, AA and BB.
   """
-  setup_done = False
-  for i, x in enumerate(it):
+  stats = None
+  for x in it:
     probs = x['probs']
-    if not setup_done:
-      counts = np.zeros(probs.shape, dtype=np.float32)
-      setup_done = True
-    counts += probs
-  return (i + 1), np.cast[np.int32](counts)
+    if stats is None:
+      stats = GenotypeStats(probs.shape[-1])
+    stats.update(probs)
+  if stats is None:
+    raise ValueError('no genotypes in input stream')
+  return stats.get_counts()
 
 
 def maf(it, counts=None):
@@ -108,6 +187,78 @@ def hwe_scalar(n_a, n_ab, N):
 hwe_vector = np.vectorize(hwe_scalar, [np.float32])
 
 
+class _HweCache(object):
+  """
+  Least recently used cache of the p-values of all possible numbers
+  of heterozygotes, given (n_a, N), holding at most max_size values.
+  """
+
+  def __init__(self, max_size=HWE_CACHE_SIZE):
+    self.max_size = max_size
+    self.size = 0
+    self.__pvalues = OrderedDict()
+
+  def __len__(self):
+    return len(self.__pvalues)
+
+  def get(self, n_a, N):
+    key = (n_a, N)
+    pvalues = self.__pvalues.pop(key, None)
+    if pvalues is None:
+      # same distribution as hwe_scalar: pvalues[k] is the sum of all
+      # probabilities not greater than prob[k]
+      _, prob = hwe_probabilites(n_a, -1, N)
+      sorted_prob = np.sort(prob)
+      cum_prob = np.cumsum(sorted_prob)
+      pvalues = cum_prob[np.searchsorted(sorted_prob, prob, side='right') - 1]
+      self.size += pvalues.size
+      while self.size > self.max_size and self.__pvalues:
+        self.size -= self.__pvalues.popitem(last=False)[1].size
+    self.__pvalues[key] = pvalues
+    return pvalues
+
+  def clear(self):
+    self.__pvalues.clear()
+    self.size = 0
+
+
+_hwe_cache = _HweCache()
+
+
+def hwe_exact(n_a, n_ab, N):
+  """
+  Vectorized version of hwe_scalar: n_a, n_ab and N are broadcast
+  against each other.
+
+  Markers are grouped by (minor allele count, N): the distribution of
+  each group is computed once, and cached across calls, and the
+  p-values of all the markers in the group are looked up at once.
+  Inconsistent inputs, e.g., n_ab > n_a, yield nan.
+  """
+  n_a, n_ab, N = np.broadcast_arrays(*[np.asarray(x, dtype=np.int64)
+                                       for x in (n_a, n_ab, N)])
+  shape = n_a.shape
+  n_a, n_ab, N = n_a.ravel(), n_ab.ravel(), N.ravel()
+  n_a = np.where(n_a <= N, n_a, 2*N - n_a)
+  res = np.empty(n_a.size, dtype=np.float64)
+  res.fill(np.nan)
+  res[n_a == 0] = 1.0
+  res[(n_ab == n_a) & (n_a > 0)] = 0.0
+  offset = n_ab - (n_a & 0x01)
+  todo = np.flatnonzero((n_a > 0) & (n_ab < n_a) & (offset >= 0) &
+                        (offset % 2 == 0))
+  if todo.size > 0:
+    todo = todo[np.lexsort((N[todo], n_a[todo]))]
+    a, b = n_a[todo], N[todo]
+    bounds = np.flatnonzero(np.hstack([[True], (a[1:] != a[:-1]) |
+                                       (b[1:] != b[:-1]), [True]]))
+    for beg, end in zip(bounds[:-1], bounds[1:]):
+      pvalues = _hwe_cache.get(int(a[beg]), int(b[beg]))
+      group = todo[beg:end]
+      res[group] = pvalues[offset[group] // 2]
+  return res.reshape(shape)
+
+
 def hwe(it, counts=None):
   """
   Implement Hardy-Weinberg exact calculation using the method described in
@@ -142,7 +293,178 @@ def hwe(it, counts=None):
   N_AB = N - counts.sum(axis=0)
   N_x = N_AB + 2*counts
   low_freq = N_x.min(axis=0)
-  return hwe_vector(low_freq, N_AB, N)
+  return hwe_exact(low_freq, N_AB, N).astype(np.float32)
+
+
+class GenotypeStats(object):
+  """
+  Per marker statistics accumulated, in double precision, over blocks
+  of genotypes: number of samples, AA and BB homozygosity levels and,
+  if confidence values are given, number of calls whose confidence
+  is not above threshold.  A sample contributes to the homozygosity
+  levels of a marker only if both its probabilities for that marker
+  are not NaN, see n_valid.
+
+  Statistics computed on disjoint sets of samples can be combined
+  with merge.
+  """
+
+  def __init__(self, n_markers, threshold=CALL_CONFIDENCE_THRESHOLD):
+    self.n_markers = n_markers
+    self.threshold = threshold
+    self.n_samples = 0
+    self.sums = np.zeros((2, n_markers), dtype=np.float64)
+    self.n_valid = np.zeros(n_markers, dtype=np.int64)
+    self.n_confs = 0
+    self.n_called = np.zeros(n_markers, dtype=np.int64)
+
+  def update(self, probs, confs=None):
+    """
+    Add a block of S genotypes: probs has shape (S, 2, N), or (2,
+    N) for a single genotype, and confs, if given, (S, N) or (N,).
+    """
+    probs = np.asarray(probs)
+    if probs.ndim == 2:
+      probs = probs[np.newaxis]
+    if probs.shape[1:] != (2, self.n_markers):
+      raise ValueError('bad probs shape: %r' % (probs.shape,))
+    valid = ~np.isnan(probs).any(axis=1)
+    self.n_samples += len(probs)
+    self.n_valid += valid.sum(axis=0)
+    if valid.all():
+      self.sums += probs.sum(axis=0, dtype=np.float64)
+    else:
+      self.sums += np.where(valid[:, np.newaxis], probs, 0).sum(
+        axis=0, dtype=np.float64)
+    if confs is not None:
+      confs = np.asarray(confs).reshape(-1, self.n_markers)
+      if len(confs) != len(probs):
+        raise ValueError('probs and confs have a different number of rows')
+      self.n_confs += len(confs)
+      self.n_called += (confs <= self.threshold).sum(axis=0)
+    return self
+
+  def merge(self, other):
+    """
+    Add the statistics of other, computed on a different set of
+    samples.
+    """
+    if (other.n_markers != self.n_markers or
+        other.threshold != self.threshold):
+      raise ValueError('incompatible statistics')
+    self.n_samples += other.n_samples
+    self.sums += other.sums
+    self.n_valid += other.n_valid
+    self.n_confs+= other.n_confs
+    self.n_called += other.n_called
+    return self
+
+  def get_counts(self):
+    """
+    Return the homozygote counts, in the format returned by
+    count_homozygotes.  If some probabilities were NaN, the number of
+    samples is replaced by the per marker n_valid array.
+    """
+    N = self.n_samples
+    if (self.n_valid != N).any():
+      N = self.n_valid
+    return N, np.rint(self.sums).astype(np.int32)
+
+  def maf(self):
+    return maf(None, self.get_counts())
+
+  def hwe(self):
+    return hwe(None, self.get_counts())
+
+  def call_rate(self):
+    """
+    Fraction of confident calls per marker, or None if no
+    confidence values were given.
+    """
+    if self.n_confs == 0:
+      return None
+    return self.n_called / float(self.n_confs)
+
+
+def iter_blocks(probs, confs=None, block_size=REDUCE_BLOCK_SIZE):
+  """
+  Iterate over (probs, confs) blocks of at most block_size samples of
+  probs, a (S, 2, N) array, and confs, a (S, N) array or None.
+  """
+  for i in xrange(0, len(probs), block_size):
+    yield (probs[i:i + block_size],
+           None if confs is None else confs[i:i + block_size])
+
+
+def reduce_blocks(blocks, n_markers, threshold=CALL_CONFIDENCE_THRESHOLD):
+  """
+  Reduce an iterable of (probs, confs) blocks, see
+  :meth:`GenotypeStats.update`, to a GenotypeStats object.
+  """
+  stats = GenotypeStats(n_markers, threshold)
+  for probs, confs in blocks:
+    stats.update(probs, confs)
+  return stats
+
+
+def _load_array(a):
+  return np.load(a, mmap_mode='r') if isinstance(a, basestring) else a
+
+
+def _make_shard(a, beg, end):
+  # paths are sent as they are, arrays as slices
+  if a is None or isinstance(a, basestring):
+    return a, beg, end
+  return a[beg:end], 0, end - beg
+
+
+def _load_shard(shard):
+  a, beg, end = shard
+  return None if a is None else _load_array(a)[beg:end]
+
+
+def _reduce_shard(args):
+  probs, confs, threshold, block_size = args
+  probs, confs = _load_shard(probs), _load_shard(confs)
+  return reduce_blocks(iter_blocks(probs, confs, block_size),
+                       probs.shape[-1], threshold)
+
+
+def reduce_genotypes(probs, confs=None, threshold=CALL_CONFIDENCE_THRESHOLD,
+                     block_size=REDUCE_BLOCK_SIZE, processes=1):
+  """
+  Compute a GenotypeStats object for probs, a (S, 2, N) array, and
+  confs, a (S, N) array or None, in a single pass over the data,
+  reading block_size samples at a time.
+
+  If processes is not 1, samples are split into contiguous shards
+  that are reduced by a pool of processes (as many as the cpus if
+  processes is None) and then merged. probs and confs can also be
+  paths to .npy files, e.g., those written by kb.genomics.materialize:
+  in this case each process memory maps them, rather than receiving
+  a copy of its shard.
+  """
+  shape = _load_array(probs).shape
+  S, N = shape[0], shape[-1]
+  if processes is None:
+    processes = mp.cpu_count()
+  n_shards = max(1, min(processes, S // block_size))
+  bounds = [int(b) for b in np.linspace(0, S, n_shards + 1)]
+  jobs = [(_make_shard(probs, beg, end), _make_shard(confs, beg, end),
+           threshold, block_size)
+          for beg, end in zip(bounds[:-1], bounds[1:])]
+  if n_shards == 1:
+    return _reduce_shard(jobs[0])
+  pool = mp.Pool(n_shards)
+  try:
+    results = pool.map(_reduce_shard, jobs)
+  finally:
+    pool.terminate()
+    pool.join()
+  stats = GenotypeStats(N, threshold)
+  for s in results:
+    stats.merge(s)
+  return stats
 
 
 # FIXME: this is out-of-sync and currently not used anywhere
@@ -6,16 +6,27 @@ Genotyping-related I/O
 ======================
 """
 
-import array, struct, datetime, itertools as it
-from collections import Counter
+import array, struct, datetime, operator, itertools as it
+import multiprocessing as mp
 
 import numpy as np
 
 from bl.core.utils import NullLogger
 from bl.core.seq.utils import reverse_complement as rev_compl
 from bl.vl.utils.snp import split_mask
+from bl.vl.utils.np_ext import sorted_lookup
 from bl.core.io import MessageStreamReader
-from bl.vl.genotype.algo import project_to_discrete_genotype
+from bl.vl.genotype.algo import project_to_discrete_genotypes
+
+
+SSC_LABEL_SIZE = 128
+SSC_RECORD_DTYPE = [('label', '|S%d' % SSC_LABEL_SIZE),
+                    ('confidence', np.float32),
+                    ('w_AA', np.float64),
+                    ('w_AB', np.float64),
+                    ('w_BB', np.float64)]
+SSC_BLOCK_SIZE = 10
+PED_BLOCK_SIZE = 32
 
 
 class Error(Exception):
@@ -205,7 +216,8 @@ class VCFWriter(object):
       # FIXME: it would be better if we could directly tell resolve_to_data
       # to fetch only as selected by marker_selector
       probs, _ = d.resolve_to_data()
-      data[i, :] = project_to_discrete_genotype(probs[:, self.marker_selector])
+      project_to_discrete_genotypes(
+        probs[np.newaxis, :, self.marker_selector], out=data[i:i + 1])
     return labels, data
 
   def __write_header(self, fobj, labels):
@@ -271,16 +283,30 @@ class PedWriter(object):
       the discrete call is marked as undefined. Default 0.2 See
       documentation of `bl.vl.genotype.algo.project_to_discrete_genotype()`.
 
+  :param block_size: number of family members whose genotypes are
+      fetched and projected at a time
+  :type block_size: int
+
   """
+  # ped genotype of each discrete call, followed by a separator
+  GENOTYPE_LUT = np.fromstring('A A\tB B\tA B\t0 0\t',
+                               dtype=np.uint8).reshape(4, 4)
+
   def __init__(self, vcs, base_path="bl_vl_ped", resolve_label=False, 
-               threshold=0.2):
+               threshold=0.2, block_size=PED_BLOCK_SIZE):
     self.vcs = vcs
     self.base_path = base_path
     self.threshold = threshold
+    self.block_size = max(1, block_size)
     self.ped_file = None
     N = len(self.vcs)
     self.null_probs = np.empty((2, N), dtype=np.float32)
     self.null_probs.fill(1/3.)
+    self.row_buffer = np.empty((N, self.GENOTYPE_LUT.shape[1]),
+                               dtype=np.uint8)
+    # (block_size, 2, N) probs and (block_size, N) codes, allocated
+    # on first use and reused for all blocks of all families
+    self.probs_buffer = self.codes_buffer = None
     self.kb = self.vcs.proxy
     self.kb.Gender.map_enums_values(self.kb)
     self.gender_map = lambda x: 2 if x == self.kb.Gender.FEMALE else 1
@@ -288,8 +314,9 @@ class PedWriter(object):
 
   def _extract_labels(self, origin, resolve_label):
     mvids = self.mvids
-    labels = [':'.join([v, str(i)]) 
-              for v, i in it.izip(origin['vid'], origin['vpos'])]
+    labels = np.array([':'.join([v, str(i)])
+                       for v, i in it.izip(origin['vid'], origin['vpos'])],
+                      dtype=object)
     if resolve_label:
       # FIXME this works because, up to now, we only have
       # SNPMarkersSet as possible position sources.
@@ -298,8 +325,8 @@ class PedWriter(object):
       for vid, mset in msets.iteritems():
         sel = origin['vid'] == vid
         indices = origin['vpos'][sel]
-        marray = self.kb.genomics.get_markers_array_rows(mset, indices)
-        labels[sel] = marray['label']
+        mindex = self.kb.genomics.get_markers_index(mset)
+        labels[sel] = mindex['label'][indices]
     return labels
 
   def _extract_data_indices(self, origin):
@@ -395,32 +422,78 @@ class PedWriter(object):
     normalized_ds_by_id = self._check_and_normalize_input(data_sample_by_id)
     if not phenotype_by_id:
       phenotype_by_id = {None: 0}
-    allele_patterns = {0: 'A A', 1: 'B B', 2: 'A B', 3: '0 0'}
-    def dump_genotype(fo, data_sample):
-      if data_sample is None:
-        probs = self.null_probs
-      else:
-        # FIXME this is an overkill if there is only one mset.
-        probs = np.zeros((2, len(self.vcs)), dtype=np.float32)
-        for mid, indices in self.indices.iteritems():
-          pprobs, _ = data_sample[mid].resolve_to_data(indices[1])
-          probs[:,indices[0]] = pprobs
-      fo.write('\t'.join([allele_patterns[x]
-                          for x in project_to_discrete_genotype(probs, 
-                                              threshold=self.threshold)]))
     if self.ped_file is None:
       self.ped_file = open(self.base_path+'.ped', 'w')
-    for i in family_members:
-      # Family ID, IndividualID, paternalID, maternalID, sex, phenotype
-      fat_id = 0 if not i.father else i.father.id
-      mot_id = 0 if not i.mother else i.mother.id
-      gender = self.gender_map(i.gender)
-      pheno = phenotype_by_id.get(i.id, 0)
-      self.ped_file.write('%s\t%s\t%s\t%s\t%s\t%s\t' %
-                          (family_label, i.id, fat_id, mot_id, gender, pheno))
+    family_members = iter(family_members)
+    while True:
+      block = list(it.islice(family_members, self.block_size))
+      if not block:
+        break
+      codes = None
       if normalized_ds_by_id:
-        dump_genotype(self.ped_file, normalized_ds_by_id.get(i.id))
+        codes = self._get_block_codes([normalized_ds_by_id.get(i.id)
+                                       for i in block])
+      for k, i in enumerate(block):
+        # Family ID, IndividualID, paternalID, maternalID, sex, phenotype
+        fat_id = 0 if not i.father else i.father.id
+        mot_id = 0 if not i.mother else i.mother.id
+        gender = self.gender_map(i.gender)
+        pheno = phenotype_by_id.get(i.id, 0)
+        self.ped_file.write('%s\t%s\t%s\t%s\t%s\t%s\t' %
+                            (family_label, i.id, fat_id, mot_id, gender,
+                             pheno))
+        if codes is None:
+          self.ped_file.write('\n')
+        else:
+          self._write_genotypes(codes[k])
+
+  def _get_block_codes(self, data_samples):
+    """
+    Discrete calls for a block of at most block_size family members,
+    as a (len(data_samples), N) view of codes_buffer: the gdos of
+    each markers set are fetched with a single resolve_many call.
+    Members without data samples, or whose data samples have no gdo,
+    are undefined.
+    """
+    if self.probs_buffer is None:
+      N = len(self.vcs)
+      self.probs_buffer = np.empty((self.block_size, 2, N), dtype=np.float32)
+      self.codes_buffer = np.empty((self.block_size, N), dtype=np.uint8)
+    n = len(data_samples)
+    probs = self.probs_buffer[:n]
+    probs.fill(0)
+    for mid, (positions, vpos) in self.indices.iteritems():
+      rows_by_id, samples = {}, []
+      for k, ds in enumerate(data_samples):
+        if ds is None:
+          continue
+        if ds[mid].id not in rows_by_id:
+          samples.append(ds[mid])
+        rows_by_id.setdefault(ds[mid].id, []).append(k)
+      resolved = set()
+      for ds, pprobs, _ in self.kb.genomics.resolve_many(samples, vpos):
+        for k in rows_by_id[ds.id]:
+          probs[k][:, positions] = pprobs
+        resolved.add(ds.id)
+      for vid in set(rows_by_id) - resolved:
+        for k in rows_by_id[vid]:
+          probs[k][:, positions] = self.null_probs[:, positions]
+    for k, ds in enumerate(data_samples):
+      if ds is None:
+        probs[k] = self.null_probs
+    return project_to_discrete_genotypes(probs, threshold=self.threshold,
+                                         out=self.codes_buffer[:n])
+
+  def _write_genotypes(self, codes):
+    # the whole row is rendered in row_buffer and written at once,
+    # with the last separator replaced by the end of line
+    if len(codes) == 0:
       self.ped_file.write('\n')
+      return
+    np.take(self.GENOTYPE_LUT, codes, axis=0, out=self.row_buffer,
+            mode='clip')
+    self.row_buffer[-1, -1] = ord('\n')
+    self.ped_file.write(self.row_buffer.data)
 
   def close(self):
     if self.ped_file:
@@ -428,11 +501,52 @@ class PedWriter(object):
     self.ped_file = None
 
 
+def read_ssc_records(fn, n_records):
+  """
+  Read the first n_records records of a file with mimetypes.SSC_FILE
+  mimetype into a structured array with SSC_RECORD_DTYPE dtype.
+  """
+  reader = MessageStreamReader(fn)
+  fields = operator.itemgetter(1, 3, 6, 7, 8)
+  return np.array([fields(reader.read()) for _ in xrange(n_records)],
+                  dtype=SSC_RECORD_DTYPE)
+
+
+def _ssc_to_arrays(records, markers):
+  n_markers = len(markers)
+  if hasattr(markers, 'lookup'):
+    rows = markers.lookup(records['label'])
+  else:
+    order = np.argsort(markers['label'], kind='mergesort')
+    rows = sorted_lookup(markers['label'][order], records['label'], order)
+  unknown = rows < 0
+  if unknown.any():
+    raise KeyError(records['label'][unknown][0])
+  flips = markers['permutation'][rows].astype(np.bool)
+  indx = markers['index'][rows]
+  S = records['w_AA'] + records['w_AB'] + records['w_BB']
+  ok = S != 0
+  p_AA = records['w_AA'][ok] / S[ok]
+  p_BB = records['w_BB'][ok] / S[ok]
+  flips, idx = flips[ok], indx[ok]
+  probs = np.empty((2, n_markers), dtype=np.float32)
+  probs.fill(1/3.)
+  probs[0, idx] = np.where(flips, p_BB, p_AA)
+  probs[1, idx] = np.where(flips, p_AA, p_BB)
+  confs = np.zeros((n_markers,), dtype=np.float32)
+  confs[indx] = records['confidence']
+  return probs, confs, records[~ok]
+
+
 def read_ssc(fn, mset, markers=None, logger=None):
   """
   Read a file with mimetypes.SSC_FILE mimetype and return the prob and
   conf arrays for a given marker array mset.
 
+  The whole file is decoded at once and mapped on the markers set
+  with a vectorized search over marker labels. Records whose weights
+  sum up to zero keep the default 1/3 probabilities.
+
   :param fn: ssc file name
   :type fn: str
 
@@ -441,47 +555,85 @@ def read_ssc(fn, mset, markers=None, logger=None):
 
   :param markers: preloaded markers informations
   :type markers: a numpy record array obtained with a call to
-                 mset.proxy.genomics.get_markers_array_rows(mset)
+                 mset.proxy.genomics.get_markers_array_rows(mset), or
+                 the result of mset.proxy.genomics.get_markers_index(mset)
   """
   if logger is None:
     logger = NullLogger()
-  ct = Counter()
-
-  # FIXME do we really want something so convoluted?
   if markers is None:
-    markers = mset.proxy.genomics.get_markers_array_rows(mset)
-  n_markers = len(markers)
-  probs = np.empty((2, n_markers), dtype=np.float32)
-  probs.fill(1/3.)
-  confs = np.zeros((n_markers,), dtype=np.float32)
-  labels = markers['label']
-  flips = markers['permutation']
-  indx  = markers['index']
-  l2m = dict((l, (f, i)) for (l, f, i) in it.izip(labels, flips, indx))
-  reader = MessageStreamReader(fn)
-  for _ in xrange(n_markers):
-    _, snp_label, _, conf, _, _, w_AA, w_AB, w_BB = reader.read()
-    flip, idx = l2m[snp_label]
-    S = w_AA + w_AB + w_BB
-    try:
-      p_AA, p_BB = w_AA / S, w_BB / S
-      if flip:
-        p_AA, p_BB = p_BB, p_AA
-      probs[0,idx] = p_AA
-      probs[1,idx] = p_BB
-    except ZeroDivisionError:
-      logger.warning(
-        'read_ssc:\tZeroDivisionError raised while parsing file %s' % fn
-        )
-      logger.debug('read_ssc:\tsnp_label = %s -- w_AA, w_AB, w_BB = %r' % (
-        snp_label, (w_AA, w_AB, w_BB)
-        ))
-      logger.debug('read_ssc:\tusing default probs %r' % (
-        (probs[0,idx], probs[1,idx]),
+    markers = mset.proxy.genomics.get_markers_index(mset)
+  records = read_ssc_records(fn, len(markers))
+  probs, confs, outliers = _ssc_to_arrays(records, markers)
+  if len(outliers):
+    logger.warning(
+      'read_ssc:\tnull weights sum for %d markers in file %s' % (
+        len(outliers), fn
         ))
-      ct['outliers'] += 1
-    confs[idx] = conf
+  for r in outliers:
+    logger.debug('read_ssc:\tsnp_label = %s -- w_AA, w_AB, w_BB = %r' % (
+      r['label'], (r['w_AA'], r['w_AB'], r['w_BB'])
+      ))
   logger.info('read_scc:\tfound %d suspected outliers in %s' % (
-    ct['outliers'], fn
+    len(outliers), fn
     ))
   return probs, confs
+
+
+def _read_ssc_job(args):
+  fn, markers = args
+  try:
+    records = read_ssc_records(fn, len(markers))
+    probs, confs, outliers = _ssc_to_arrays(records, markers)
+  except (IOError, KeyError, TypeError), e:
+    return fn, None, None, '%s: %s' % (type(e).__name__, e)
+  return fn, probs, confs, len(outliers)
+
+
+def read_ssc_many(fns, mset, markers=None, block_size=SSC_BLOCK_SIZE,
+                  processes=None, logger=None):
+  """
+  Read the files with mimetypes.SSC_FILE mimetype listed in fns with
+  a pool of processes, see :func:`read_ssc`, and yield (selected,
+  probs_block, confs_block) tuples, where selected lists the
+  positions in fns of the (at most block_size) files in the block.
+  Blocks follow the order of fns and can be fed directly to
+  kb.genomics.add_gdos:
+
+  .. code-block:: python
+
+    for sel, probs, confs in read_ssc_many(paths, mset):
+      kb.genomics.add_gdos(action, [samples[i] for i in sel], probs, confs)
+
+  Files that cannot be read, or contain unknown markers, are logged
+  and skipped.
+  """
+  if logger is None:
+    logger = NullLogger()
+  if markers is None:
+    markers = mset.proxy.genomics.get_markers_index(mset)
+  n_markers = len(markers)
+  pool = mp.Pool(processes)
+  try:
+    results = pool.imap(_read_ssc_job, ((fn, markers) for fn in fns))
+    selected = []
+    probs = np.empty((block_size, 2, n_markers), dtype=np.float32)
+    confs = np.empty((block_size, n_markers), dtype=np.float32)
+    for i, (fn, p, c, info) in enumerate(results):
+      if p is None:
+        logger.error('read_ssc_many:\tcannot read %s (%s)' % (fn, info))
+        continue
+      logger.info('read_scc:\tfound %d suspected outliers in %s' % (
+        info, fn
+        ))
+      probs[len(selected)] = p
+      confs[len(selected)] = c
+      selected.append(i)
+      if len(selected) == block_size:
+        yield selected, probs.copy(), confs.copy()
+        selected = []
+    if selected:
+      n = len(selected)
+      yield selected, probs[:n].copy(), confs[:n].copy()
+  finally:
+    pool.terminate()
+    pool.join()
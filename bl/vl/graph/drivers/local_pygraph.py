@@ -46,18 +46,17 @@ class PygraphDriver(object):
     def setup(self):
         self.logger.info('start pre-fetching graph data')
         self.logger.info('-- start pre-fetching action data')
-        actions = self.kb.get_objects(self.kb.Action)
-        self.logger.debug('-- fetched %d actions' % len(actions))
         action_by_oid = {}
-        for a in actions:
+        for a in self.kb.iter_objects(self.kb.Action):
             assert a.omero_id not in action_by_oid
             action_by_oid[a.omero_id] = a
+        self.logger.debug('-- fetched %d actions' % len(action_by_oid))
         self.logger.info('-- done pre-fetching action data')
         objs = []
         self.logger.info('-- start pre-fetching objs data')
         for k in self.obj_klasses:
             old_len = len(objs)
-            objs.extend(self.kb.get_objects(k))
+            objs.extend(self.kb.iter_objects(k))
             self.logger.info('-- -- done pre-fetching %s and subclasses' % k)
             self.logger.debug('-- -- fetched %d objects' % (len(objs) - old_len))
         self.logger.info('-- done pre-fetching objs data')
@@ -69,7 +68,7 @@ class PygraphDriver(object):
             obj_by_oid[self.__okey__(o)] = o
         self.logger.info('done mapping objs nodes')
         action_oid_to_object = {}
-        for a in actions:
+        for a in action_by_oid.itervalues():
             # there could be dangling actions
             if hasattr(a, 'target') and a.target.omero_id in obj_by_oid:
                 k = a.omero_id
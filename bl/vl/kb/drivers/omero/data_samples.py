@@ -79,12 +79,15 @@ class GenotypeDataSample(DataSample):
       raise ValueError('no connected DataObject(s)')
     for do in dos:
       do.reload()
-      if do.mimetype == mimetypes.GDO_TABLE:
+      if do.mimetype in (mimetypes.GDO_TABLE, mimetypes.GDO_QTABLE):
         set_vid, vid, index = self.proxy.genomics.parse_gdo_path(do.path)
         mset = self.snpMarkersSet
         assert mset.id == set_vid
         mset.reload()
-        res = self.proxy.genomics.get_gdo(mset, vid, index, indices=indices)
+        encoding = self.proxy.genomics.get_gdo_encoding(do.path)
+        res = self.proxy.genomics.get_gdo(mset, vid, index, indices=indices,
+                                          encoding=encoding, sha1=do.sha1)
         return res['probs'], res['confidence']
     else:
-      raise ValueError('DataObject is not a %s' % mimetypes.GDO_TABLE)
+      raise ValueError('DataObject is not a %s or a %s' %
+                       (mimetypes.GDO_TABLE, mimetypes.GDO_QTABLE))
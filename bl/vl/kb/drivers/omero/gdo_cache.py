@@ -0,0 +1,172 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Local gdo cache
+===============
+
+A directory of gdo rows, each one saved as a .npy file named after the
+sha1 recorded in the corresponding DataObject, i.e., the sha1 of the
+row's probs bytes followed by its confidence bytes.  Entries are
+memory mapped when read, checked against their sha1 the first time
+they are used by a process, and evicted, least recently used first,
+when the total size of the directory exceeds a given limit.
+
+.. code-block:: python
+
+   kb.genomics.enable_gdo_cache('/scratch/gdo-cache', max_size=50 * 2**30)
+   probs, confs = data_sample.resolve_to_data()  # fetched and cached
+   probs, confs = data_sample.resolve_to_data()  # read from the cache
+"""
+
+import os, hashlib, threading
+
+import numpy as np
+
+
+DEFAULT_GDO_CACHE_SIZE = 10 * 2**30
+SUFFIX = '.npy'
+
+
+class GdoCache(object):
+  """
+  A sha1 keyed, size capped, on disk cache of gdo rows. Each entry
+  also records the op_vid of the row it was read from.
+  """
+
+  def __init__(self, root, max_size=DEFAULT_GDO_CACHE_SIZE):
+    if max_size <= 0:
+      raise ValueError('max_size should be a positive number')
+    self.root = root
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self.__entries = {}
+    self.__verified = set()
+    self.__lock = threading.RLock()
+    if not os.path.isdir(root):
+      os.makedirs(root)
+    for fn in os.listdir(root):
+      if not fn.endswith(SUFFIX):
+        continue
+      try:
+        sha1, op_vid = fn[:-len(SUFFIX)].split('.')
+      except ValueError:
+        continue
+      size = os.path.getsize(os.path.join(root, fn))
+      self.__entries[sha1] = (op_vid, size)
+
+  def __len__(self):
+    return len(self.__entries)
+
+  def __path(self, sha1):
+    return os.path.join(self.root,
+                        '%s.%s%s' % (sha1, self.__entries[sha1][0], SUFFIX))
+
+  def __drop(self, sha1):
+    try:
+      os.remove(self.__path(sha1))
+    except OSError:
+      pass
+    del self.__entries[sha1]
+    self.__verified.discard(sha1)
+
+  @property
+  def size(self):
+    return sum(size for _, size in self.__entries.itervalues())
+
+  def get(self, sha1):
+    """
+    Return (op_vid, data) for the row with the given sha1, where
+    data is a copy on write memory map, or None on a miss.
+    """
+    with self.__lock:
+      return self.__get(sha1)
+
+  def __get(self, sha1):
+    if sha1 not in self.__entries:
+      self.misses += 1
+      return None
+    path = self.__path(sha1)
+    try:
+      data = np.load(path, mmap_mode='c')
+    except (IOError, ValueError):
+      self.__drop(sha1)
+      self.misses += 1
+      return None
+    if sha1 not in self.__verified:
+      if hashlib.sha1(data.tostring()).hexdigest() != sha1:
+        del data
+        self.__drop(sha1)
+        self.misses += 1
+        return None
+      self.__verified.add(sha1)
+    os.utime(path, None)
+    self.hits += 1
+    return self.__entries[sha1][0], data
+
+  def put(self, sha1, data, op_vid):
+    """
+    Store data, a one dimensional array, under sha1. Nothing is
+    stored, and False is returned, if sha1 is not the digest of
+    data's bytes or data does not fit in the cache.
+    """
+    with self.__lock:
+      return self.__put(sha1, data, op_vid)
+
+  def __put(self, sha1, data, op_vid):
+    data = np.ascontiguousarray(data)
+    if data.nbytes > self.max_size:
+      return False
+    if hashlib.sha1(data.tostring()).hexdigest() != sha1:
+      return False
+    if sha1 in self.__entries:
+      return True
+    self.__entries[sha1] = (op_vid, 0)
+    path = self.__path(sha1)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+      np.save(f, data)
+    os.rename(tmp_path, path)
+    self.__entries[sha1] = (op_vid, os.path.getsize(path))
+    self.__verified.add(sha1)
+    self.__evict(keep=sha1)
+    return True
+
+  def __evict(self, keep=None):
+    total = self.size
+    if total <= self.max_size:
+      return
+    by_age = []
+    for sha1 in self.__entries:
+      if sha1 != keep:
+        try:
+          by_age.append((os.path.getmtime(self.__path(sha1)), sha1))
+        except OSError:
+          by_age.append((0, sha1))
+    by_age.sort()
+    for _, sha1 in by_age:
+      if total <= self.max_size:
+        break
+      total -= self.__entries[sha1][1]
+      self.__drop(sha1)
+
+  def clear(self):
+    with self.__lock:
+      for sha1 in self.__entries.keys():
+        self.__drop(sha1)
+
+  @property
+  def hit_ratio(self):
+    n = self.hits + self.misses
+    return float(self.hits) / n if n else 0.0
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_ratio': self.hit_ratio,
+      'entries': len(self),
+      'size': self.size,
+      'max_size': self.max_size,
+      }
@@ -38,15 +38,26 @@ site: AA, AB and BB.
 
 import bl.vl.utils as vlu
 from bl.vl.kb import mimetypes
+from bl.vl.genotype import algo
 import variant_call_support
 import wrapper as wp
+from gdo_cache import GdoCache, DEFAULT_GDO_CACHE_SIZE
+from markers_index import MarkersIndex
 from proxy_core import convert_from_numpy
 from utils import assign_vid, make_unique_key
 
+import os, tempfile
 import numpy as np
+import itertools as it
 import hashlib
+from multiprocessing.pool import ThreadPool
 
 BATCH_SIZE = 5000
+GDO_BATCH_SIZE = 10
+SAMPLE_IDS_BATCH_SIZE = 1000
+MARKERS_INDEX_DIR_ENV = 'OMERO_BIOBANK_MARKERS_INDEX_DIR'
+DEFAULT_MARKERS_INDEX_DIR = os.path.join('~', '.omero_biobank', 'markers')
+MATERIALIZE_THREADS = 4
 VID_SIZE = vlu.DEFAULT_VID_LEN
 
 MARKER_LABEL_SIZE = 128
@@ -83,7 +94,116 @@ def GDO_TABLE_COLS(N):
       ]
     return cols
 
-MA_TABLES = frozenset([MSET_TABLE_NAME, GDO_TABLE_NAME])
+# Optional marker blocked companion of the gdo table: row
+# r * n_blocks + b holds markers [b * B, (b + 1) * B) of gdo row r, the
+# last block is padded with nan.  It covers the first nrows / n_blocks
+# rows of the gdo table.
+GDO_BLOCKS_TABLE_NAME = 'gdob'
+GDO_BLOCK_SIZE = 1024
+# blocks are read only if they cover less than this fraction of a row
+GDO_BLOCKS_MAX_FRACTION = 0.5
+def GDO_BLOCKS_TABLE_COLS(B):
+    cols = [
+      ('string', 'vid', 'gdo VID', VID_SIZE, None),
+      ('string', 'op_vid', 'Last operation that modified this row',
+       VID_SIZE, None),
+      ('float_array', 'probs', 'np.zeros((2,B), dtype=np.float32)',
+       2*B, None),
+      ('float_array', 'confidence', 'np.zeros((B,), dtype=np.float32)',
+       B, None),
+      ]
+    return cols
+
+# Quantized gdo tables: probabilities and confidence values in [0, 1]
+# are stored as unsigned integers with a fixed scale, the largest
+# value is reserved for nan.  Since omero tables have no small integer
+# columns, values are packed, little endian, into long arrays.
+GDO_ENCODINGS = {
+    'uint8': ('gdoq8', np.uint8),
+    'uint16': ('gdoq16', np.uint16),
+    }
+def GDO_QTABLE_COLS(N, encoding):
+    k = 8 // np.dtype(GDO_ENCODINGS[encoding][1]).itemsize
+    cols = [
+      ('string', 'vid', 'gdo VID', VID_SIZE, None),
+      ('string', 'op_vid', 'Last operation that modified this row',
+       VID_SIZE, None),
+      ('long_array', 'probs', '2*N %s values, packed' % encoding,
+       (2*N + k - 1) // k, None),
+      ('long_array', 'confidence', 'N %s values, packed' % encoding,
+       (N + k - 1) // k, None),
+      ]
+    return cols
+
+# Running per marker statistics over all the gdos of a markers set,
+# see algo.GenotypeStats: each action that adds gdos accumulates, in
+# place, into its own row (identified by op_vid), and rows are summed
+# when read.  All rows share the same confidence threshold.
+MARKER_STATS_TABLE_NAME = 'mstats'
+CALL_CONFIDENCE_THRESHOLD = algo.CALL_CONFIDENCE_THRESHOLD
+MARKER_STATS_SUMS = ['n_samples', 'sum_AA', 'sum_BB', 'n_valid', 'n_called']
+def MARKER_STATS_TABLE_COLS(N):
+    cols = [
+      ('string', 'op_vid', 'action whose gdos are summed in this row',
+       VID_SIZE, None),
+      ('long', 'n_samples', 'number of gdos', None),
+      ('double', 'threshold', 'confidence threshold', None),
+      ('double_array', 'sum_AA', 'sum of AA probabilities', N, None),
+      ('double_array', 'sum_BB', 'sum of BB probabilities', N, None),
+      ('long_array', 'n_valid', 'number of non NaN probabilities', N,
+       None),
+      ('long_array', 'n_called', 'number of confidence <= threshold', N,
+       None),
+      ]
+    return cols
+
+QUERIES = [
+  ('data_objects_by_sample_ids',
+   """select do
+   from DataObject do
+   join fetch do.sample as s
+   where s.id in (:ids)
+   """, {'ids': [wp.LONG]}),
+  ]
+
+MA_TABLES = frozenset([MSET_TABLE_NAME, GDO_TABLE_NAME,
+                       GDO_BLOCKS_TABLE_NAME, MARKER_STATS_TABLE_NAME] +
+                      [t for t, _ in GDO_ENCODINGS.itervalues()])
+
+
+def encode_gdo_values(x, encoding):
+    """
+    Quantize x, an array of values in [0, 1] (or nan), according to
+    encoding and pack the result, along the last axis, into int64.
+    """
+    dtype = np.dtype(GDO_ENCODINGS[encoding][1]).newbyteorder('<')
+    top = np.iinfo(dtype).max
+    x = np.asarray(x, dtype=np.float32)
+    nans = np.isnan(x)
+    q = np.rint(np.clip(np.where(nans, 0, x), 0, 1) * (top - 1))
+    q = q.astype(dtype)
+    q[nans] = top
+    k = 8 // dtype.itemsize
+    n = x.shape[-1]
+    buf = np.zeros(x.shape[:-1] + ((n + k - 1) // k * k,), dtype=dtype)
+    buf[..., :n] = q
+    return buf.view('<i8')
+
+
+def decode_gdo_values(packed, encoding, n, indices=None):
+    """
+    Inverse of :func:`encode_gdo_values`: return, as float32, the
+    first n values (restricted to indices, if given) packed in packed.
+    """
+    dtype = np.dtype(GDO_ENCODINGS[encoding][1]).newbyteorder('<')
+    top = np.iinfo(dtype).max
+    q = np.ascontiguousarray(packed, dtype='<i8').view(dtype)[..., :n]
+    if indices is not None:
+        q = q[..., indices]
+    x = q.astype(np.float32) / (top - 1)
+    x[q == top] = np.nan
+    return x
+
 
 class GenomicsAdapter(object):
     """
@@ -94,6 +214,35 @@ class GenomicsAdapter(object):
 
     def __init__(self, kb):
         self.kb = kb
+        self.gdo_cache = None
+        self.markers_indices = {}
+        self.marker_stats_thresholds = {}
+        self.marker_stats_rows = {}
+        for name, hql, params in QUERIES:
+            self.kb.queries.register(name, hql, params)
+
+    def enable_gdo_cache(self, root, max_size=DEFAULT_GDO_CACHE_SIZE):
+        """
+        Keep a local copy, in directory root, of the gdo rows read
+        through :meth:`get_gdo`, :meth:`get_gdo_iterator` (with
+        data_samples) and GenotypeDataSample.resolve_to_data, keyed
+        by the sha1 of their DataObject; see :class:`gdo_cache.GdoCache`.
+
+        The cache can also be enabled by setting the
+        OMERO_BIOBANK_GDO_CACHE_DIR environment variable.
+        """
+        self.gdo_cache = GdoCache(root, max_size)
+        return self.gdo_cache
+
+    def disable_gdo_cache(self):
+        self.gdo_cache = None
+
+    def get_gdo_cache_stats(self):
+        """
+        Return a dict with hits, misses, hit_ratio, entries, size and
+        max_size of the gdo cache, or None if the cache is not enabled.
+        """
+        return None if self.gdo_cache is None else self.gdo_cache.stats()
 
     def create_markers_array(self, label, maker, model, release, rows, 
                              action):
@@ -121,6 +270,8 @@ class GenomicsAdapter(object):
         #FIXME we are actually considering only SNP gdo.
         self._create_markers_array_table(GDO_TABLE_NAME, GDO_TABLE_COLS(N),
                                          marray.id)
+        self._write_marker_stats(
+            marray.id, avid, algo.GenotypeStats(N, CALL_CONFIDENCE_THRESHOLD))
         return marray
 
     def get_markers_array(self, label=None,
@@ -155,6 +306,23 @@ class GenomicsAdapter(object):
                                                  col_names=col_names,
                                                  batch_size=batch_size)
 
+    def get_markers_index(self, marray, verify=True, refresh=False):
+        """
+        Return the local :class:`markers_index.MarkersIndex` of
+        marray, building or rebuilding it if needed.  Indices are
+        kept under $OMERO_BIOBANK_MARKERS_INDEX_DIR, or
+        ~/.omero_biobank/markers, and checked against the mset table
+        the first time they are used by this adapter, or whenever
+        refresh is True.  If verify is False, only the number of rows
+        is checked, not the op_vid column.
+        """
+        if refresh or marray.id not in self.markers_indices:
+            root = os.path.expanduser(os.getenv(MARKERS_INDEX_DIR_ENV,
+                                                DEFAULT_MARKERS_INDEX_DIR))
+            self.markers_indices[marray.id] = MarkersIndex(self, marray, root,
+                                                           verify)
+        return self.markers_indices[marray.id]
+
     def get_number_of_markers(self, marray):
         "get the number of markers listed by marray"
         table_name = self._markers_array_table_name(MSET_TABLE_NAME, marray.id)
@@ -165,8 +333,8 @@ class GenomicsAdapter(object):
             table_name = self._markers_array_table_name(table, marray_id)
             self.kb.delete_table(table_name)
 
-    def make_gdo_path(self, marray, vid, index):
-        table_name = self._markers_array_table_name(GDO_TABLE_NAME, marray.id)
+    def make_gdo_path(self, marray, vid, index, encoding=None):
+        table_name = self._gdo_table_name(marray.id, encoding)
         return 'table:%s/vid=%s/row_index=%d' % (table_name, vid, index)
 
     def parse_gdo_path(self, path):
@@ -177,7 +345,33 @@ class GenomicsAdapter(object):
         index = int(index[len('row_index='):])
         return set_vid, vid, index
 
-    def add_gdo(self, set_vid, probs, confidence, op_vid):
+    def get_gdo_encoding(self, path):
+        """
+        Return the encoding, e.g., 'uint8', of the gdo at path, or
+        None for plain float32 gdos.
+        """
+        head = path.split('/', 1)[0][len('table:'):]
+        tag, _ = self._markers_array_table_name_parse(head)
+        for encoding, (t, _) in GDO_ENCODINGS.iteritems():
+            if t == tag:
+                return encoding
+        return None
+
+    def add_gdo(self, set_vid, probs, confidence, op_vid, encoding=None):
+        if encoding is not None:
+            table_name = self._get_gdo_qtable(set_vid, encoding)
+            row = {'op_vid': op_vid,
+                   'probs': encode_gdo_values(probs.ravel(),
+                                              encoding).tolist(),
+                   'confidence': encode_gdo_values(confidence,
+                                                   encoding).tolist()}
+            assign_vid(row)
+            row_indices = self.kb.add_table_row(table_name, row)
+            assert len(row_indices) == 1
+            self._update_marker_stats(set_vid, op_vid,
+                                      probs.reshape(1, 2, -1),
+                                      confidence[np.newaxis])
+            return row['vid'], row_indices[0]
         probs.shape = probs.size
         table_name = self._markers_array_table_name(GDO_TABLE_NAME, set_vid)
         row = {'op_vid': op_vid, 'probs': probs, 'confidence': confidence}
@@ -185,9 +379,15 @@ class GenomicsAdapter(object):
         row_indices = self.kb.add_table_row(table_name, row)
         assert len(row_indices) == 1
         probs.shape = (2, probs.size/2)
+        self._extend_gdo_blocks(set_vid, row_indices[0], [row['vid']],
+                                [op_vid], probs[np.newaxis],
+                                confidence[np.newaxis])
+        self._update_marker_stats(set_vid, op_vid, probs[np.newaxis],
+                                  confidence[np.newaxis])
         return row['vid'], row_indices[0]
 
-    def add_gdo_data_object(self, action, sample, probs, confs):
+    def add_gdo_data_object(self, action, sample, probs, confs,
+                            encoding=None):
         """
         Syntactic sugar to simplify adding genotype data objects.
 
@@ -199,62 +399,422 @@ class GenomicsAdapter(object):
           probabilities.
         :type probs: numpy.darray
 
+        :param encoding: if not None, one of the keys of GDO_ENCODINGS,
+          e.g., 'uint8': data is quantized and stored with the
+          mimetypes.GDO_QTABLE mimetype.
+        :type encoding: str
+
         """
         avid = self.kb.resolve_action_id(action)
         if not isinstance(sample, self.kb.GenotypeDataSample):
           raise ValueError('sample should be an instance of GenotypeDataSample')
         mset = sample.snpMarkersSet
         # FIXME doesn't check that probs and confs have the right dtype and size
-        gdo_vid, row_index = self.add_gdo(mset.id, probs, confs, avid)
+        gdo_vid, row_index = self.add_gdo(mset.id, probs, confs, avid,
+                                          encoding)
+        if encoding is not None:
+            probs = encode_gdo_values(probs.ravel(), encoding)
+            confs = encode_gdo_values(confs, encoding)
         size = 0
         sha1 = hashlib.sha1()
         s = probs.tostring();  size += len(s) ; sha1.update(s)
         s = confs.tostring();  size += len(s) ; sha1.update(s)
         conf = {
           'sample': sample,
-          'path': self.make_gdo_path(mset, gdo_vid, row_index),
-          'mimetype': mimetypes.GDO_TABLE,
+          'path': self.make_gdo_path(mset, gdo_vid, row_index, encoding),
+          'mimetype': (mimetypes.GDO_TABLE if encoding is None
+                       else mimetypes.GDO_QTABLE),
           'sha1': sha1.hexdigest(),
           'size': size,
           }
         gds = self.kb.factory.create(self.kb.DataObject, conf).save()
         return gds
 
-    def get_gdo(self, mset, vid, row_index, indices=None):
-        table_name = self._markers_array_table_name(GDO_TABLE_NAME, mset.id)
+    def add_gdos(self, action, samples, probs_block, confs_block,
+                 batch_size=GDO_BATCH_SIZE, encoding=None):
+        """
+        Bulk version of :meth:`add_gdo_data_object`.
+
+        Append one gdo row for each sample, batch_size rows at a
+        time, and save all the corresponding DataObject(s) with a
+        single call.
+
+        :param samples: GenotypeDataSample(s), all on the same
+          SNPMarkersSet
+        :type samples: list
+
+        :param probs_block: a <nsamples>x2x<nmarkers> array with the
+          AA and the BB homozygous probabilities.
+        :type probs_block: numpy.darray
+
+        :param confs_block: a <nsamples>x<nmarkers> array with the
+          confidence on the above probabilities.
+        :type confs_block: numpy.darray
+
+        :param encoding: see :meth:`add_gdo_data_object`
+        :type encoding: str
+
+        :type return: list of DataObject, one for each sample
+        """
+        avid = self.kb.resolve_action_id(action)
+        if not samples:
+            return []
+        for sample in samples:
+            if not isinstance(sample, self.kb.GenotypeDataSample):
+                raise ValueError(
+                    'samples should be instances of GenotypeDataSample')
+        mset = samples[0].snpMarkersSet
+        for sample in samples[1:]:
+            if sample.snpMarkersSet != mset:
+                raise ValueError('data_sample %s snpMarkersSet != %s' %
+                                 (sample.id, mset.id))
+        probs_block = np.ascontiguousarray(probs_block, dtype=np.float32)
+        confs_block = np.ascontiguousarray(confs_block, dtype=np.float32)
+        S = len(samples)
+        N = self.get_number_of_markers(mset)
+        if probs_block.shape != (S, 2, N):
+            raise ValueError('probs_block shape should be %r' % ((S, 2, N),))
+        if confs_block.shape != (S, N):
+            raise ValueError('confs_block shape should be %r' % ((S, N),))
+        vids = [vlu.make_vid() for _ in xrange(S)]
+        digests = []
+        def batches():
+            for i in xrange(0, S, batch_size):
+                j = min(S, i + batch_size)
+                probs = probs_block[i:j].reshape(j - i, 2 * N)
+                confs = confs_block[i:j]
+                if encoding is not None:
+                    probs = encode_gdo_values(probs, encoding)
+                    confs = encode_gdo_values(confs, encoding)
+                for p, c in it.izip(probs, confs):
+                    sha1 = hashlib.sha1(p.tostring())
+                    sha1.update(c.tostring())
+                    digests.append((sha1.hexdigest(), p.nbytes + c.nbytes))
+                if encoding is not None:
+                    probs, confs = probs.tolist(), confs.tolist()
+                yield {'vid': vids[i:j], 'op_vid': [avid] * (j - i),
+                       'probs': list(probs), 'confidence': list(confs)}
+        if encoding is None:
+            table_name = self._markers_array_table_name(GDO_TABLE_NAME,
+                                                        mset.id)
+            mimetype = mimetypes.GDO_TABLE
+        else:
+            table_name = self._get_gdo_qtable(mset.id, encoding)
+            mimetype = mimetypes.GDO_QTABLE
+        row_indices = self.kb.add_table_columns_from_stream(table_name,
+                                                            batches())
+        assert len(row_indices) == S
+        if encoding is None:
+            self._extend_gdo_blocks(mset.id, row_indices[0], vids,
+                                    [avid] * S, probs_block, confs_block,
+                                    batch_size)
+        self._update_marker_stats(mset.id, avid, probs_block, confs_block)
+        data_objects = []
+        for sample, vid, row_index, (sha1, size) in it.izip(
+            samples, vids, row_indices, digests
+            ):
+            conf = {
+                'sample': sample,
+                'path': self.make_gdo_path(mset, vid, row_index, encoding),
+                'mimetype': mimetype,
+                'sha1': sha1,
+                'size': size,
+                }
+            data_objects.append(self.kb.factory.create(self.kb.DataObject,
+                                                       conf))
+        return self.kb.save_array(data_objects)
+
+    def get_gdo(self, mset, vid, row_index, indices=None, encoding=None,
+                sha1=None):
+        """
+        Read a single gdo.  If sha1, the one of the gdo DataObject, is
+        given, the gdo cache, if enabled, is checked first.
+        """
+        n_markers = None
+        if encoding is not None:
+            n_markers = self.get_number_of_markers(mset)
+        ref = (mset.id, vid, row_index, encoding, sha1)
+        gdo = self._get_cached_gdo(ref, indices, n_markers)
+        if gdo is not None:
+            return gdo
+        table_name = self._gdo_table_name(mset.id, encoding)
         rows = self.kb.get_table_rows_by_indices(table_name, [row_index])
         assert len(rows) == 1
         assert rows[0]['vid'] == vid
-        return self._unwrap_gdo(rows[0], indices)
+        self._cache_gdo(ref, rows[0])
+        return self._unwrap_gdo(rows[0], indices, encoding, n_markers)
 
     #FIXME this is the basic object, we should have some support for selections
     def get_gdo_iterator(self, mset, data_samples=None, indices = None,
-                         batch_size=100):
-        def get_gdo_iterator_on_list(dos):
-            seen_data_samples = set([])
-            for do in dos:
-                # FIXME we could, in principle, handle other mimetypes too
-                if do.mimetype == mimetypes.GDO_TABLE:
-                    self.kb.logger.debug(do.path)
-                    mset_vid, vid, row_index = self.parse_gdo_path(do.path)
-                    self.kb.logger.debug('%r' % [vid, row_index])
-                    if mset_vid != mset.id:
-                        raise ValueError(
-                            'DataObject %s map to data with a wrong SNPMarkersSet' 
-                            % do.path
-                        )
-                    yield self.get_gdo(mset, vid, row_index, indices)
-                else:
-                    pass
+                         batch_size=100, encoding=None):
+        """
+        Iterate over the gdos of mset.  If data_samples is given, only
+        the gdos of those samples are returned, in the same order as
+        data_samples; rows are read from the gdo table batch_size at
+        a time.  Otherwise, all rows of the gdo table with the given
+        encoding are returned.
+        """
         if data_samples is None:
-            return self._get_gdo_iterator(mset.id, indices, batch_size)
+            return self._get_gdo_iterator(mset.id, indices, batch_size,
+                                          encoding)
+        refs = [r for _, r in self._get_gdo_refs(mset, data_samples)]
+        return self._get_gdos_by_refs(refs, indices, batch_size)
+
+    def resolve_many(self, data_samples, indices=None, batch_size=100):
+        """
+        Bulk version of GenotypeDataSample.resolve_to_data: yield a
+        (data_sample, probs, confidence) tuple for each sample in
+        data_samples, in the same order.  data_samples can be on
+        different SNPMarkersSet(s).  Data samples without a gdo are
+        skipped, for those with more than one only the first is used.
+        """
         for d in data_samples:
-            if d.snpMarkersSet != mset:
-                raise ValueError('data_sample %s snpMarkersSet != mset' % d.id)
-        ids = ','.join('%s' % ds.omero_id for ds in data_samples)
-        query = 'from DataObject do where do.sample.id in (%s)' % ids
-        dos = self.kb.find_all_by_query(query, None)
-        return get_gdo_iterator_on_list(dos)
+            if not isinstance(d, self.kb.GenotypeDataSample):
+                raise ValueError(
+                    'data_samples should be instances of GenotypeDataSample')
+        samples, refs = [], []
+        for sample, ref in self._get_gdo_refs(None, data_samples):
+            if not samples or samples[-1] is not sample:
+                samples.append(sample)
+                refs.append(ref)
+        gdos = self._get_gdos_by_refs(refs, indices, batch_size)
+        for sample, gdo in it.izip(samples, gdos):
+            yield sample, gdo['probs'], gdo['confidence']
+
+    def materialize(self, mset, data_samples, indices=None, out=None,
+                    batch_size=100, n_threads=MATERIALIZE_THREADS):
+        """
+        Fetch the gdos of data_samples into on disk arrays.
+
+        Gdos are read batch_size at a time, by n_threads concurrent
+        threads, into two .npy files, <out>-probs.npy, a float32
+        <nsamples>x2x<nmarkers> array, and <out>-confidence.npy, a
+        float32 <nsamples>x<nmarkers> array, with nmarkers restricted
+        to indices, if given.  Rows follow the order of data_samples;
+        samples without a gdo are skipped, and the vids of the
+        remaining ones are saved in <out>-samples.npy.  If out is
+        None, files are written to a new temporary directory.
+
+        :type return: tuple (probs, confidence, sample_index), where
+          the first two are read-write memory maps and sample_index
+          maps data sample vids to row indices
+        """
+        refs = []
+        seen = set()
+        for sample, ref in self._get_gdo_refs(mset, data_samples):
+            if sample.id not in seen:
+                seen.add(sample.id)
+                refs.append((sample.id, ref))
+        markers = np.arange(self.get_number_of_markers(mset))
+        n_markers = len(markers if indices is None else markers[indices])
+        if out is None:
+            out = os.path.join(tempfile.mkdtemp(prefix='gdo-'), mset.id)
+        open_memmap = np.lib.format.open_memmap
+        probs = open_memmap('%s-probs.npy' % out, mode='w+',
+                            dtype=np.float32, shape=(len(refs), 2, n_markers))
+        confs = open_memmap('%s-confidence.npy' % out, mode='w+',
+                            dtype=np.float32, shape=(len(refs), n_markers))
+        vids = np.array([v for v, _ in refs], dtype='|S%d' % VID_SIZE)
+        np.save('%s-samples.npy' % out, vids)
+        def fetch(start):
+            chunk = [r for _, r in refs[start:start + batch_size]]
+            for i, gdo in enumerate(self._get_gdos_by_refs(chunk, indices,
+                                                           batch_size)):
+                probs[start + i] = gdo['probs']
+                confs[start + i] = gdo['confidence']
+        starts = range(0, len(refs), batch_size)
+        if n_threads > 1 and len(starts) > 1:
+            self.kb.connect()
+            pool = ThreadPool(min(n_threads, len(starts)))
+            try:
+                pool.map(fetch, starts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for start in starts:
+                fetch(start)
+        probs.flush()
+        confs.flush()
+        return probs, confs, dict((v, i) for i, v in enumerate(vids))
+
+    def build_gdo_blocks(self, mset, block_size=GDO_BLOCK_SIZE,
+                         batch_size=GDO_BATCH_SIZE):
+        """
+        (Re)build the marker blocked copy of the gdo table of mset.
+
+        Once built, the copy is kept up to date by :meth:`add_gdo` and
+        :meth:`add_gdos`, and it is used by the gdo readers whenever
+        the requested marker indices fall in a small enough fraction
+        of the blocks.  It has to be rebuilt if gdo rows are modified
+        in place.
+        """
+        gdo_table = self._markers_array_table_name(GDO_TABLE_NAME, mset.id)
+        blocks_table = self._markers_array_table_name(GDO_BLOCKS_TABLE_NAME,
+                                                      mset.id)
+        self.kb.delete_table(blocks_table)
+        self.kb.create_table(blocks_table, GDO_BLOCKS_TABLE_COLS(block_size))
+        N = self.get_number_of_markers(mset)
+        n_rows = self.kb.get_number_of_rows(gdo_table)
+        def batches():
+            for i in xrange(0, n_rows, batch_size):
+                rows = self.kb.get_table_slice(
+                    gdo_table, range(i, min(n_rows, i + batch_size)),
+                    batch_size=batch_size)
+                probs = rows['probs'].reshape(len(rows), 2, N)
+                yield self._gdo_rows_to_blocks(rows['vid'], rows['op_vid'],
+                                               probs, rows['confidence'],
+                                               block_size)
+        self.kb.add_table_columns_from_stream(blocks_table, batches())
+
+    def drop_gdo_blocks(self, mset):
+        "Remove the marker blocked copy of the gdo table of mset"
+        self.kb.delete_table(
+            self._markers_array_table_name(GDO_BLOCKS_TABLE_NAME, mset.id))
+
+    def get_marker_stats(self, mset):
+        """
+        Return the running statistics of the gdos of mset, as a dict
+        with keys n_samples, threshold, sum_AA and sum_BB (per marker
+        sums of the AA and BB probabilities), n_valid (per marker
+        number of gdos with no NaN probabilities, the ones that
+        contribute to the sums) and n_called (per marker number of
+        gdos with confidence <= threshold), or None if mset has no
+        statistics table (see :meth:`recompute_marker_stats`).
+
+        The statistics are kept up to date by :meth:`add_gdo` and
+        :meth:`add_gdos`, with one row per action, read, added to and
+        written back without locking: concurrent loaders that use
+        different actions do not interfere, while concurrent loaders
+        that share an action may lose increments, making the
+        statistics approximate until :meth:`recompute_marker_stats`
+        is called.
+        """
+        table_name = self._markers_array_table_name(MARKER_STATS_TABLE_NAME,
+                                                    mset.id)
+        if not self.kb.table_exists(table_name):
+            return None
+        rows = self.kb.get_table_slice(
+            table_name, range(self.kb.get_number_of_rows(table_name)))
+        stats = dict((k, rows[k].sum(axis=0)) for k in MARKER_STATS_SUMS)
+        stats['n_samples'] = int(stats['n_samples'])
+        stats['threshold'] = float(rows['threshold'][0])
+        return stats
+
+    def get_marker_qc(self, mset):
+        """
+        Return a dict with the per marker maf, hwe and call_rate of
+        the gdos of mset, computed from :meth:`get_marker_stats`, or
+        None if mset has no statistics or no gdos.  Values are the
+        ones computed by :class:`bl.vl.genotype.algo.GenotypeStats`
+        on the same gdos, e.g., by ``algo.reduce_genotypes``.
+        """
+        stats = self.get_marker_stats(mset)
+        if stats is None or stats['n_samples'] == 0:
+            return None
+        stats = self._genotype_stats(stats)
+        return {'maf': stats.maf(), 'hwe': stats.hwe(),
+                'call_rate': stats.call_rate()}
+
+    def recompute_marker_stats(self, mset, action,
+                               threshold=CALL_CONFIDENCE_THRESHOLD,
+                               batch_size=100):
+        """
+        Rebuild the statistics table of mset, see
+        :meth:`get_marker_stats`, from all the gdos referred by a
+        DataObject, reading them batch_size at a time.  The
+        confidence threshold can be changed only this way.
+        """
+        avid = self.kb.resolve_action_id(action)
+        N = self.get_number_of_markers(mset)
+        tables = [(mimetypes.GDO_TABLE, self._gdo_table_name(mset.id))] + [
+            (mimetypes.GDO_QTABLE, self._gdo_table_name(mset.id, e))
+            for e in GDO_ENCODINGS]
+        query = """from DataObject do
+                   where do.mimetype = :mimetype and do.path like :prefix
+                   order by do.id"""
+        refs = []
+        for mimetype, table_name in tables:
+            params = {'mimetype': mimetype,
+                      'prefix': 'table:%s/%%' % table_name}
+            for do in self.kb.iter_query(query, params):
+                _, vid, row_index = self.parse_gdo_path(do.path)
+                refs.append((mset.id, vid, row_index,
+                             self.get_gdo_encoding(do.path), do.sha1))
+        totals = algo.GenotypeStats(N, threshold)
+        probs= np.empty((batch_size, 2, N), dtype=np.float32)
+        confs = np.empty((batch_size, N), dtype=np.float32)
+        for i in xrange(0, len(refs), batch_size):
+            chunk = refs[i:i + batch_size]
+            gdos = self._get_gdos_by_refs(chunk, batch_size=batch_size)
+            for j, gdo in enumerate(gdos):
+                probs[j] = gdo['probs']
+                confs[j] = gdo['confidence']
+            totals.update(probs[:len(chunk)], confs[:len(chunk)])
+        self._write_marker_stats(mset.id, avid, totals)
+        return self.get_marker_stats(mset)
+
+    def drop_marker_stats(self, mset):
+        "Remove the statistics table of mset"
+        self.kb.delete_table(
+            self._markers_array_table_name(MARKER_STATS_TABLE_NAME, mset.id))
+        self.marker_stats_thresholds[mset.id] = None
+        for k in [k for k in self.marker_stats_rows if k[0] == mset.id]:
+            del self.marker_stats_rows[k]
+
+    def quantize_gdos(self, mset, encoding, batch_size=GDO_BATCH_SIZE):
+        """
+        Re-encode, with the given encoding, all float32 gdos of mset
+        that are still referred by a DataObject, and move the
+        DataObject(s) to the new rows.  The original gdo table is left
+        untouched.  Return the number of migrated DataObject(s).
+        """
+        if encoding not in GDO_ENCODINGS:
+            raise ValueError('unknown encoding %s' % encoding)
+        gdo_table = self._markers_array_table_name(GDO_TABLE_NAME, mset.id)
+        query = """from DataObject do
+                   where do.mimetype = :mimetype and do.path like :prefix
+                   order by do.id"""
+        params = {'mimetype': mimetypes.GDO_TABLE,
+                  'prefix': 'table:%s/%%' % gdo_table}
+        refs = sorted((self.parse_gdo_path(do.path)[2], do)
+                      for do in self.kb.iter_query(query, params))
+        if not refs:
+            return 0
+        migrated = []
+        def batches():
+            for i in xrange(0, len(refs), batch_size):
+                chunk = refs[i:i + batch_size]
+                rows = self.kb.get_table_slice(gdo_table,
+                                               [r for r, _ in chunk],
+                                               batch_size=len(chunk))
+                probs = encode_gdo_values(rows['probs'], encoding)
+                confs = encode_gdo_values(rows['confidence'], encoding)
+                for (_, do), vid, p, c in it.izip(chunk, rows['vid'],
+                                                  probs, confs):
+                    if self.parse_gdo_path(do.path)[1] != vid:
+                        raise ValueError('%s: inconsistent vid' % do.path)
+                    sha1 = hashlib.sha1(p.tostring())
+                    sha1.update(c.tostring())
+                    migrated.append((do, vid, sha1.hexdigest(),
+                                     p.nbytes + c.nbytes))
+                yield {'vid': list(rows['vid']),
+                       'op_vid': list(rows['op_vid']),
+                       'probs': probs.tolist(),
+                       'confidence': confs.tolist()}
+        row_indices = self.kb.add_table_columns_from_stream(
+            self._get_gdo_qtable(mset.id, encoding), batches())
+        dos = []
+        for (do, vid, sha1, size), row_index in it.izip(migrated,
+                                                        row_indices):
+            do.path = self.make_gdo_path(mset, vid, row_index, encoding)
+            do.mimetype = mimetypes.GDO_QTABLE
+            do.sha1 = sha1
+            do.size = size
+            dos.append(do)
+        for i in xrange(0, len(dos), BATCH_SIZE):
+            self.kb.save_array(dos[i:i + BATCH_SIZE])
+        return len(dos)
 
     def get_genotype_data_samples(self, individual, markers_set):
         """
@@ -275,21 +835,39 @@ class GenomicsAdapter(object):
                 if d.snpMarkersSet == markers_set)
 
 
-    def register_vcs(self, vcs):
-        "Save vcs in kb"
-        variant_call_support.register_vcs(self.kb, vcs)
+    def register_vcs(self, vcs, mimetype=None):
+        """
+        Save vcs in kb, see :func:`variant_call_support.register_vcs`
+        """
+        variant_call_support.register_vcs(self.kb, vcs, mimetype)
+
+    def convert_vcs_storage(self, vcs, mimetype=mimetypes.VCS_CHUNKS):
+        """
+        Rewrite vcs data as mimetype, see
+        :func:`variant_call_support.convert_vcs_storage`
+        """
+        return variant_call_support.convert_vcs_storage(self.kb, vcs,
+                                                        mimetype)
 
     def delete_vcs(self, vcs):
         "Delete vcs from kb"        
         variant_call_support.delete_vcs(self.kb, vcs)
         
-    def get_vcs_by_label(self, label):
-        "Retrieve vcs with label label from kb"                
-        return variant_call_support.get_vcs_by_label(self.kb, label)
-        
-    def get_vcs_by_vid(self, vid):
-        "Retrieve vcs with vid vid from kb"                        
-        return variant_call_support.get_vcs_by_vid(self.kb, vid)
+    def get_vcs_by_label(self, label, region=None, fields=None):
+        """
+        Retrieve vcs with label label from kb, see
+        :func:`variant_call_support.get_vcs_by_label`
+        """
+        return variant_call_support.get_vcs_by_label(self.kb, label,
+                                                     region, fields)
+
+    def get_vcs_by_vid(self, vid, region=None, fields=None):
+        """
+        Retrieve vcs with vid vid from kb, see
+        :func:`variant_call_support.get_vcs_by_vid`
+        """
+        return variant_call_support.get_vcs_by_vid(self.kb, vid,
+                                                   region, fields)
 
     def create_vcs(self, marray, reference_genome, positions, action):
         """
@@ -334,8 +912,32 @@ class GenomicsAdapter(object):
         return self.kb.add_table_rows_from_stream(table_name, 
                                                   add_op_vid(stream),
                                                   batch_size)
-    def _unwrap_gdo(self, row, indices):
+    def _gdo_table_name(self, set_vid, encoding=None):
+        if encoding is None:
+            return self._markers_array_table_name(GDO_TABLE_NAME, set_vid)
+        if encoding not in GDO_ENCODINGS:
+            raise ValueError('unknown encoding %s' % encoding)
+        return self._markers_array_table_name(GDO_ENCODINGS[encoding][0],
+                                              set_vid)
+
+    def _get_gdo_qtable(self, set_vid, encoding):
+        "Return the name of the quantized gdo table, creating it if needed"
+        table_name = self._gdo_table_name(set_vid, encoding)
+        if not self.kb.table_exists(table_name):
+            N = self.kb.get_number_of_rows(
+                self._markers_array_table_name(MSET_TABLE_NAME, set_vid))
+            self.kb.create_table(table_name, GDO_QTABLE_COLS(N, encoding))
+        return table_name
+
+    def _unwrap_gdo(self, row, indices, encoding=None, n_markers=None):
         r = {'vid': row['vid'], 'op_vid': row['op_vid']}
+        if encoding is not None:
+            p = decode_gdo_values(row['probs'], encoding, 2 * n_markers)
+            p.shape = (2, n_markers)
+            r['probs'] = p[:, indices] if indices is not None else p
+            r['confidence'] = decode_gdo_values(row['confidence'], encoding,
+                                                n_markers, indices)
+            return r
         p = row['probs']
         p.shape = (2, p.size/2)
         r['probs'] = p[:, indices] if indices is not None else p
@@ -343,11 +945,377 @@ class GenomicsAdapter(object):
         r['confidence'] = c[indices] if indices is not None else c
         return r
 
-    def _get_gdo_iterator(self, set_vid, indices=None, batch_size=100):
-        def iterator(stream):
+    def _get_gdo_blocks_layout(self, set_vid):
+        table_name = self._markers_array_table_name(GDO_BLOCKS_TABLE_NAME,
+                                                    set_vid)
+        if not self.kb.table_exists(table_name):
+            return None
+        headers = dict(self.kb.get_table_headers(table_name))
+        block_size = np.dtype(headers['confidence']).shape[0]
+        n_markers = self.kb.get_number_of_rows(
+            self._markers_array_table_name(MSET_TABLE_NAME, set_vid))
+        n_blocks = (n_markers + block_size - 1) // block_size
+        return {'table_name': table_name,
+                'block_size': block_size,
+                'n_markers': n_markers,
+                'n_blocks': n_blocks,
+                'coverage': self.kb.get_number_of_rows(table_name) // n_blocks}
+
+    def _select_gdo_blocks_layout(self, set_vid, indices):
+        """
+        Return the blocks layout of set_vid, with the blocks needed
+        by indices, if reading them is cheaper than reading whole
+        gdo rows; None otherwise.
+        """
+        if indices is None:
+            return None
+        layout = self._get_gdo_blocks_layout(set_vid)
+        if layout is None or layout['coverage'] == 0:
+            return None
+        B = layout['block_size']
+        markers = np.arange(layout['n_markers'])[indices]
+        blocks = np.unique(markers // B)
+        if len(blocks) * B >= GDO_BLOCKS_MAX_FRACTION * layout['n_markers']:
+            return None
+        layout['blocks'] = blocks
+        layout['positions'] = (np.searchsorted(blocks, markers // B) * B
+                               + markers % B)
+        return layout
+
+    def _read_gdo_blocks(self, layout, row_indices):
+        """
+        Read the gdos at row_indices, restricted to the markers
+        selected in layout, from the marker blocked table.
+        """
+        blocks, pos = layout['blocks'], layout['positions']
+        B, nb, n = layout['block_size'], len(blocks), len(row_indices)
+        coords = [r * layout['n_blocks'] + b
+                  for r in row_indices for b in blocks]
+        data = self.kb.get_table_slice(layout['table_name'], coords,
+                                       batch_size=len(coords))
+        assert len(data) == len(coords)
+        probs = data['probs'].reshape(n, nb, 2, B).transpose(0, 2, 1, 3)
+        probs = probs.reshape(n, 2, nb * B)[:, :, pos]
+        confs = data['confidence'].reshape(n, nb * B)[:, pos]
+        return [{'vid': data['vid'][i * nb], 'op_vid': data['op_vid'][i * nb],
+                 'probs': probs[i], 'confidence': confs[i]}
+                for i in xrange(n)]
+
+    @staticmethod
+    def _gdo_rows_to_blocks(vids, op_vids, probs, confs, block_size):
+        """
+        Split S gdo rows, probs with shape (S, 2, N) and confs with
+        shape (S, N), into marker blocks, returned as table columns.
+        """
+        S, N = confs.shape
+        n_blocks = (N + block_size - 1) // block_size
+        padded_probs = np.empty((S, 2, n_blocks * block_size),
+                                dtype=np.float32)
+        padded_probs.fill(np.nan)
+        padded_probs[:, :, :N] = probs
+        padded_confs = np.empty((S, n_blocks * block_size), dtype=np.float32)
+        padded_confs.fill(np.nan)
+        padded_confs[:, :N] = confs
+        padded_probs = padded_probs.reshape(S, 2, n_blocks, block_size)
+        padded_probs = padded_probs.transpose(0, 2, 1, 3).reshape(
+            S * n_blocks, 2 * block_size)
+        padded_confs = padded_confs.reshape(S * n_blocks, block_size)
+        return {'vid': [v for v in vids for _ in xrange(n_blocks)],
+                'op_vid': [v for v in op_vids for _ in xrange(n_blocks)],
+                'probs': list(padded_probs),
+                'confidence': list(padded_confs)}
+
+    def _extend_gdo_blocks(self, set_vid, first_row, vids, op_vids,
+                           probs, confs, batch_size=GDO_BATCH_SIZE):
+        """
+        Append the blocks of newly added gdo rows, if set_vid has a
+        marker blocked table that covers all the previous rows.
+        """
+        layout = self._get_gdo_blocks_layout(set_vid)
+        if layout is None or layout['coverage'] != first_row:
+            return
+        def batches():
+            for i in xrange(0, len(vids), batch_size):
+                j = i + batch_size
+                yield self._gdo_rows_to_blocks(vids[i:j], op_vids[i:j],
+                                               probs[i:j], confs[i:j],
+                                               layout['block_size'])
+        self.kb.add_table_columns_from_stream(layout['table_name'], batches())
+
+    @staticmethod
+    def _marker_stats_row(stats):
+        """
+        Statistics table row of stats, an algo.GenotypeStats object.
+        """
+        return {'n_samples': stats.n_samples, 'threshold': stats.threshold,
+                'sum_AA': stats.sums[0], 'sum_BB': stats.sums[1],
+                'n_valid': stats.n_valid, 'n_called': stats.n_called}
+
+    @staticmethod
+    def _genotype_stats(row):
+        """
+        Inverse of _marker_stats_row: all gdos come with confidence
+        values.
+        """
+        stats = algo.GenotypeStats(len(row['n_called']), row['threshold'])
+        stats.n_samples = stats.n_confs = row['n_samples']
+        stats.sums[0], stats.sums[1] = row['sum_AA'], row['sum_BB']
+        stats.n_valid[:] = row['n_valid']
+        stats.n_called[:] = row['n_called']
+        return stats
+
+    def _get_marker_stats_threshold(self, set_vid):
+        """
+        Return the confidence threshold of the statistics table of
+        set_vid, or None if there is no such table.  The result is
+        cached, so that adding gdos does not cost extra round trips.
+        """
+        if set_vid not in self.marker_stats_thresholds:
+            table_name = self._markers_array_table_name(
+                MARKER_STATS_TABLE_NAME, set_vid)
+            threshold = None
+            if self.kb.table_exists(table_name):
+                threshold = float(self.kb.get_table_slice(
+                    table_name, [0], col_names=['threshold'])['threshold'][0])
+            self.marker_stats_thresholds[set_vid] = threshold
+        return self.marker_stats_thresholds[set_vid]
+
+    def _get_marker_stats_row_index(self, set_vid, op_vid):
+        """
+        Return the index of the row of op_vid in the statistics table
+        of set_vid, or None if there is no such row.  Rows are never
+        moved, so the result is cached.
+        """
+        key = set_vid, op_vid
+        if self.marker_stats_rows.get(key) is None:
+            table_name = self._markers_array_table_name(
+                MARKER_STATS_TABLE_NAME, set_vid)
+            rows = self.kb.get_table_where_list(table_name,
+                                                '(op_vid == "%s")' % op_vid)
+            self.marker_stats_rows[key] = min(rows) if len(rows) > 0 else None
+        return self.marker_stats_rows[key]
+
+    def _append_marker_stats(self, table_name, op_vid, values):
+        values = dict((k, [v]) for k, v in values.iteritems())
+        values['op_vid'] = [op_vid]
+        row_indices = self.kb.add_table_columns_from_stream(table_name,
+                                                            [values])
+        assert len(row_indices) == 1
+        return row_indices[0]
+
+    def _write_marker_stats(self, set_vid, op_vid, stats):
+        """
+        Reset the statistics table of set_vid to stats, an
+        algo.GenotypeStats object, stored in the first row, now owned
+        by op_vid: the other rows are zeroed in place.  The table is
+        created if it does not exist yet.
+        """
+        table_name = self._markers_array_table_name(MARKER_STATS_TABLE_NAME,
+                                                    set_vid)
+        values = self._marker_stats_row(stats)
+        if self.kb.table_exists(table_name):
+            empty = self._marker_stats_row(
+                algo.GenotypeStats(stats.n_markers, stats.threshold))
+            for k, v in empty.iteritems():
+                empty[k] = v.tolist() if hasattr(v, 'tolist') else v
+            self.kb.update_table_rows(table_name, '(n_samples >= 0)', empty)
+            values['op_vid'] = op_vid
+            self.kb.update_table_row_at(table_name, 0, values)
+        else:
+            self.kb.create_table(table_name,
+                                 MARKER_STATS_TABLE_COLS(stats.n_markers))
+            self._append_marker_stats(table_name, op_vid, values)
+        self.marker_stats_thresholds[set_vid] = stats.threshold
+        self.marker_stats_rows[(set_vid, op_vid)] = 0
+
+    def _update_marker_stats(self, set_vid, op_vid, probs, confs):
+        """
+        Add the contribution of newly added gdos to the row of op_vid
+        in the statistics table of set_vid, if any, appending the row
+        if needed.
+        """
+        threshold = self._get_marker_stats_threshold(set_vid)
+        if threshold is None:
+            return
+        table_name = self._markers_array_table_name(MARKER_STATS_TABLE_NAME,
+                                                    set_vid)
+        stats = algo.GenotypeStats(confs.shape[-1], threshold)
+        values = self._marker_stats_row(stats.update(probs, confs))
+        index = self._get_marker_stats_row_index(set_vid, op_vid)
+        if index is None:
+            index = self._append_marker_stats(table_name, op_vid, values)
+            self.marker_stats_rows[(set_vid, op_vid)] = index
+        else:
+            self.kb.update_table_row_at(table_name, index, values,
+                                        add=MARKER_STATS_SUMS)
+
+    def _get_gdo_refs(self, mset, data_samples):
+        """
+        Return (data_sample, gdo_ref) pairs, following the order of
+        data_samples, for all gdo DataObject(s) of data_samples,
+        fetched with one query per SAMPLE_IDS_BATCH_SIZE samples.  If
+        mset is None, data_samples can be on any SNPMarkersSet, each
+        one is loaded only once.
+        """
+        if mset is None:
+            msets = {}
+            for d in data_samples:
+                ms = d.snpMarkersSet
+                if ms.omero_id not in msets:
+                    ms.reload()
+                    msets[ms.omero_id] = ms.id
+            set_vids = dict((d.omero_id, msets[d.snpMarkersSet.omero_id])
+                            for d in data_samples)
+        else:
+            for d in data_samples:
+                if d.snpMarkersSet != mset:
+                    raise ValueError('data_sample %s snpMarkersSet != mset'
+                                     % d.id)
+            set_vids = dict((d.omero_id, mset.id) for d in data_samples)
+        ids = [ds.omero_id for ds in data_samples]
+        dos = []
+        for i in xrange(0, len(ids), SAMPLE_IDS_BATCH_SIZE):
+            dos.extend(self.kb.queries.find_all(
+                'data_objects_by_sample_ids',
+                {'ids': ids[i:i + SAMPLE_IDS_BATCH_SIZE]}))
+        by_id = dict((ds.omero_id, ds) for ds in data_samples)
+        position = dict((ds.omero_id, i) for i, ds in enumerate(data_samples))
+        dos.sort(key=lambda do: position[do.sample.omero_id])
+        refs = []
+        for do in dos:
+            # FIXME we could, in principle, handle other mimetypes too
+            if do.mimetype in (mimetypes.GDO_TABLE, mimetypes.GDO_QTABLE):
+                self.kb.logger.debug(do.path)
+                mset_vid, vid, row_index = self.parse_gdo_path(do.path)
+                self.kb.logger.debug('%r' % [vid, row_index])
+                if mset_vid != set_vids[do.sample.omero_id]:
+                    raise ValueError(
+                        'DataObject %s map to data with a wrong SNPMarkersSet'
+                        % do.path
+                    )
+                refs.append((by_id[do.sample.omero_id],
+                             (mset_vid, vid, row_index,
+                              self.get_gdo_encoding(do.path), do.sha1)))
+        return refs
+
+    def _get_cached_gdo(self, ref, indices, n_markers=None):
+        set_vid, vid, _, encoding, sha1 = ref
+        if self.gdo_cache is None or sha1 is None:
+            return None
+        entry = self.gdo_cache.get(sha1)
+        if entry is None:
+            return None
+        op_vid, data = entry
+        if encoding is None:
+            n_probs = 2 * (len(data) // 3)
+        else:
+            k = 8 // np.dtype(GDO_ENCODINGS[encoding][1]).itemsize
+            n_probs = (2 * n_markers + k - 1) // k
+        row = {'vid': vid, 'op_vid': op_vid,
+               'probs': data[:n_probs], 'confidence': data[n_probs:]}
+        return self._unwrap_gdo(row, indices, encoding, n_markers)
+
+    def _cache_gdo(self, ref, row):
+        sha1 = ref[4]
+        if self.gdo_cache is None or sha1 is None:
+            return
+        data = np.concatenate((row['probs'].ravel(), row['confidence']))
+        if not self.gdo_cache.put(sha1, data, row['op_vid']):
+            self.kb.logger.debug('not caching %s: sha1 mismatch' % ref[1])
+
+    def _get_gdos_by_refs(self, refs, indices=None, batch_size=100):
+        """
+        Yield the gdos referred by refs, a list of (set_vid, vid,
+        row_index, encoding, sha1) tuples, in the same order.  Each
+        chunk of batch_size refs is read with a single slice per gdo
+        table, on sorted row indices, or from the marker blocked table
+        if indices select only a few blocks.  If the gdo cache is
+        enabled, cached rows are not fetched, and whole rows are read
+        for the others, so that they can be cached.
+        """
+        layouts = {}
+        n_markers = {}
+        for i in xrange(0, len(refs), batch_size):
+            chunk = refs[i:i + batch_size]
+            gdos = {}
+            by_table = {}
+            to_cache = {}
+            for ref in chunk:
+                set_vid, _, row_index, encoding, sha1 = ref
+                key = set_vid, encoding, row_index
+                if key in gdos or key in to_cache:
+                    continue
+                if encoding is not None and set_vid not in n_markers:
+                    n_markers[set_vid] = self.kb.get_number_of_rows(
+                        self._markers_array_table_name(MSET_TABLE_NAME,
+                                                       set_vid))
+                gdo = self._get_cached_gdo(ref, indices,
+                                           n_markers.get(set_vid))
+                if gdo is not None:
+                    gdos[key] = gdo
+                    continue
+                if self.gdo_cache is not None and sha1 is not None:
+                    to_cache[key] = ref
+                by_table.setdefault((set_vid, encoding), set()).add(row_index)
+            for (set_vid, encoding), row_indices in by_table.iteritems():
+                row_indices = sorted(row_indices)
+                key = set_vid, encoding
+                if encoding is None and self.gdo_cache is None:
+                    if set_vid not in layouts:
+                        layouts[set_vid] = self._select_gdo_blocks_layout(
+                            set_vid, indices)
+                    layout = layouts[set_vid]
+                    if layout is not None:
+                        covered = [r for r in row_indices
+                                   if r < layout['coverage']]
+                        row_indices = row_indices[len(covered):]
+                        for r, gdo in it.izip(
+                            covered, self._read_gdo_blocks(layout, covered)
+                            ):
+                            gdos[key + (r,)] = gdo
+                    if not row_indices:
+                        continue
+                table_name = self._gdo_table_name(set_vid, encoding)
+                data = self.kb.get_table_slice(table_name, row_indices,
+                                               batch_size=len(row_indices))
+                assert len(data) == len(row_indices)
+                for row_index, row in it.izip(row_indices, data):
+                    if key + (row_index,) in to_cache:
+                        self._cache_gdo(to_cache[key + (row_index,)], row)
+                    gdos[key + (row_index,)] = self._unwrap_gdo(
+                        row, indices, encoding, n_markers.get(set_vid))
+            for set_vid, vid, row_index, encoding, _ in chunk:
+                gdo = gdos[set_vid, encoding, row_index]
+                assert gdo['vid'] == vid
+                yield gdo
+
+    def _get_gdo_iterator(self, set_vid, indices=None, batch_size=100,
+                          encoding=None):
+        def iterator(stream, n_markers=None):
           for d in stream:
-            yield self._unwrap_gdo(d, indices)
-        table_name = self._markers_array_table_name(GDO_TABLE_NAME, set_vid)
+            yield self._unwrap_gdo(d, indices, encoding, n_markers)
+        def blocks_iterator(layout):
+          coverage = layout['coverage']
+          for i in xrange(0, coverage, batch_size):
+            rows = range(i, min(coverage, i + batch_size))
+            for gdo in self._read_gdo_blocks(layout, rows):
+              yield gdo
+          n_rows = self.kb.get_number_of_rows(table_name)
+          for i in xrange(coverage, n_rows, batch_size):
+            rows = range(i, min(n_rows, i + batch_size))
+            for d in self.kb.get_table_slice(table_name, rows,
+                                             batch_size=batch_size):
+              yield self._unwrap_gdo(d, indices)
+        table_name = self._gdo_table_name(set_vid, encoding)
+        if encoding is not None:
+          n_markers = self.kb.get_number_of_rows(
+            self._markers_array_table_name(MSET_TABLE_NAME, set_vid))
+          return iterator(
+            self.kb.get_table_rows_iterator(table_name, batch_size=batch_size),
+            n_markers)
+        layout = self._select_gdo_blocks_layout(set_vid, indices)
+        if layout is not None:
+          return blocks_iterator(layout)
         return iterator(
           self.kb.get_table_rows_iterator(table_name, batch_size=batch_size)
           )
@@ -0,0 +1,149 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Local markers array index
+=========================
+
+A persistent, memory mapped copy of the label, index and permutation
+columns of a markers array (mset) table, with labels kept sorted for
+binary search.  The (large) mask column is only read on demand.
+
+Each markers set gets its own directory, named after its vid, under
+the index root; the index is rebuilt when the number of rows of the
+mset table or the digest of its op_vid column change.
+
+.. code-block:: python
+
+   mindex = kb.genomics.get_markers_index(mset)
+   rows = mindex.lookup(['rs123', 'rs456'])  # -1 for unknown labels
+   mindex['index'][rows], mindex['permutation'][rows]
+"""
+
+import os, shutil, hashlib, tempfile
+
+import numpy as np
+
+from bl.vl.utils.np_ext import sorted_lookup
+
+
+COLUMNS = ['label', 'index', 'permutation']
+META_FILE = 'meta'
+
+
+def op_vid_digest(op_vids):
+  return hashlib.sha1(np.ascontiguousarray(op_vids).tostring()).hexdigest()
+
+
+class MarkersIndex(object):
+  """
+  Label based index of the markers of a SNPMarkersSet.  Columns are
+  available, in table row order, as mindex['label'],
+  mindex['index'] and mindex['permutation'].
+  """
+
+  def __init__(self, genomics, mset, root, verify=True):
+    self.genomics = genomics
+    self.mset = mset
+    self.path = os.path.join(root, mset.id)
+    n_rows = genomics.get_number_of_markers(mset)
+    op_vids = None
+    if verify:
+      op_vids = genomics.get_markers_array_rows(mset, col_names=['op_vid'])
+      op_vids = op_vids['op_vid']
+    if not self.__is_valid(n_rows, op_vids):
+      self.__build(root, op_vids)
+    self.__load()
+
+  def __read_meta(self):
+    try:
+      with open(os.path.join(self.path, META_FILE)) as f:
+        n_rows, digest = f.read().split()
+      return int(n_rows), digest
+    except (IOError, ValueError):
+      return None
+
+  def __is_valid(self, n_rows, op_vids):
+    meta = self.__read_meta()
+    if meta is None or meta[0] != n_rows:
+      return False
+    return op_vids is None or meta[1] == op_vid_digest(op_vids)
+
+  def __build(self, root, op_vids):
+    rows = self.genomics.get_markers_array_rows(
+      self.mset, col_names=COLUMNS + ['op_vid'])
+    if not os.path.isdir(root):
+      os.makedirs(root)
+    tmp_path = tempfile.mkdtemp(dir=root)
+    for k in COLUMNS:
+      np.save(os.path.join(tmp_path, '%s.npy' % k), rows[k])
+    order = np.argsort(rows['label'], kind='mergesort')
+    np.save(os.path.join(tmp_path, 'order.npy'), order)
+    np.save(os.path.join(tmp_path, 'sorted_label.npy'), rows['label'][order])
+    with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+      f.write('%d %s\n' % (len(rows), op_vid_digest(rows['op_vid'])))
+    if os.path.isdir(self.path):
+      shutil.rmtree(self.path)
+    os.rename(tmp_path, self.path)
+
+  def __load(self):
+    def load(name):
+      return np.load(os.path.join(self.path, '%s.npy' % name), mmap_mode='r')
+    self.columns = dict((k, load(k)) for k in COLUMNS)
+    self.order = load('order')
+    self.sorted_labels = load('sorted_label')
+
+  def __getstate__(self):
+    return self.path
+
+  def __setstate__(self, path):
+    # unpickled indices, e.g., in worker processes, are read only
+    # views of an existing index: masks are available only if saved
+    self.genomics = self.mset = None
+    self.path = path
+    self.__load()
+
+  def __len__(self):
+    return len(self.order)
+
+  def __getitem__(self, name):
+    return self.columns[name]
+
+  def lookup(self, labels):
+    """
+    Return the mset table rows of labels, as an array, with -1 for
+    labels that are not in the markers set.
+    """
+    return sorted_lookup(self.sorted_labels, labels, self.order)
+
+  def get(self, label):
+    """
+    Return the (index, permutation) pair of label.
+    """
+    row = self.lookup([label])[0]
+    if row < 0:
+      raise KeyError(label)
+    return self.columns['index'][row], self.columns['permutation'][row]
+
+  def get_masks(self, rows=None):
+    """
+    Return the masks of the given rows, or of all rows.  All masks
+    are fetched and saved with the index the first time rows is
+    None; until then, masks of selected rows are read from the
+    server.
+    """
+    path = os.path.join(self.path, 'mask.npy')
+    if os.path.exists(path):
+      masks = np.load(path, mmap_mode='r')
+      return masks if rows is None else masks[rows]
+    if rows is not None:
+      return self.genomics.get_markers_array_rows(
+        self.mset, indices=[int(r) for r in rows],
+        col_names=['mask'])['mask']
+    masks = self.genomics.get_markers_array_rows(self.mset,
+                                                 col_names=['mask'])['mask']
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+      np.save(f, masks)
+    os.rename(tmp_path, path)
+    return np.load(path, mmap_mode='r')
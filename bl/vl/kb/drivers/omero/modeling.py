@@ -1,46 +1,226 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
+import re, time
+from functools import wraps
+
+import omero.model as om
+
 import wrapper as wp
 
 
+DEFAULT_LOOKUP_CACHE_TTL = 300  # seconds
+FIELD_PATH_PATTERN = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$')
+
+
+QUERIES = [
+  ('device_by_label', 'select d from Device d where d.label = :label',
+   {'label': wp.STRING}),
+  ('action_setup_by_label',
+   'select a from ActionSetup a where a.label = :label',
+   {'label': wp.STRING}),
+  ('study_by_label', 'select st from Study st where st.label = :label',
+   {'label': wp.STRING}),
+  ('tube_by_label', 'select t from Tube t where t.label = :label',
+   {'label': wp.STRING}),
+  ('plate_well_by_label',
+   """select pw from PlateWell pw join fetch pw.container as ct
+   where pw.label = :wlabel and ct.label = :clabel
+   """, {'wlabel': wp.STRING, 'clabel': wp.STRING}),
+  ('data_sample_by_label',
+   'select d from DataSample d where d.label = :label',
+   {'label': wp.STRING}),
+  ('data_collection_by_label',
+   'select dc from DataCollection dc where dc.label = :label',
+   {'label': wp.STRING}),
+  ('vessels_collection_by_label',
+   'select vc from VesselsCollection vc where vc.label = :label',
+   {'label': wp.STRING}),
+  ('container_by_label', 'select c from Container c where c.label = :label',
+   {'label': wp.STRING}),
+  ('objects', 'select o from {table} o', None),
+  ('objects_by_id', 'select o from {table} o order by o.id', None),
+  ('vessels_by_content',
+   """select v from {table} v join fetch v.content as c
+   where c.value = :cvalue
+   """, {'cvalue': wp.STRING}),
+  ('enrollments_by_study_label',
+   """select e
+   from Enrollment e
+   join fetch e.study as s
+   join fetch e.individual as i
+   where s.label = :slabel
+   """, {'slabel': wp.STRING}),
+  ('enrollment_by_study_code',
+   """select e
+   from Enrollment e join fetch e.study as s
+   where e.studyCode = :ilabel and s.id = :sid
+   """, {'ilabel': wp.STRING, 'sid': wp.LONG}),
+  ('enrollments_by_study_codes',
+   """select e
+   from Enrollment e
+   join fetch e.study as s
+   join fetch e.individual as i
+   where s.id = :sid and e.studyCode in (:codes)
+   """, {'sid': wp.LONG, 'codes': [wp.STRING]}),
+  ('data_objects_by_sample',
+   """select do
+   from DataObject do
+   join fetch do.sample as s
+   where s.id = :sid
+   """, {'sid': wp.LONG}),
+  ('data_collection_items',
+   """select i
+   from DataCollectionItem i
+   join fetch i.dataSample as s
+   join fetch i.dataCollection as dc
+   where dc.id = :dcid
+   """, {'dcid': wp.LONG}),
+  ('vessels_collection_items',
+   """select i
+   from VesselsCollectionItem i
+   join fetch i.vessel as v
+   join fetch i.vesselsCollection as vc
+   where vc.id = :vcid
+   """, {'vcid': wp.LONG}),
+  ('snp_markers_set_by_label',
+   'select ms from SNPMarkersSet ms where ms.label = :label',
+   {'label': wp.STRING}),
+  ('snp_markers_set_by_mmr',
+   """select ms
+   from SNPMarkersSet ms
+   where ms.maker = :maker
+   and ms.model = :model
+   and ms.release = :release
+   """, {'maker': wp.STRING, 'model': wp.STRING, 'release': wp.STRING}),
+  ('seq_data_samples_by_tube_label',
+   """select sds
+   from SeqDataSample sds
+   join sds.sample as s
+   where s.label = :sample_label
+   """, {'sample_label': wp.STRING}),
+  ]
+
+
+class LookupCache(object):
+  """
+  A read-through cache for label based lookups of reference objects
+  (studies, devices, ...). Entries are keyed by (klass, label) and
+  expire after ttl seconds. Negative results (None) are cached too.
+  """
+
+  def __init__(self, ttl=DEFAULT_LOOKUP_CACHE_TTL, clock=time.time):
+    if ttl <= 0:
+      raise ValueError('ttl should be a positive number')
+    self.ttl = ttl
+    self.clock = clock
+    self.hits = 0
+    self.misses = 0
+    self.__entries = {}
+
+  def __len__(self):
+    return len(self.__entries)
+
+  def get(self, klass, label, loader):
+    key = (klass, label)
+    now = self.clock()
+    if key in self.__entries:
+      expires, value = self.__entries[key]
+      if now < expires:
+        self.hits += 1
+        return value
+    self.misses += 1
+    value = loader()
+    self.__entries[key] = (now + self.ttl, value)
+    return value
+
+  def invalidate(self, obj=None):
+    """
+    Drop all entries whose klass matches obj, i.e., all entries that
+    a lookup could resolve to obj. If obj is None, drop everything.
+    """
+    if obj is None:
+      self.__entries.clear()
+      return
+    for key in [k for k in self.__entries if isinstance(obj, k[0])]:
+      del self.__entries[key]
+
+  @property
+  def hit_ratio(self):
+    n = self.hits + self.misses
+    return float(self.hits) / n if n else 0.0
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_ratio': self.hit_ratio,
+      'size': len(self),
+      'ttl': self.ttl,
+      }
+
+
+def cached_lookup(ome_table):
+  """
+  Route a ModelingAdapter get-by-label method through the adapter's
+  lookup cache, if one is enabled.
+  """
+  def decorator(method):
+    @wraps(method)
+    def lookup(self, label):
+      if self.lookup_cache is None:
+        return method(self, label)
+      return self.lookup_cache.get(getattr(self.kb, ome_table), label,
+                                   lambda: method(self, label))
+    return lookup
+  return decorator
+
+
 class ModelingAdapter(object):
 
   def __init__(self, kb):
     self.kb = kb
+    self.lookup_cache = None
+    for name, hql, params in QUERIES:
+      self.kb.queries.register(name, hql, params)
 
+  def enable_lookup_cache(self, ttl=DEFAULT_LOOKUP_CACHE_TTL):
+    self.lookup_cache = LookupCache(ttl)
+    return self.lookup_cache
+
+  def disable_lookup_cache(self):
+    self.lookup_cache = None
+
+  def invalidate_lookup_cache(self, obj=None):
+    if self.lookup_cache is not None:
+      self.lookup_cache.invalidate(obj)
+
+  def get_lookup_cache_stats(self):
+    return None if self.lookup_cache is None else self.lookup_cache.stats()
+
+  @cached_lookup('Device')
   def get_device(self, label):
     """
     Return the Device object labeled 'label' or None if nothing
     matches 'label'.
     """
-    query = 'select d from Device d where d.label = :label'
-    pars = self.kb.ome_query_params({'label': wp.ome_wrap(label, wp.STRING)})
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+    return self.kb.queries.find('device_by_label', {'label': label})
 
+  @cached_lookup('ActionSetup')
   def get_action_setup(self, label):
     """
     Return the ActionSetup object labeled 'label' or None if nothing
     matches 'label'.
     """
-    query = 'select a from ActionSetup a where a.label = :label'
-    pars = self.kb.ome_query_params({'label': wp.ome_wrap(label, wp.STRING)})
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+    return self.kb.queries.find('action_setup_by_label', {'label': label})
 
+  @cached_lookup('Study')
   def get_study(self, label):
     """
     Return the Study object labeled 'label' or None if nothing
     matches 'label'.
     """
-    query = 'select st from Study st where st.label = :label'
-    pars = self.kb.ome_query_params({'label': wp.ome_wrap(label, wp.STRING)})
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+    return self.kb.queries.find('study_by_label', {'label': label})
 
   def get_vessel(self, label):
     """
@@ -48,29 +228,18 @@ class ModelingAdapter(object):
     matches 'label'. A label 'foo:A1' is interpreted as well 'A1' of
     plate 'foo'.
     """
-    import re
     if re.match(r'^.*::+.*$', label):
       # Labels like SAMPLE::PROTOCOL must be considered as a single label
       parts = [label]
     else:
       parts = label.split(':')
     if len(parts) == 1:
-      query = 'select t from Tube t where t.label = :label'
-      pars = self.kb.ome_query_params({'label': wp.ome_wrap(label, wp.STRING)})
-      result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                     query, pars)
-      return None if result is None else self.kb.factory.wrap(result)
+      return self.kb.queries.find('tube_by_label', {'label': label})
     elif len(parts) == 2:
-      query = """select pw from PlateWell pw join fetch pw.container as ct
-      where pw.label = :wlabel and ct.label = :clabel
-      """
-      pars = self.kb.ome_query_params({
-        'clabel': wp.ome_wrap(parts[0], wp.STRING),
-        'wlabel': wp.ome_wrap(parts[1], wp.STRING),
+      return self.kb.queries.find('plate_well_by_label', {
+        'clabel': parts[0],
+        'wlabel': parts[1],
         })
-      result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                     query, pars)
-      return None if result is None else self.kb.factory.wrap(result)
     else:
       raise ValueError('Bad label %s value' % label)
 
@@ -79,181 +248,156 @@ class ModelingAdapter(object):
     Return the DataSample object labeled 'label' or None if nothing
     matches 'label'.
     """
-    query = 'select d from DataSample d where d.label = :label'
-    pars = self.kb.ome_query_params({'label': wp.ome_wrap(label, wp.STRING)})
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+    return self.kb.queries.find('data_sample_by_label', {'label': label})
 
+  @cached_lookup('DataCollection')
   def get_data_collection(self, label):
     """
     Return the DataCollection object labeled 'label' or
     None if nothing matches 'label'.
     """
-    query = 'select dc from DataCollection dc where dc.label = :label'
-    pars = self.kb.ome_query_params({'label': wp.ome_wrap(label, wp.STRING)})
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+    return self.kb.queries.find('data_collection_by_label',
+                                {'label': label})
 
+  @cached_lookup('VesselsCollection')
   def get_vessels_collection(self, label):
     """
     Return the VesselsCollection object labeled 'label' or None if
     nothing matches 'label'.
     """
-    query = 'select vc from VesselsCollection vc where vc.label = :label'
-    pars = self.kb.ome_query_params({'label' : wp.ome_wrap(label, wp.STRING)})
-    result = self.kb.ome_operation('getQueryService', 'findByQuery',
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+    return self.kb.queries.find('vessels_collection_by_label',
+                                {'label': label})
 
   def get_objects(self, klass):
-    query = "from %s o" % klass.get_ome_table()
-    pars = None
-    results = self.kb.ome_operation('getQueryService', 'findAllByQuery',
-                                    query, pars)
-    return [self.kb.factory.wrap(o) for o in results]
+    return self.kb.queries.find_all('objects', table=klass.get_ome_table())
 
-  def get_enrolled(self, study):
-    query = """select e
-    from Enrollment e
-    join fetch e.study as s
-    join fetch e.individual as i
-    where s.label = :slabel
+  def iter_objects(self, klass, page_size):
     """
-    pars = self.kb.ome_query_params({
-      'slabel': wp.ome_wrap(study.label, wp.STRING),
-      })
-    result = self.kb.ome_operation("getQueryService", "findAllByQuery",
-                                   query, pars)
-    return [self.kb.factory.wrap(e) for e in result]
+    Iterate over all objects of class klass, fetching them page_size
+    at a time, in omero id order.
+    """
+    return self.kb.queries.iter_all('objects_by_id', page_size=page_size,
+                                    table=klass.get_ome_table())
 
-  def get_data_objects(self, sample):
-    query = """select do
-    from DataObject do
-    join fetch do.sample as s
-    where s.id  = :sid
+  def count(self, klass, where=None, params=None):
     """
-    pars = self.kb.ome_query_params({
-      'sid': wp.ome_wrap(sample.omero_id, wp.LONG),
-      })
-    result = self.kb.ome_operation("getQueryService", "findAllByQuery",
-                                   query, pars)
-    return [self.kb.factory.wrap(i) for i in result]
+    Return the number of objects of class klass, computed on the
+    server side. where is an optional HQL condition on the 'o' alias,
+    e.g., "o.label like :pattern", with its parameters given in
+    params as in find_all_by_query.
+    """
+    query = 'select count(o) from %s o' % klass.get_ome_table()
+    if where:
+      query += ' where %s' % where
+    rows = self.kb.projection(query, params)
+    return rows[0][0] if rows else 0
 
-  def get_data_collection_items(self, dc):
-    query = """select i
-    from DataCollectionItem i
-    join fetch i.dataSample as s
-    join fetch i.dataCollection as dc
-    where dc.id  = :dcid
+  def group_count(self, klass, group_by_fields, where=None, params=None):
     """
-    pars = self.kb.ome_query_params({
-      'dcid': wp.ome_wrap(dc.omero_id, wp.LONG),
-      })
-    result = self.kb.ome_operation("getQueryService", "findAllByQuery",
-                                   query, pars)
-    return [self.kb.factory.wrap(i) for i in result]
+    Count objects of class klass grouped by the values of
+    group_by_fields, a list of (possibly dotted) field names of the
+    'o' alias, e.g., ['gender'] or ['action.context.label'].
 
-  def get_vessels_collection_items(self, vc):
-    query = """select i
-    from VesselsCollectionItem i
-    join fetch i.vessel as v
-    join fetch i.vesselsCollection as vc
-    where vc.id = :vcid
+    Return a dict that maps the tuple of group values to the
+    corresponding count. Values that are kb objects are wrapped.
     """
-    pars = self.kb.ome_query_params({
-        'vcid' : wp.ome_wrap(vc.omero_id, wp.LONG),
-        })
-    result = self.kb.ome_operation('getQueryService', 'findAllByQuery',
-                                   query, pars)
-    return [self.kb.factory.wrap(i) for i in result]
+    if isinstance(group_by_fields, basestring):
+      group_by_fields = [group_by_fields]
+    if not group_by_fields:
+      raise ValueError('group_by_fields should not be empty')
+    for f in group_by_fields:
+      if not FIELD_PATH_PATTERN.match(f):
+        raise ValueError('illegal field name: %r' % f)
+    columns = ', '.join('o.%s' % f for f in group_by_fields)
+    query = 'select %s, count(o) from %s o' % (columns,
+                                               klass.get_ome_table())
+    if where:
+      query += ' where %s' % where
+    query += ' group by %s' % columns
+    counts = {}
+    for row in self.kb.projection(query, params):
+      key = tuple(self.kb.factory.wrap(v) if isinstance(v, om.IObject)
+                  else v for v in row[:-1])
+      counts[key] = row[-1]
+    return counts
+
+  def get_enrolled(self, study):
+    return self.kb.queries.find_all('enrollments_by_study_label',
+                                    {'slabel': study.label})
+
+  def get_data_objects(self, sample):
+    return self.kb.queries.find_all('data_objects_by_sample',
+                                    {'sid': sample.omero_id})
+
+  def get_data_collection_items(self, dc):
+    return self.kb.queries.find_all('data_collection_items',
+                                    {'dcid': dc.omero_id})
+
+  def get_vessels_collection_items(self, vc):
+    return self.kb.queries.find_all('vessels_collection_items',
+                                    {'vcid': vc.omero_id})
 
   def get_enrollment(self, study, ind_label):
-    query = """select e
-    from Enrollment e join fetch e.study as s
-    where e.studyCode = :ilabel and s.id = :sid
-    """
-    pars = self.kb.ome_query_params({
-      'ilabel': wp.ome_wrap(ind_label),
-      'sid': wp.ome_wrap(study.omero_id),
+    return self.kb.queries.find('enrollment_by_study_code', {
+      'ilabel': ind_label,
+      'sid': study.omero_id,
       })
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+
+  def get_enrollments(self, study, study_codes, batch_size):
+    """
+    Return a dict that maps each code in study_codes that is
+    enrolled in study to the corresponding Enrollment, with its
+    individual already fetched. Codes are looked up batch_size at a
+    time with 'in' queries.
+    """
+    study_codes = list(set(study_codes))
+    enrollments = {}
+    for offset in xrange(0, len(study_codes), batch_size):
+      result = self.kb.queries.find_all('enrollments_by_study_codes', {
+        'sid': study.omero_id,
+        'codes': study_codes[offset:offset+batch_size],
+        })
+      for e in result:
+        enrollments[e.studyCode] = e
+    return enrollments
 
   def get_vessels(self, klass, content):
     if not issubclass(klass, self.kb.Vessel):
       raise ValueError('klass should be a subclass of Vessel')
     if not content:
-      query = "select v from %s v" % klass.get_ome_table()
-      pars = None
+      return self.kb.queries.find_all('objects', table=klass.get_ome_table())
     elif isinstance(content, self.kb.VesselContent):
       value = content.ome_obj.value._val
-      query = """select v from %s v join fetch v.content as c
-      where c.value = :cvalue
-      """ % klass.get_ome_table()
-      pars = self.kb.ome_query_params({'cvalue': wp.ome_wrap(value)})
+      return self.kb.queries.find_all('vessels_by_content',
+                                      {'cvalue': value},
+                                      table=klass.get_ome_table())
     else:
       raise ValueError('content should be an instance of VesselContent')
-    results = self.kb.ome_operation('getQueryService', 'findAllByQuery',
-                                    query, pars)
-    return [self.kb.factory.wrap(v) for v in results]
 
   def get_containers(self, klass):
     if not issubclass(klass, self.kb.Container):
       raise ValueError('klass should be a subclass of Container')
-    query = "select v from %s v" % klass.get_ome_table()
-    pars = None
-    results = self.kb.ome_operation('getQueryService', 'findAllByQuery',
-                                    query, pars)
-    return [self.kb.factory.wrap(v) for v in results]
+    return self.kb.queries.find_all('objects', table=klass.get_ome_table())
 
+  @cached_lookup('Container')
   def get_container(self, label):
     assert isinstance(label, str)
-    query = """select c
-    from Container c
-    where c.label = :label
-    """
-    pars = self.kb.ome_query_params({'label': wp.ome_wrap(label)})
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
+    return self.kb.queries.find('container_by_label', {'label': label})
 
   def get_snp_markers_set(self, label, maker, model, release):
     if label:
-      query = """select ms
-      from SNPMarkersSet ms
-      where ms.label = :label
-      """
-      pars = self.kb.ome_query_params({'label': wp.ome_wrap(label)})
+      return self.kb.queries.find('snp_markers_set_by_label',
+                                  {'label': label})
     else:
       if not (maker and model and release):
         raise ValueError('maker model and release should be all provided')
-      query = """select ms
-      from SNPMarkersSet ms
-      where ms.maker = :maker
-      and ms.model = :model
-      and ms.release = :release
-      """
-      pars = self.kb.ome_query_params({
-        'maker': wp.ome_wrap(maker),
-        'model': wp.ome_wrap(model),
-        'release': wp.ome_wrap(release),
+      return self.kb.queries.find('snp_markers_set_by_mmr', {
+        'maker': maker,
+        'model': model,
+        'release': release,
         })
-    result = self.kb.ome_operation("getQueryService", "findByQuery",
-                                   query, pars)
-    return None if result is None else self.kb.factory.wrap(result)
 
   def get_seq_data_samples_by_tube(self, tube):
     assert isinstance(tube, self.kb.Tube)
-    query = '''
-    SELECT sds
-    FROM SeqDataSample sds
-    JOIN sds.sample AS s
-    WHERE s.label = :sample_label
-    '''
-    pars = self.kb.ome_query_params({'sample_label': wp.ome_wrap(tube.label)})
-    results = self.kb.ome_operation('getQueryService', 'findAllByQuery',
-                                   query, pars)
-    return None if results is None else  [self.kb.factory.wrap(v) for v in results]
+    return self.kb.queries.find_all('seq_data_samples_by_tube_label',
+                                    {'sample_label': tube.label})
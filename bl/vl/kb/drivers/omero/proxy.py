@@ -16,6 +16,7 @@ from bl.vl.kb import KBPermissionError, KBError
 
 from proxy_core import ProxyCore
 from wrapper import ObjectFactory, MetaWrapper
+import wrapper as wp
 import action
 import vessels
 import objects_collections
@@ -31,7 +32,8 @@ import affymetrix_chips
 import illumina_chips
 
 from genomics import GenomicsAdapter
-from modeling import ModelingAdapter
+from modeling import ModelingAdapter, DEFAULT_LOOKUP_CACHE_TTL
+from query_templates import QueryRegistry
 from context_manager import ContextManagerAdapter
 from eav import EAVAdapter
 from ehr import EHR
@@ -41,10 +43,24 @@ from admin import Admin
 
 EXTRA_MODULES_ENV = 'OMERO_BIOBANK_EXTRA_MODULES'
 NO_VCHECK_ENV = 'OMERO_BIOBANK_NO_VCHECK'
+LOOKUP_CACHE_TTL_ENV = 'OMERO_BIOBANK_LOOKUP_CACHE_TTL'
+GDO_CACHE_DIR_ENV = 'OMERO_BIOBANK_GDO_CACHE_DIR'
+GDO_CACHE_SIZE_ENV = 'OMERO_BIOBANK_GDO_CACHE_SIZE'
 
 KOK = MetaWrapper.__KNOWN_OME_KLASSES__
 BATCH_SIZE = 5000
 
+QUERIES = [
+  ('object_by_vid', 'select o from {table} o where o.vid = :vid',
+   {'vid': wp.STRING}),
+  ('objects_by_field', 'select o from {table} o where o.{field} in (:values)',
+   {'values': [None]}),
+  ('actions_by_target_vid',
+   """select act from {table} act join act.target as trg
+   where trg.vid = :target_id
+   """, {'target_id': wp.STRING}),
+  ]
+
 
 class Proxy(ProxyCore):
   """
@@ -73,8 +89,21 @@ class Proxy(ProxyCore):
       klass = KOK[k]
       setattr(self, klass.get_ome_table(), klass)
     #-- setup adapters
+    self.queries = QueryRegistry(self)
+    for name, hql, params in QUERIES:
+      self.queries.register(name, hql, params)
     self.genomics = GenomicsAdapter(self)
+    gdo_cache_dir = os.getenv(GDO_CACHE_DIR_ENV)
+    if gdo_cache_dir:
+      gdo_cache_size = os.getenv(GDO_CACHE_SIZE_ENV)
+      if gdo_cache_size:
+        self.genomics.enable_gdo_cache(gdo_cache_dir, int(gdo_cache_size))
+      else:
+        self.genomics.enable_gdo_cache(gdo_cache_dir)
     self.madpt = ModelingAdapter(self)
+    lookup_cache_ttl = os.getenv(LOOKUP_CACHE_TTL_ENV)
+    if lookup_cache_ttl:
+      self.madpt.enable_lookup_cache(float(lookup_cache_ttl))
     self.context = ContextManagerAdapter(self)
     self.eadpt = EAVAdapter(self)
     self.admin = Admin(self)
@@ -155,13 +184,45 @@ class Proxy(ProxyCore):
       kb_obj.reload()
     return cloned_obj
 
+  def save(self, obj, move_to_common_space=False):
+    obj = super(Proxy, self).save(obj, move_to_common_space)
+    self.madpt.invalidate_lookup_cache(obj)
+    return obj
+
+  def save_array(self, array):
+    array = super(Proxy, self).save_array(array)
+    for obj in array:
+      self.madpt.invalidate_lookup_cache(obj)
+    return array
+
+  def delete(self, kb_obj):
+    result = super(Proxy, self).delete(kb_obj)
+    self.madpt.invalidate_lookup_cache(kb_obj)
+    return result
+
   def find_all_by_query(self, query, params):
     return super(Proxy, self).find_all_by_query(query, params, self.factory)
 
+  def iter_query(self, query, params=None, page_size=BATCH_SIZE):
+    """
+    Generator version of find_all_by_query: results are fetched from
+    the server page_size at a time and wrapped on demand.
+
+    query should define a stable ordering of its results, e.g.,
+    'from Individual o order by o.id'.
+    """
+    return self.iter_all_by_query(query, params, self.factory, page_size)
+
+  def get_query_stats(self):
+    """
+    Return call counts and latencies of the registered query
+    templates, see :class:`query_templates.QueryRegistry`.
+    """
+    return self.queries.stats()
+
   def get_by_vid(self, klass, vid):
-    query = "from %s o where o.vid = :vid" % klass.get_ome_table()
-    params = {"vid": vid}
-    res = self.find_all_by_query(query, params)
+    res = self.queries.find_all('object_by_vid', {'vid': vid},
+                                table=klass.get_ome_table())
     if len(res) != 1:
       raise ValueError("%d kb objects map to %s" % (len(res), vid))
     return res[0]
@@ -173,11 +234,9 @@ class Proxy(ProxyCore):
     to o.
     """
     def get_by_field_helper(values):
-      template = "from %s o where o.{} in (%s)".format(field_name)
-      query = template % (klass.get_ome_table(),
-                          ','.join(map(lambda x: "'%s'" % x, values)))
-      params = {}
-      res = self.find_all_by_query(query, params)
+      res = self.queries.find_all('objects_by_field', {'values': values},
+                                  table=klass.get_ome_table(),
+                                  field=field_name)
       return dict(map(lambda o: (getattr(o, field_name), o), res))
     def values_by_chunk():
       offset = 0
@@ -225,6 +284,28 @@ class Proxy(ProxyCore):
   # Modeling-related utility functions
   # ==================================
 
+  def enable_lookup_cache(self, ttl=DEFAULT_LOOKUP_CACHE_TTL):
+    """
+    Cache the results of get_study, get_device, get_action_setup,
+    get_data_collection, get_vessels_collection and get_container
+    for ttl seconds. Cached entries are dropped whenever an object
+    of a matching class is saved or deleted through this proxy.
+
+    The cache can also be enabled by setting the
+    OMERO_BIOBANK_LOOKUP_CACHE_TTL environment variable.
+    """
+    return self.madpt.enable_lookup_cache(ttl)
+
+  def disable_lookup_cache(self):
+    self.madpt.disable_lookup_cache()
+
+  def get_lookup_cache_stats(self):
+    """
+    Return a dict with hits, misses, hit_ratio, size and ttl of the
+    lookup cache, or None if the cache is not enabled.
+    """
+    return self.madpt.get_lookup_cache_stats()
+
   def get_device(self, label):
     return self.madpt.get_device(label)
 
@@ -249,12 +330,28 @@ class Proxy(ProxyCore):
   def get_objects(self, klass):
     return self.madpt.get_objects(klass)
 
+  def iter_objects(self, klass, page_size=BATCH_SIZE):
+    return self.madpt.iter_objects(klass, page_size)
+
+  def count(self, klass, where=None, params=None):
+    return self.madpt.count(klass, where, params)
+
+  def group_count(self, klass, group_by_fields, where=None, params=None):
+    return self.madpt.group_count(klass, group_by_fields, where, params)
+
   def get_enrolled(self, study):
     return self.madpt.get_enrolled(study)
 
   def get_enrollment(self, study, ind_label):
     return self.madpt.get_enrollment(study, ind_label)
 
+  def get_enrollments(self, study, study_codes, batch_size=240):
+    """
+    Bulk version of get_enrollment: return a dict that maps the codes
+    in study_codes enrolled in study to their Enrollment objects.
+    """
+    return self.madpt.get_enrollments(study, study_codes, batch_size)
+
   def get_vessel(self, label):
     return self.madpt.get_vessel(label)
 
@@ -341,7 +438,6 @@ class Proxy(ProxyCore):
     """
     Get all Actions that have the *target* object as target
     """
-    query = "SELECT act FROM %s act JOIN act.target AS trg WHERE trg.vid = :target_id"
     # select the proper action class
     act = ''
     if isinstance(target, self.Vessel):
@@ -354,7 +450,8 @@ class Proxy(ProxyCore):
       act = 'ActionOnCollection'
     else:
       raise ValueError('Target %s has no a specific Action' % type(target))
-    return self.find_all_by_query(query % act, {'target_id': target.id})
+    return self.queries.find_all('actions_by_target_vid',
+                                 {'target_id': target.id}, table=act)
 
   def get_individuals(self, group):
     """
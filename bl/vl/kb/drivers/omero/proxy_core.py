@@ -282,18 +282,56 @@ class ProxyCore(object):
                        (action, operation))
     return result
 
+  def __wrap_query_params(self, params):
+    xpars = {}
+    for k,v in params.iteritems():
+      xpars[k] = ome_wrap(*v) if type(v) == tuple else ome_wrap(v)
+    return self.ome_query_params(xpars)
+
   def find_all_by_query(self, query, params, factory):
     if params:
-      xpars = {}
-      for k,v in params.iteritems():
-        xpars[k] = ome_wrap(*v) if type(v) == tuple else ome_wrap(v)
-      pars = self.ome_query_params(xpars)
+      pars = self.__wrap_query_params(params)
     else:
       pars = None
     result = self.ome_operation("getQueryService", "findAllByQuery",
                                 query, pars)
     return [] if result is None else [factory.wrap(r) for r in result]
 
+  def projection(self, query, params):
+    """
+    Run a projection query (e.g., 'select o.label, count(o) from ...')
+    and return its result as a list of rows of unwrapped values.
+    """
+    pars = self.__wrap_query_params(params) if params else None
+    result = self.ome_operation("getQueryService", "projection",
+                                query, pars)
+    return [] if result is None else [[ort.unwrap(v) for v in row]
+                                      for row in result]
+
+  def iter_all_by_query(self, query, params, factory, page_size=BATCH_SIZE):
+    """
+    Lazily run query, fetching results page_size at a time.
+
+    Pagination is done with ParametersI.page(offset, limit), so query
+    should have a stable ordering (e.g., 'order by o.id'), otherwise
+    the same row could be returned by two different pages.
+    """
+    if page_size <= 0:
+      raise ValueError('page_size should be a positive integer')
+    offset = 0
+    while True:
+      pars = self.__wrap_query_params(params or {})
+      pars.page(offset, page_size)
+      result = self.ome_operation("getQueryService", "findAllByQuery",
+                                  query, pars)
+      if not result:
+        break
+      for r in result:
+        yield factory.wrap(r)
+      if len(result) < page_size:
+        break
+      offset += page_size
+
   def update_by_example(self, o):
     res = self.ome_operation('getQueryService', 'findByExample', o.ome_obj)
     if not res:
@@ -447,6 +485,15 @@ class ProxyCore(object):
     table = self._get_table(session, table_name)
     return table.getNumberOfRows()
 
+  def get_table_where_list(self, table_name, selector):
+    """
+    Return the indices of the rows of table table_name that satisfy
+    selector, a condition on its columns such as '(pos >= 10)'.
+    """
+    session = self.connect()
+    table = self._get_table(session, table_name)
+    return table.getWhereList(selector, {}, 0, table.getNumberOfRows(), 1)
+
   @staticmethod
   def _load_columns(table, records):
     columns = table.getHeaders()
@@ -669,6 +716,15 @@ class ProxyCore(object):
     return self.__extend_table(table_name, self.__load_batch, stream,
                                batch_size=batch_size)
 
+  def add_table_columns_from_stream(self, table_name, stream):
+    """
+    Append rows to table table_name.  Each element of stream is a
+    batch of rows given by column, i.e., a dict that maps each column
+    name to an equally long sequence of values.
+    """
+    return self.__extend_table(table_name, self.__load_columns_batch,
+                               iter(stream))
+
   def __extend_table(self, table_name, batch_loader, records_stream,
                      batch_size=BATCH_SIZE):
     if not self.current_session:
@@ -702,6 +758,13 @@ class ProxyCore(object):
       o.values = v[o.name]
     return col_objs
 
+  def __load_columns_batch(self, columns_stream, col_objs, chunk_size):
+    for v in columns_stream:
+      for o in col_objs:
+        o.values = v[o.name]
+      return col_objs
+    return None
+
   def update_table_row(self, table_name, selector, row):
     if not self.current_session:
         self.connect()
@@ -718,6 +781,26 @@ class ProxyCore(object):
     # finally:
     #   self.disconnect()
 
+  def update_table_row_at(self, table_name, index, row, add=()):
+    """
+    Update in place row number index of table_name with the values
+    in row, a dict keyed by column name.  Values of the columns
+    listed in add are added, element wise, to the current ones,
+    which are read and written back through the same table handle.
+    """
+    if not self.current_session:
+        self.connect()
+    t = self._get_table(self.current_session, table_name)
+    data = t.readCoordinates([index])
+    for o in data.columns:
+      if o.name not in row:
+        continue
+      v = row[o.name]
+      if o.name in add:
+        v = np.asarray(o.values[0]) + np.asarray(v)
+      o.values[0] = v.tolist() if hasattr(v, 'tolist') else v
+    t.update(data)
+
   def update_table_rows(self, table_name, selector, update_items):
     if not self.current_session:
         self.connect()
@@ -0,0 +1,201 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Named HQL query templates
+=========================
+
+Queries are registered once, by name, as constant HQL strings with
+named parameters. Each call only binds parameter values, so the query
+text sent to the server does not change from call to call and its
+parsed plan can be reused by Hibernate's query plan cache. Values are
+never formatted into the query text.
+
+A template may also contain ``{slot}`` placeholders, e.g.,
+``from {table} o``, for the parts of a query that cannot be
+parameters (class and field names). Slot values must be plain
+identifiers; each rendered variant is validated and built only once.
+
+.. code-block:: python
+
+   kb.queries.register('study_by_label',
+                       'select st from Study st where st.label = :label',
+                       {'label': wp.STRING})
+   study = kb.queries.find('study_by_label', {'label': 'ASTUDY'})
+   kb.queries.stats()['study_by_label']['calls']
+"""
+
+import re, time
+
+import wrapper as wp
+
+
+PARAM_PATTERN = re.compile(r'(?<!:):([A-Za-z_]\w*)')
+SLOT_PATTERN = re.compile(r'\{(\w+)\}')
+IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_]\w*$')
+
+
+class QueryTemplate(object):
+  """
+  A named HQL query with typed parameters.
+
+  params maps each parameter name to its type: one of the wrapper
+  type codes (e.g., wp.STRING, wp.LONG), None for automatic wrapping,
+  or a one element list, e.g., [wp.STRING], for collection valued
+  parameters used in 'in (:name)' clauses.
+  """
+
+  def __init__(self, name, hql, params=None):
+    self.name = name
+    self.hql = ' '.join(hql.split())
+    self.params = params or {}
+    self.slots = frozenset(SLOT_PATTERN.findall(self.hql))
+    self.calls = 0
+    self.total_time = 0.0
+    self.__rendered = {}
+    self.__check()
+
+  def __check(self):
+    for c in '\'"%':
+      if c in self.hql:
+        raise ValueError('%s: %r is not allowed, use parameters' %
+                         (self.name, c))
+    used = set(PARAM_PATTERN.findall(self.hql))
+    declared = set(self.params)
+    if used != declared:
+      raise ValueError('%s: declared parameters %s do not match %s' %
+                       (self.name, sorted(declared), sorted(used)))
+    for k, t in self.params.iteritems():
+      if isinstance(t, list):
+        if len(t) != 1:
+          raise ValueError('%s: bad list type for %s' % (self.name, k))
+        t = t[0]
+      if t is not None and t not in wp.WRAPPING:
+        raise ValueError('%s: unknown type %r for %s' % (self.name, t, k))
+
+  def render(self, **slots):
+    """
+    Return the HQL text for the given slot values.
+    """
+    key = tuple(sorted(slots.iteritems()))
+    try:
+      return self.__rendered[key]
+    except KeyError:
+      pass
+    if set(slots) != self.slots:
+      raise ValueError('%s: expected slots %s' %
+                       (self.name, sorted(self.slots)))
+    for v in slots.itervalues():
+      if not IDENTIFIER_PATTERN.match(v):
+        raise ValueError('%s: illegal slot value %r' % (self.name, v))
+    hql = self.__rendered[key] = self.hql.format(**slots)
+    return hql
+
+  def bind(self, kb, values):
+    """
+    Return omero query parameters with values bound to this template.
+    """
+    if set(values) != set(self.params):
+      raise ValueError('%s: expected parameters %s' %
+                       (self.name, sorted(self.params)))
+    conf = {}
+    for k, t in self.params.iteritems():
+      if isinstance(t, list):
+        conf[k] = wp.ome_wrap([wp.ome_wrap(x, t[0]) for x in values[k]])
+      else:
+        conf[k] = wp.ome_wrap(values[k], t)
+    return kb.ome_query_params(conf)
+
+  def record(self, elapsed):
+    self.calls += 1
+    self.total_time += elapsed
+
+  def stats(self):
+    return {
+      'calls': self.calls,
+      'total_time': self.total_time,
+      'mean_time': self.total_time / self.calls if self.calls else 0.0,
+      }
+
+
+class QueryRegistry(object):
+  """
+  Keeps named QueryTemplate(s) and runs them against a kb.
+  """
+
+  def __init__(self, kb):
+    self.kb = kb
+    self.templates = {}
+
+  def register(self, name, hql, params=None):
+    """
+    Register a new template. Registering again the same name with
+    the same definition is a no-op.
+    """
+    template = QueryTemplate(name, hql, params)
+    old = self.templates.get(name)
+    if old is not None:
+      if (old.hql, old.params) != (template.hql, template.params):
+        raise ValueError('query %s is already registered' % name)
+      return old
+    self.templates[name] = template
+    return template
+
+  def __getitem__(self, name):
+    try:
+      return self.templates[name]
+    except KeyError:
+      raise ValueError('unknown query %s' % name)
+
+  def __run(self, action, name, values, slots, page=None):
+    template = self[name]
+    query = template.render(**slots)
+    pars = template.bind(self.kb, values or {})
+    if page is not None:
+      pars.page(*page)
+    start = time.time()
+    try:
+      return self.kb.ome_operation('getQueryService', action, query, pars)
+    finally:
+      template.record(time.time() - start)
+
+  def find(self, name, values=None, **slots):
+    """
+    Run query name and return its single result, or None.
+    """
+    result = self.__run('findByQuery', name, values, slots)
+    return None if result is None else self.kb.factory.wrap(result)
+
+  def find_all(self, name, values=None, **slots):
+    """
+    Run query name and return the list of all its results.
+    """
+    result = self.__run('findAllByQuery', name, values, slots)
+    return [] if result is None else [self.kb.factory.wrap(r)
+                                      for r in result]
+
+  def iter_all(self, name, values=None, page_size=5000, **slots):
+    """
+    Run query name, fetching results page_size at a time. The query
+    should define a stable ordering of its results.
+    """
+    if page_size <= 0:
+      raise ValueError('page_size should be a positive integer')
+    offset = 0
+    while True:
+      result = self.__run('findAllByQuery', name, values, slots,
+                          page=(offset, page_size))
+      if not result:
+        break
+      for r in result:
+        yield self.kb.factory.wrap(r)
+      if len(result) < page_size:
+        break
+      offset += page_size
+
+  def stats(self):
+    """
+    Return a dict that maps each template name to its call count and
+    cumulative/mean latency (in seconds).
+    """
+    return dict((k, t.stats()) for k, t in self.templates.iteritems())
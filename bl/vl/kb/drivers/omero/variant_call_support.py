@@ -16,19 +16,41 @@ mediated by kb.
    vcs3 = vcs1.union(vcs2)
    vcs3.label = 'label1+label2'
    register_vcs(kb, vcs3)
-   
-  
+
+Data is loaded lazily: nodes on first use, fields on first
+get_field(name). A region, with the same format used by
+:meth:`VariantCallSupport.selection`, and a list of fields can be
+given at retrieval time, so that only the corresponding table rows
+are read:
+
+.. code-block:: python
+
+   vcs = get_vcs_by_label(kb, 'label1', region=((1, 0), (2, 0)),
+                          fields=['origin'])
+
+Data can be stored either as plain omero tables, one for the nodes
+and one for each field (mimetypes.VCS_TABLES, the default), or as
+compressed chunks of records in a single table
+(mimetypes.VCS_CHUNKS), see :mod:`vcs_chunks`. Existing vcs can be
+moved from one storage to the other with convert_vcs_storage:
+
+.. code-block:: python
+
+   register_vcs(kb, vcs3, mimetype=mimetypes.VCS_CHUNKS)
+   convert_vcs_storage(kb, vcs1, mimetypes.VCS_CHUNKS)
 """
 import omero.model as om
 import omero.rtypes as ort
 
 
 import numpy as np
+import itertools as it
 import uuid
 import json
 import hashlib
 
 import wrapper as wp
+import vcs_chunks
 
 from bl.vl.kb import mimetypes
 from bl.vl.kb.drivers.omero.data_samples import DataSample
@@ -41,26 +63,120 @@ import bl.vl.utils.np_ext as np_ext
 def create_label():
     return uuid.uuid4().hex
 
-def get_vcs_by_label(kb, label):
-    "Recover a VariantCallSupport definition by label"
+def get_vcs_by_label(kb, label, region=None, fields=None):
+    """
+    Recover a VariantCallSupport definition by label.
+
+    If region is given, only the nodes in region, see
+    VariantCallSupport.selection, are read; if fields is given, only
+    the listed fields will be available.
+    """
     vcs = kb.get_by_label(VariantCallSupport, label)
-    return None if vcs is None else _restore_data(kb, vcs)
+    return None if vcs is None else _restore_data(kb, vcs, region, fields)
 
-def get_vcs_by_vid(kb, vid):
-    "Recover a VariantCallSupport definition by vid"
+def get_vcs_by_vid(kb, vid, region=None, fields=None):
+    """
+    Recover a VariantCallSupport definition by vid, see
+    get_vcs_by_label.
+    """
     vcs = kb.get_by_vid(VariantCallSupport, vid)
-    return None if vcs is None else _restore_data(kb, vcs)    
+    return None if vcs is None else _restore_data(kb, vcs, region, fields)
 
-def _restore_data(kb, vcs):
-    # pylint: disable=C0111    
+def _restore_data(kb, vcs, region=None, fields=None):
+    # pylint: disable=C0111
     dos = kb.get_data_objects(vcs)
     if len(dos) == 0:
         return vcs # empty vcs
-    nodes, fields = _get_vcs_data(kb, dos)
-    vcs.define_support(nodes)
-    vcs.define_fields(fields)
+    mimetype, table_names = _get_vcs_tables(kb, dos)
+    if fields is not None:
+        unknown = set(fields) - set(table_names['fields'])
+        if unknown:
+            raise ValueError('unknown fields: %s' % ', '.join(sorted(unknown)))
+        table_names['fields'] = dict((k, table_names['fields'][k])
+                                     for k in fields)
+    rows = None
+    if region is not None and mimetype == mimetypes.VCS_TABLES:
+        rows = _get_rows_range(kb, table_names['support']['nodes'],
+                               _region_selector(region))
+    # with chunks, rows are known only once nodes are read
+    vcs._define_source({'kb': kb, 'mimetype': mimetype, 'region': region,
+                        'rows': rows,
+                        'nodes': table_names['support']['nodes'],
+                        'fields': table_names['fields']})
     return vcs
 
+def _region_selector(region):
+    # nodes with beg <= (chrom, pos) < end, see VariantCallSupport._get_gpos
+    (beg_chrom, beg_pos), (end_chrom, end_pos) = region
+    return ('(((chrom > %d) | ((chrom == %d) & (pos >= %d))) & '
+            '((chrom < %d) | ((chrom == %d) & (pos < %d))))' %
+            (beg_chrom, beg_chrom, beg_pos, end_chrom, end_chrom, end_pos))
+
+def _get_rows_range(kb, table_name, selector):
+    # rows are sorted, hence selected rows are contiguous
+    rows = kb.get_table_where_list(table_name, selector)
+    return (min(rows), max(rows) + 1) if len(rows) > 0 else (0, 0)
+
+def _read_vcs_table(kb, table_name, rows=None):
+    # pylint: disable=C0111
+    if rows is None:
+        return kb.read_whole_table(table_name)
+    beg, end = rows
+    if beg == end:
+        return np.zeros(0, dtype=kb.get_table_headers(table_name))
+    return kb.get_table_slice(table_name, range(beg, end))
+
+def _read_vcs_field(kb, table_name, rows=None):
+    # pylint: disable=C0111
+    if rows is None:
+        return kb.read_whole_table(table_name)
+    beg, end = rows
+    # fields are not necessarily sorted by index: read exactly the
+    # selected rows rather than the range they span
+    selected = sorted(kb.get_table_where_list(
+        table_name, '((index >= %d) & (index < %d))' % (beg, end)))
+    if len(selected) == 0:
+        return np.zeros(0, dtype=kb.get_table_headers(table_name))
+    field = kb.get_table_slice(table_name, selected)
+    field['index'] -= beg
+    return field
+
+def _get_nodes_key(nodes):
+    return VariantCallSupport._get_gpos(nodes['chrom'], nodes['pos'])
+
+def _get_field_key(field):
+    return field['index']
+
+def _make_chunks_ref(table_name, name, dtype):
+    return {'table': table_name, 'name': name, 'dtype': dtype.descr}
+
+def _get_chunks_dtype(ref):
+    return np.dtype([(str(k), str(t)) for k, t in ref['dtype']])
+
+def _read_vcs_chunks(kb, ref, region=None):
+    """
+    Read the nodes in region, or all of them, and return them with
+    the corresponding rows range, see _get_rows_range.
+    """
+    key_range = None
+    if region is not None:
+        (beg_chrom, beg_pos), (end_chrom, end_pos) = region
+        key_range = (VariantCallSupport._get_gpos(beg_chrom, beg_pos),
+                     VariantCallSupport._get_gpos(end_chrom, end_pos))
+    nodes, offset = vcs_chunks.read_chunks(kb, ref['table'], ref['name'],
+                                           _get_chunks_dtype(ref), key_range,
+                                           _get_nodes_key)
+    return nodes, None if region is None else (offset, offset + len(nodes))
+
+def _read_vcs_chunks_field(kb, ref, rows=None):
+    # pylint: disable=C0111
+    field, _ = vcs_chunks.read_chunks(kb, ref['table'], ref['name'],
+                                      _get_chunks_dtype(ref), rows,
+                                      _get_field_key)
+    if rows is not None:
+        field['index'] -= rows[0]
+    return field
+
 def _make_table_name(vcs, tag):
     return '%s:%s.h5' % (vcs.id, tag)
 
@@ -70,22 +186,29 @@ def _pack_in_path(table_names):
 def _unpack_path(path):
     return json.loads(path)
     
-def _get_vcs_data(kb, dos):
+def _get_vcs_tables(kb, dos):
     # pylint: disable=C0111
     for do in dos:
         do.reload()
-        if do.mimetype == mimetypes.VCS_TABLES:
-            table_names = _unpack_path(do.path)
-            nodes = kb.read_whole_table(table_names['support']['nodes'])
-            fields = {}
-            for name, table_name in table_names['fields'].iteritems():
-                fields[name] = kb.read_whole_table(table_name)
-            return nodes, fields
+        if do.mimetype in VCS_MIMETYPES:
+            return do.mimetype, _unpack_path(do.path)
     else:
         raise RuntimeError('cannot find data fields')
 
-def _save_vcs_data(kb, vcs):
+def _list_tables(do):
+    # names of all the tables used by a VCS_MIMETYPES data object
+    table_names = _unpack_path(do.path)
+    refs = [table_names['support']['nodes']] + table_names['fields'].values()
+    if do.mimetype == mimetypes.VCS_CHUNKS:
+        return sorted(set(ref['table'] for ref in refs))
+    return refs
+
+def _save_vcs_data(kb, vcs, mimetype=mimetypes.VCS_TABLES):
     # pylint: disable=C0111
+    if mimetype == mimetypes.VCS_CHUNKS:
+        return _save_vcs_chunks(kb, vcs)
+    elif mimetype != mimetypes.VCS_TABLES:
+        raise ValueError('unsupported vcs mimetype: %s' % mimetype)
     nodes = vcs.get_nodes()
     fields = vcs.get_fields()
     table_names = {'support': {}, 'fields' : {}}
@@ -110,10 +233,64 @@ def _save_vcs_data(kb, vcs):
             }
     return kb.factory.create(kb.DataObject, conf)
 
-def register_vcs(kb, vcs):
-    "Creates a permanent copy of a VariantCallSupport"
+def _save_vcs_chunks(kb, vcs):
+    # pylint: disable=C0111
+    nodes = vcs.get_nodes()
+    fields = vcs.get_fields()
+    table_name = _make_table_name(vcs, 'chunks')
+    table_names = {'support': {}, 'fields' : {}}
+    table_names['support']['nodes'] = _make_chunks_ref(table_name, 'nodes',
+                                                       nodes.dtype)
+    arrays = [('nodes', nodes, _get_nodes_key(nodes))]
+    for k in sorted(fields):
+        name = 'fields.%s' % k
+        table_names['fields'][k] = _make_chunks_ref(table_name, name,
+                                                    fields[k].dtype)
+        arrays.append((name, fields[k], _get_field_key(fields[k])))
+    sha1, size = vcs_chunks.store_chunks(kb, table_name, arrays,
+                                         vcs_chunks.CHUNK_SIZE)
+    conf = {'sample' : vcs,
+            'mimetype' : mimetypes.VCS_CHUNKS,
+            'path' : _pack_in_path(table_names),
+            'sha1' : sha1,
+            'size' : size,
+            }
+    return kb.factory.create(kb.DataObject, conf)
+
+def register_vcs(kb, vcs, mimetype=None):
+    """
+    Creates a permanent copy of a VariantCallSupport, with data stored
+    as mimetype, one of VCS_MIMETYPES, or vcs.STORAGE_MIMETYPE.
+    """
+    if mimetype is not None:
+        vcs.set_storage_mimetype(mimetype)
     vcs.save()
 
+def convert_vcs_storage(kb, vcs, mimetype=mimetypes.VCS_CHUNKS):
+    """
+    Rewrite the stored data of vcs as mimetype, one of
+    VCS_MIMETYPES, replacing its current data object and tables.
+
+    Returns the new data object, or None if vcs data is already
+    stored as mimetype.
+    """
+    if mimetype not in VCS_MIMETYPES:
+        raise ValueError('unsupported vcs mimetype: %s' % mimetype)
+    dos = kb.get_data_objects(vcs)
+    current, _ = _get_vcs_tables(kb, dos)
+    if current == mimetype:
+        return None
+    _restore_data(kb, vcs)
+    vcs.get_fields()
+    new_do = _save_vcs_data(kb, vcs, mimetype).save()
+    for do in dos:
+        if do.mimetype == current:
+            for table_name in _list_tables(do):
+                kb.delete_table(table_name)
+            kb.delete(do)
+    vcs.set_storage_mimetype(mimetype)
+    return new_do
+
 
 def delete_vcs(kb, vcs):
     "Deletes vcs from permanent storage"
@@ -123,10 +300,8 @@ def delete_vcs(kb, vcs):
 def _delete_data(kb, dos):
     for do in dos:
         do.reload()
-        if do.mimetype == mimetypes.VCS_TABLES:
-            table_names = _unpack_path(do.path)
-            kb.delete_table(table_names['support']['nodes'])
-            for table_name in table_names['fields'].values():
+        if do.mimetype in VCS_MIMETYPES:
+            for table_name in _list_tables(do):
                 kb.delete_table(table_name)
             kb.delete(do)
     else:
@@ -154,15 +329,14 @@ def create_vcs(kb, marray, reference_genome, positions, action):
     if not len(positions) == kb.genomics.get_number_of_markers(marray):
         raise ValueError('inconsistent number of markers and positions.')
     split_arrays = np_ext.argsort_split(positions)
-    vcs = _create_vcs_helper(kb, marray, reference_genome, 
-                             split_arrays[0], positions, action)
-    for indices in split_arrays[1:]:
-        vcs = vcs.union(_create_vcs_helper(kb, marray, reference_genome,
-                                           indices, positions, action))
-    return vcs
+    return VariantCallSupport.union_all(
+        [_create_vcs_helper(kb, marray, reference_genome, indices,
+                            positions, action)
+         for indices in split_arrays])
 
     
 VID_SIZE = vlu.DEFAULT_VID_LEN
+VCS_MIMETYPES = frozenset([mimetypes.VCS_TABLES, mimetypes.VCS_CHUNKS])
 
 
 class  VariantCallSupport(DataSample):
@@ -174,6 +348,8 @@ class  VariantCallSupport(DataSample):
     OME_TABLE = 'VariantCallSupport'
     __fields__ = [('referenceGenome', ReferenceGenome, wp.REQUIRED)]
 
+    STORAGE_MIMETYPE = mimetypes.VCS_TABLES
+
     CHROMOSOME_SCALE = 10**12 # this should allow up to 10**7 chromosomes
 
     #FIXME -- note that we are using a long to store integers because
@@ -185,19 +361,30 @@ class  VariantCallSupport(DataSample):
 
     def save(self):
         super(VariantCallSupport, self).save()        
-        do = _save_vcs_data(self.proxy, self)
+        do = _save_vcs_data(self.proxy, self, self.get_storage_mimetype())
         do.save()
 
+    def get_storage_mimetype(self):
+        "Mimetype used by save, STORAGE_MIMETYPE unless changed"
+        try:
+            return self.bare_getattr('_storage_mimetype')
+        except AttributeError:
+            return self.STORAGE_MIMETYPE
+
+    def set_storage_mimetype(self, mimetype):
+        "Set the mimetype used by save, one of VCS_MIMETYPES"
+        if mimetype not in VCS_MIMETYPES:
+            raise ValueError('unsupported vcs mimetype: %s' % mimetype)
+        self.bare_setattr('_storage_mimetype', mimetype)
+
     def __precleanup__(self):
         dos = self.proxy.get_data_objects(self)
         if len(dos) > 0:
             kb = self.proxy
             for do in dos:
                 do.reload()
-                if do.mimetype == mimetypes.VCS_TABLES:
-                    table_names = _unpack_path(do.path)
-                    kb.delete_table(table_names['support']['nodes'])
-                    for table_name in table_names['fields'].values():
+                if do.mimetype in VCS_MIMETYPES:
+                    for table_name in _list_tables(do):
                         kb.delete_table(table_name)
                     kb.delete(do)
                 else:
@@ -213,6 +400,7 @@ class  VariantCallSupport(DataSample):
 
         result is a numpy array of dtype NODES_DTYPE
         """
+        self._load_support()
         return np.array([], dtype=self.NODES_DTYPE) \
           if not hasattr(self, 'nodes') else self.bare_getattr('nodes')
 
@@ -224,7 +412,9 @@ class  VariantCallSupport(DataSample):
         is a numpy record array with, at least, a 'index' column that
         links records to their supporting node.
         """
-        return (self.get_fields()).get(name)
+        self._load_field(name)
+        return None if not hasattr(self, 'fields') \
+                    else self.bare_getattr('fields').get(name)
 
     def get_fields(self):
         """
@@ -234,6 +424,10 @@ class  VariantCallSupport(DataSample):
         numpy record array with, at least, a 'index' column that links
         records to their supporting node.
         """
+        source = self._get_source()
+        if source is not None:
+            for name in source['fields'].keys():
+                self._load_field(name)
         return {} if not hasattr(self, 'fields') \
                   else self.bare_getattr('fields')
 
@@ -263,7 +457,7 @@ class  VariantCallSupport(DataSample):
         vcs.define_field('origin', np.array(data, 
                                             dtype=[('index', '<i4'), ...]))
         """
-        if self.nodes is None:
+        if len(self.get_nodes()) == 0:
             raise RuntimeError('no support, cannot associate field')
         if (field['index'].min() < 0  
             or field['index'].max() >= len(self.get_nodes())):
@@ -288,16 +482,72 @@ class  VariantCallSupport(DataSample):
         nchromosomes], and pos is a positive int. The region selected
         goes from gc_range[0] included to gc_range[1] excluded.
         """
+        return self.selections([gc_range])[0]
+
+    def selections(self, gc_ranges):
+        """
+        Extract the subregions identified by gc_ranges, a sequence of
+        ranges in the format used by selection, in a single pass.
+
+        Range bounds are found with a binary search on the genomic
+        positions of nodes, which are computed once and cached.
+        """
+        gpos = self._get_nodes_gpos()
+        ranges = np.array(gc_ranges, dtype=np.int64).reshape(-1, 2, 2)
+        begs = self._get_gpos(ranges[:, 0, 0], ranges[:, 0, 1])
+        ends = self._get_gpos(ranges[:, 1, 0], ranges[:, 1, 1])
+        lo = np.searchsorted(gpos, begs)
+        hi = np.maximum(lo, np.searchsorted(gpos, ends))
+        return list(self._iter_slices(lo, hi))
+
+    def iter_windows(self, size):
+        """
+        Iterate over the non empty windows of length size, aligned to
+        multiples of size within each chromosome, yielding
+        (gc_range, vcs) pairs, where vcs is the selection of gc_range.
+        """
         nodes = self.get_nodes()
-        fields = self.get_fields()
-        beg, end = [self._get_gpos(x[0], x[1]) for x in gc_range]
-        gpos = self._get_gpos(nodes['chrom'], nodes['pos'])
-        sel = (gpos >= beg) & (gpos < end)
-        mapped_index = sel.cumsum() - 1 # 
-        nfields = {}
-        for k in fields:
-            nfields[k] = self._fix_field_index(fields[k], sel, mapped_index)
-        return self._clone_structure(nodes[sel], nfields)
+        starts = nodes['pos'] // size * size
+        keys = self._get_gpos(nodes['chrom'], starts)
+        lo = np.flatnonzero(np.hstack([[True], keys[1:] != keys[:-1]])
+                            if len(keys) > 0 else keys)
+        hi = np.hstack([lo[1:], [len(nodes)]]).astype(lo.dtype)
+        for i, vcs in it.izip(lo, self._iter_slices(lo, hi)):
+            chrom, beg = nodes['chrom'][i], starts[i]
+            yield ((chrom, beg), (chrom, beg + size)), vcs
+
+    def overlaps(self, intervals, length_field=None, length_column='length'):
+        """
+        Find the intervals each node overlaps.
+
+        intervals is a sequence of ranges in the format used by
+        selection. Nodes are single positions, unless length_field is
+        given: then each node spans, starting from its position, the
+        largest value of length_column among the records of
+        length_field that refer to it (e.g., the length of an indel).
+
+        Returns two arrays of the same size, with node and interval
+        indices, one element for each overlapping pair, sorted by node
+        and then by interval. Node extents are kept sorted by start,
+        with a running maximum of their ends, so candidate nodes are
+        found with a binary search for each interval.
+        """
+        starts, ends, max_ends = self._get_nodes_extent(length_field,
+                                                        length_column)
+        ranges = np.array(intervals, dtype=np.int64).reshape(-1, 2, 2)
+        begs = self._get_gpos(ranges[:, 0, 0], ranges[:, 0, 1])
+        stops = self._get_gpos(ranges[:, 1, 0], ranges[:, 1, 1])
+        lo = np.searchsorted(max_ends, begs, side='right')
+        hi = np.searchsorted(starts, stops)
+        counts = np.maximum(hi - lo, 0)
+        counts[stops <= begs] = 0
+        ivals = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.cumsum(counts) - counts
+        nodes = np.repeat(lo - offsets, counts) + np.arange(counts.sum())
+        keep = ends[nodes] > begs[ivals]
+        nodes, ivals = nodes[keep], ivals[keep]
+        order = np.lexsort((ivals, nodes))
+        return nodes[order], ivals[order]
 
     def union(self, other):
         """
@@ -312,11 +562,77 @@ class  VariantCallSupport(DataSample):
                         self._unite_fields(other, shuffle, s_isct, 
                                            o_isct, o_sel))
         
+    @classmethod
+    def union_all(cls, vcs_list):
+        """
+        return the union of all the vcs in vcs_list.
+
+        Same as vcs_list[0].union(vcs_list[1]).union(...), but the
+        (sorted) nodes of all vcs are combined with a single k-way
+        merge, and fields are remapped and deduplicated only once.
+        """
+        merged, positions, fields = cls._merge_all(vcs_list)
+        keep = np.hstack([[True], merged[1:] != merged[:-1]])[:len(merged)]
+        new_index = keep.cumsum() - 1
+        nodes = np.empty(keep.sum(), dtype=cls.NODES_DTYPE)
+        for vcs, pos in it.izip(vcs_list, positions):
+            nodes[new_index[pos]] = vcs.get_nodes()
+        maps = [new_index[pos] for pos in positions]
+        return vcs_list[0]._clone_structure(
+            nodes, cls._merge_all_fields(fields, None, maps))
+
+    @classmethod
+    def intersection_all(cls, vcs_list):
+        """
+        return the intersection of all the vcs in vcs_list.
+
+        Same as vcs_list[0].intersection(vcs_list[1]).intersection(...),
+        with a single k-way merge of the nodes of all vcs.
+        """
+        merged, positions, fields = cls._merge_all(vcs_list)
+        flag = np.hstack([[True], merged[1:] != merged[:-1]])[:len(merged)]
+        counts = np.diff(np.hstack([np.flatnonzero(flag), [len(merged)]]))
+        common = counts == len(vcs_list)
+        unique_index = flag.cumsum() - 1
+        new_index = common.cumsum() - 1
+        sels, maps = [], []
+        for pos in positions:
+            sels.append(common[unique_index[pos]])
+            maps.append(new_index[unique_index[pos]])
+        nodes = vcs_list[0].get_nodes()[sels[0]]
+        return vcs_list[0]._clone_structure(
+            nodes, cls._merge_all_fields(fields, sels, maps))
+
+    @classmethod
+    def _merge_all(cls, vcs_list):
+        # pylint: disable=C0111
+        if not vcs_list:
+            raise ValueError('vcs_list is empty')
+        for other in vcs_list[1:]:
+            vcs_list[0]._check_other(other)
+        merged, positions = np_ext.merge_sorted(
+            [vcs._get_nodes_gpos() for vcs in vcs_list])
+        return merged, positions, [vcs.get_fields() for vcs in vcs_list]
+
+    @classmethod
+    def _merge_all_fields(cls, fields, sels, maps):
+        # pylint: disable=C0111
+        merged = {}
+        for k in set(k for fs in fields for k in fs):
+            chunks = []
+            for i, fs in enumerate(fields):
+                if k in fs:
+                    chunks.append(cls._fix_field_index(
+                        fs[k], None if sels is None else sels[i], maps[i]))
+            merged[k] = cls._kill_duplicates(np.hstack(chunks))
+        return merged
+
     def _get_union_selectors(self, other):
         # pylint: disable=C0111
         self_nodes = self.get_nodes()
         other_nodes = other.get_nodes()
-        self_isct, other_isct = np_ext.index_intersect(self_nodes, other_nodes)
+        self_isct, other_isct = np_ext.index_intersect_sorted(
+            self._get_nodes_gpos(), other._get_nodes_gpos())
         self_sel = np.ones((len(self_nodes),), dtype=np.bool)
         other_sel = np.ones((len(other_nodes),), dtype=np.bool)
         other_sel[other_isct] = False
@@ -358,7 +674,8 @@ class  VariantCallSupport(DataSample):
         # pylint: disable=C0111        
         self_nodes = self.get_nodes()
         other_nodes = other.get_nodes()
-        self_isct, other_isct = np_ext.index_intersect(self_nodes, other_nodes)
+        self_isct, other_isct = np_ext.index_intersect_sorted(
+            self._get_nodes_gpos(), other._get_nodes_gpos())
         self_sel = np.zeros((len(self_nodes),), dtype=np.bool)
         self_sel[self_isct] = True
         other_sel = np.zeros((len(other_nodes),), dtype=np.bool)
@@ -399,8 +716,8 @@ class  VariantCallSupport(DataSample):
     def _get_complement_selectors(self, other):
         # pylint: disable=C0111        
         self_nodes = self.get_nodes()
-        other_nodes = other.get_nodes()
-        self_isct, other_isct = np_ext.index_intersect(self_nodes, other_nodes)
+        self_isct, other_isct = np_ext.index_intersect_sorted(
+            self._get_nodes_gpos(), other._get_nodes_gpos())
         self_sel = np.ones((len(self_nodes),), dtype=np.bool)
         self_sel[self_isct] = False
         self_isct = np.arange(0, len(self_nodes))[self_sel]
@@ -421,6 +738,98 @@ class  VariantCallSupport(DataSample):
     def _define_support(self, nodes):
         self.bare_setattr('nodes', nodes)
 
+    def _get_nodes_gpos(self):
+        nodes = self.get_nodes()
+        try:
+            cached_nodes, gpos = self.bare_getattr('_gpos')
+            if cached_nodes is nodes:
+                return gpos
+        except AttributeError:
+            pass
+        gpos = self._get_gpos(nodes['chrom'], nodes['pos'])
+        self.bare_setattr('_gpos', (nodes, gpos))
+        return gpos
+
+    def _get_nodes_extent(self, length_field=None, length_column='length'):
+        # (starts, ends, running maximum of ends) of nodes, as gpos
+        starts = self._get_nodes_gpos()
+        field = None
+        if length_field is not None:
+            field = self.get_field(length_field)
+            if field is None:
+                raise ValueError('unknown field: %s' % length_field)
+        key = (starts, field, length_column)
+        try:
+            cached_key, extent = self.bare_getattr('_extent')
+            if all(a is b for a, b in zip(cached_key, key)):
+                return extent
+        except AttributeError:
+            pass
+        ends = starts + 1
+        if field is not None:
+            index = field['index']
+            np.maximum.at(ends, index, starts[index] + field[length_column])
+        extent = starts, ends, np.maximum.accumulate(ends)
+        self.bare_setattr('_extent', (key, extent))
+        return extent
+
+    def _iter_slices(self, lo, hi):
+        # nodes [lo[i], hi[i]) with their fields, for each i
+        nodes = self.get_nodes()
+        fields = self.get_fields()
+        bounds = {}
+        for k, field in fields.iteritems():
+            index = field['index']
+            if np.alltrue(index[1:] >= index[:-1]):
+                bounds[k] = (np.searchsorted(index, lo),
+                             np.searchsorted(index, hi))
+        for i, (beg, end) in enumerate(it.izip(lo, hi)):
+            nfields = {}
+            for k, field in fields.iteritems():
+                if k in bounds:
+                    nfield = field[bounds[k][0][i]:bounds[k][1][i]].copy()
+                else:
+                    index = field['index']
+                    nfield = field[(index >= beg) & (index < end)]
+                nfield['index'] -= beg
+                nfields[k] = nfield
+            yield self._clone_structure(nodes[beg:end].copy(), nfields)
+
+    def _define_source(self, source):
+        # previously loaded data, if any, is replaced by the source's
+        self.bare_setattr('_source', source)
+        self.bare_setattr('fields', {})
+
+    def _get_source(self):
+        try:
+            return self.bare_getattr('_source')
+        except AttributeError:
+            return None
+
+    def _load_support(self):
+        source = self._get_source()
+        if source is None or source['nodes'] is None:
+            return
+        ref, source['nodes'] = source['nodes'], None
+        if source['mimetype'] == mimetypes.VCS_CHUNKS:
+            nodes, source['rows'] = _read_vcs_chunks(source['kb'], ref,
+                                                     source['region'])
+        else:
+            nodes = _read_vcs_table(source['kb'], ref, source['rows'])
+        self._define_support(nodes)
+
+    def _load_field(self, name):
+        source = self._get_source()
+        if source is None or name not in source['fields']:
+            return
+        if source['mimetype'] == mimetypes.VCS_CHUNKS:
+            self._load_support()
+            read_field = _read_vcs_chunks_field
+        else:
+            read_field = _read_vcs_field
+        ref = source['fields'].pop(name)
+        self._define_field(name, read_field(source['kb'], ref, source['rows']))
+
     @classmethod            
     def _get_gpos(cls, chrom, pos):
         return chrom*cls.CHROMOSOME_SCALE + pos
@@ -468,8 +877,8 @@ class  VariantCallSupport(DataSample):
     def _check_other(self, other):
         if not isinstance(other, type(self)):
             raise ValueError('other is of an incompatible type')
-        if other.nodes is None:
-            raise ValueError('other.nodes is None')
+        if len(other.get_nodes()) == 0:
+            raise ValueError('other has no support')
         if self.referenceGenome != other.referenceGenome:
             raise ValueError('other has a different referenceGenome')
             
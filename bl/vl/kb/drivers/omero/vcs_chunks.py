@@ -0,0 +1,173 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Chunked VCS storage
+===================
+
+Records arrays, e.g., the nodes and fields of a VariantCallSupport,
+stored as compressed chunks of at most CHUNK_SIZE records, one omero
+table row per chunk.  Within a chunk, integer columns are delta
+encoded and string columns (e.g., origin vids) are dictionary
+encoded; the result is then compressed.
+
+Each array is given a name and a sorted key (e.g., the genomic
+position of nodes or the index column of fields): chunk rows record
+the range of keys they hold, so that a key range can be read without
+fetching the other chunks.
+
+.. code-block:: python
+
+   sha1, size = store_chunks(kb, 'foo.h5', [('nodes', nodes, gpos)])
+   nodes, offset = read_chunks(kb, 'foo.h5', 'nodes', nodes.dtype,
+                               key_range=(lo, hi), key_func=get_gpos)
+"""
+
+import hashlib, base64
+from cStringIO import StringIO
+
+import numpy as np
+
+
+CHUNK_SIZE = 2**16
+META_COLS = ['name', 'offset', 'n_records', 'lo', 'hi']
+
+def TABLE_COLS(name_size, data_size):
+  cols = [
+    ('string', 'name', 'array name', name_size, None),
+    ('long', 'offset', 'position of the first record in the array', None),
+    ('long', 'n_records', 'number of records', None),
+    ('long', 'lo', 'smallest key', None),
+    ('long', 'hi', 'largest key', None),
+    ('string', 'data', 'encoded records', data_size, None),
+    ]
+  return cols
+
+
+def _smallest_int_dtype(a):
+  if a.size == 0:
+    return np.int8
+  lo, hi = a.min(), a.max()
+  for t in np.int8, np.int16, np.int32:
+    info = np.iinfo(t)
+    if info.min <= lo and hi <= info.max:
+      return t
+  return np.int64
+
+
+def encode_chunk(records):
+  """
+  Encode records as a compressed, base64 encoded, string.
+  """
+  arrays = {}
+  for i, k in enumerate(records.dtype.names):
+    col = records[k]
+    if col.dtype.kind in 'iu':
+      delta = np.diff(col.astype(np.int64))
+      delta = np.hstack([col[:1].astype(np.int64), delta])
+      arrays['d%d' % i] = delta.astype(_smallest_int_dtype(delta))
+    elif col.dtype.kind == 'S':
+      values, codes = np.unique(col, return_inverse=True)
+      arrays['v%d' % i] = values
+      arrays['c%d' % i] = codes.astype(_smallest_int_dtype(codes))
+    else:
+      arrays['r%d' % i] = col
+  f = StringIO()
+  np.savez_compressed(f, **arrays)
+  return base64.b64encode(f.getvalue())
+
+
+def decode_chunk(data, dtype):
+  """
+  Decode a string built by encode_chunk into a records array of
+  type dtype.
+  """
+  arrays = np.load(StringIO(base64.b64decode(data)))
+  n = None
+  columns = {}
+  for i, k in enumerate(dtype.names):
+    if 'd%d' % i in arrays.files:
+      columns[k] = np.cumsum(arrays['d%d' % i], dtype=np.int64)
+    elif 'v%d' % i in arrays.files:
+      columns[k] = arrays['v%d' % i][arrays['c%d' % i]]
+    else:
+      columns[k] = arrays['r%d' % i]
+    n = len(columns[k])
+  records = np.zeros(n or 0, dtype=dtype)
+  for k, col in columns.iteritems():
+    records[k] = col
+  return records
+
+
+def store_chunks(kb, table_name, arrays, chunk_size=CHUNK_SIZE):
+  """
+  Store arrays, a sequence of (name, records, keys) tuples where keys
+  is a sorted integer array as long as records, in a new table called
+  table_name.
+
+  Return the sha1 and size of the raw records bytes, computed chunk
+  by chunk, i.e., without building any other copy of the arrays.
+  """
+  sha1, size = hashlib.sha1(), 0
+  columns = dict((k, []) for k in META_COLS + ['data'])
+  for name, records, keys in arrays:
+    for offset in xrange(0, len(records), chunk_size):
+      chunk = np.ascontiguousarray(records[offset:offset + chunk_size])
+      chunk_keys = keys[offset:offset + chunk_size]
+      sha1.update(chunk.data)
+      size += chunk.nbytes
+      columns['name'].append(name)
+      columns['offset'].append(offset)
+      columns['n_records'].append(len(chunk))
+      columns['lo'].append(int(chunk_keys.min()))
+      columns['hi'].append(int(chunk_keys.max()))
+      columns['data'].append(encode_chunk(chunk))
+  name_size = max([len(x) for x in columns['name']] + [1])
+  data_size = max([len(x) for x in columns['data']] + [1])
+  kb.create_table(table_name, TABLE_COLS(name_size, data_size))
+  if columns['name']:
+    kb.add_table_columns_from_stream(table_name, [columns])
+  return sha1.hexdigest(), size
+
+
+def read_meta(kb, table_name):
+  """
+  Return the META_COLS columns of all chunks stored in table_name.
+  """
+  n_rows = kb.get_number_of_rows(table_name)
+  if n_rows == 0:
+    return np.zeros(0, dtype=[('name', '|S1'), ('offset', '<i8'),
+                              ('n_records', '<i8'), ('lo', '<i8'),
+                              ('hi', '<i8')])
+  return kb.get_table_slice(table_name, range(n_rows), col_names=META_COLS)
+
+
+def read_chunks(kb, table_name, name, dtype, key_range=None, key_func=None):
+  """
+  Read the records of array name, of type dtype, from table_name.
+
+  If key_range, a (lo, hi) pair, is given, only the chunks that hold
+  keys in [lo, hi) are fetched, and only the records whose key, as
+  computed by key_func(records), is in that range are returned.
+  Return (records, offset), where offset is the position, within
+  the whole array, of the first returned record.
+  """
+  meta = read_meta(kb, table_name)
+  sel = meta['name'] == name
+  if key_range is not None:
+    lo, hi = key_range
+    sel &= (meta['lo'] < hi) & (meta['hi'] >= lo)
+  rows = np.flatnonzero(sel)
+  if len(rows) == 0:
+    return np.zeros(0, dtype=dtype), 0
+  rows = rows[np.argsort(meta['offset'][rows])]
+  data = kb.get_table_slice(table_name, [int(r) for r in rows],
+                            col_names=['data'])['data']
+  records = np.concatenate([decode_chunk(d, dtype) for d in data])
+  offset = int(meta['offset'][rows[0]])
+  if key_range is not None:
+    keys = key_func(records)
+    selected = np.flatnonzero((keys >= lo) & (keys < hi))
+    offset += int(selected[0]) if len(selected) > 0 else 0
+    records = records[selected]
+  return records, offset
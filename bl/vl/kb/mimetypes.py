@@ -2,7 +2,9 @@
 # END_COPYRIGHT
 
 GDO_TABLE = 'x-bl/gdo-table'
+GDO_QTABLE = 'x-bl/gdo-qtable'
 VCS_TABLES = 'x-bb/vcs-tables'
+VCS_CHUNKS = 'x-bb/vcs-chunks'
 SSC_FILE = 'x-ssc-messages'
 CEL_FILE = 'x-vl/affymetrix-cel'
 SAM_FILE = 'x-vl/sam'
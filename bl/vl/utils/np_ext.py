@@ -31,6 +31,85 @@ def index_intersect(a1, a2):
   mask = b[:-1]['item'] == b[1:]['item']
   return b[1:][mask]['idx'] - a2.size, b[mask]['idx']
 
+def index_intersect_sorted(a1, a2, assume_sorted=True):
+  """
+  Same as index_intersect, for arrays a1 and a2 that are sorted in
+  strictly increasing order, e.g., VCS node positions.
+
+  The shorter array is binary searched into the longer one, which
+  takes O(min(n, m) log max(n, m)) time, with no concatenated copy and
+  no sorting. If assume_sorted is False, inputs are checked, in
+  linear time, and ValueError is raised if they are not strictly
+  increasing.
+  """
+  if a1.dtype != a2.dtype:
+    raise ValueError("arrays must be of the same type")
+  if not assume_sorted:
+    for a in a1, a2:
+      if not np.all(a[1:] > a[:-1]):
+        raise ValueError("arrays must be strictly increasing")
+  swap = a1.size > a2.size
+  small, large = (a2, a1) if swap else (a1, a2)
+  if small.size == 0 or large.size == 0:
+    return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+  pos = np.minimum(np.searchsorted(large, small), large.size - 1)
+  found = large[pos] == small
+  i_small, i_large = np.flatnonzero(found), pos[found]
+  return (i_large, i_small) if swap else (i_small, i_large)
+
+def sorted_lookup(sorted_a, keys, order=None):
+  """
+  Find the positions of keys in the sorted array sorted_a, with a
+  vectorized binary search. If sorted_a = a[order], positions are
+  given with respect to a. Keys not in sorted_a get -1.
+
+  .. code:: python
+      a = array(['c', 'a', 'b'])
+      order = a.argsort()
+      sorted_lookup(a[order], ['b', 'x', 'c'], order)
+      >>> array([ 2, -1,  0])
+  """
+  keys = np.asarray(keys)  # not cast to sorted_a.dtype: could truncate
+  if sorted_a.size == 0 or keys.size == 0:
+    return -np.ones(keys.shape, dtype=np.int64)
+  pos = np.searchsorted(sorted_a, keys)
+  pos = np.minimum(pos, sorted_a.size - 1)
+  found = sorted_a[pos] == keys
+  if order is not None:
+    pos = order[pos]
+  return np.where(found, pos, -1)
+
+def merge_sorted(arrays):
+  """
+  Merge a list of sorted one dimensional arrays with a balanced tree
+  of pairwise merges, each one placing elements with a binary search
+  rather than sorting. Ties keep the order of arrays.
+
+  Return the merged array and a list with, for each input array,
+  the positions of its elements in the merged one.
+
+  .. code:: python
+      merge_sorted([array([1, 4]), array([2, 3, 4])])
+      >>> (array([1, 2, 3, 4, 4]), [array([0, 3]), array([1, 2, 4])])
+  """
+  if not arrays:
+    raise ValueError("nothing to merge")
+  parts = [(a, [np.arange(len(a))]) for a in map(np.asarray, arrays)]
+  while len(parts) > 1:
+    merged = []
+    for i in xrange(0, len(parts) - 1, 2):
+      (a, a_pos), (b, b_pos) = parts[i], parts[i + 1]
+      ia = np.arange(len(a)) + np.searchsorted(b, a, side='left')
+      ib = np.arange(len(b)) + np.searchsorted(a, b, side='right')
+      c = np.empty(len(a) + len(b), dtype=a.dtype)
+      c[ia] = a
+      c[ib] = b
+      merged.append((c, [ia[p] for p in a_pos] + [ib[p] for p in b_pos]))
+    if len(parts) % 2:
+      merged.append(parts[-1])
+    parts = merged
+  return parts[0]
+
 def argsort_split(a, kind='mergesort'):
   """
   Return a list of indices arrays that sort subsets of a in a strictly
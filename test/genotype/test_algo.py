@@ -1,7 +1,7 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
-import sys, unittest, itertools as it
+import sys, os, unittest, tempfile, shutil, time, itertools as it
 import numpy as np
 
 import bl.vl.genotype.algo as algo
@@ -26,6 +26,52 @@ class TestProjectToDiscreteGenotype(unittest.TestCase):
     self.__check_gt(0.1, [1, 3, 2, 0])
 
 
+class TestProjectToDiscreteGenotypes(unittest.TestCase):
+
+  def setUp(self):
+    S, N = 23, 40
+    self.probs = np.empty((S, 2, N), dtype=np.float32)
+    for i in xrange(S):
+      self.probs[i], _ = algo.generate_data(N, conf_sigma=0.2)
+    # ties and deterministic calls
+    self.probs[0, :, :6] = [[0.5, 0.0, 0.4, 1.0, 0.0, 0.0],
+                            [0.5, 0.5, 0.2, 0.0, 1.0, 0.0]]
+    # missing values
+    self.probs[1, 0, 3] = np.nan
+    self.probs[2, :, 7] = np.nan
+    self.wd = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.wd)
+
+  def __check(self, codes, threshold):
+    self.assertEqual(codes.dtype, np.uint8)
+    for p, c in it.izip(self.probs, codes):
+      expected = algo.project_to_discrete_genotype(p, threshold=threshold)
+      self.assertEqual(c.tolist(), expected.tolist())
+
+  def test_against_single(self):
+    for threshold in 0.2, 1.0, 0.05:
+      for block_size in 1, 5, 100:
+        self.__check(algo.project_to_discrete_genotypes(
+          self.probs, threshold=threshold, block_size=block_size), threshold)
+    self.assertRaises(ValueError, algo.project_to_discrete_genotypes,
+                      self.probs[:, :1])
+    self.assertRaises(ValueError, algo.project_to_discrete_genotypes,
+                      self.probs, out=np.empty((1, 1), dtype=np.uint8))
+
+  def test_memmap(self):
+    fn = os.path.join(self.wd, 'probs.npy')
+    np.save(fn, self.probs)
+    probs = np.load(fn, mmap_mode='r')
+    out = np.lib.format.open_memmap(os.path.join(self.wd, 'codes.npy'),
+                                    mode='w+', dtype=np.uint8,
+                                    shape=(probs.shape[0], probs.shape[2]))
+    res = algo.project_to_discrete_genotypes(probs, out=out, block_size=4)
+    self.assertTrue(res is out)
+    self.__check(out, 0.2)
+
+
 class TestCountHomozigotes(unittest.TestCase):
 
   def setUp(self):
@@ -54,6 +100,126 @@ class TestCountHomozigotes(unittest.TestCase):
       self.assertEqual(c.tolist(), exp_c)
 
 
+class TestGenotypeStats(unittest.TestCase):
+
+  def setUp(self):
+    S, N = 50, 30
+    self.probs = np.empty((S, 2, N), dtype=np.float32)
+    self.confs = np.empty((S, N), dtype=np.float32)
+    for i in xrange(S):
+      self.probs[i], self.confs[i] = algo.generate_data(N)
+    self.wd = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.wd)
+
+  def __check_stats(self, stats):
+    S = len(self.probs)
+    self.assertEqual(stats.n_samples, S)
+    self.assertTrue(np.allclose(stats.sums,
+                                self.probs.sum(axis=0, dtype=np.float64)))
+    self.assertTrue(np.allclose(stats.call_rate(),
+                                (self.confs <= stats.threshold).mean(axis=0)))
+    counts = algo.count_homozygotes(dict(probs=p) for p in self.probs)
+    self.assertEqual(stats.get_counts()[0], counts[0])
+    self.assertEqual(stats.get_counts()[1].tolist(), counts[1].tolist())
+    self.assertTrue(np.allclose(stats.maf(), algo.maf(None, counts)))
+    self.assertTrue(np.allclose(stats.hwe(), algo.hwe(None, counts)))
+
+  def test_blocks(self):
+    N = self.probs.shape[-1]
+    blocks = algo.iter_blocks(self.probs, self.confs, block_size=7)
+    self.__check_stats(algo.reduce_blocks(blocks, N))
+    stats = algo.GenotypeStats(N)
+    for p, c in it.izip(self.probs, self.confs):
+      stats.update(p, c)
+    self.__check_stats(stats)
+    s1 = algo.reduce_blocks(algo.iter_blocks(self.probs[:20], self.confs[:20]),
+                            N)
+    s2 = algo.reduce_blocks(algo.iter_blocks(self.probs[20:], self.confs[20:]),
+                            N)
+    self.__check_stats(s1.merge(s2))
+    self.assertRaises(ValueError, stats.merge, algo.GenotypeStats(N + 1))
+    self.assertRaises(ValueError, stats.update, self.probs[:, :, 1:])
+    self.assertTrue(algo.GenotypeStats(N).update(self.probs).call_rate()
+                    is None)
+
+  def test_nan(self):
+    N = self.probs.shape[-1]
+    self.probs[3, 0, 2] = np.nan
+    self.probs[7, :, 5] = np.nan
+    valid = ~np.isnan(self.probs).any(axis=1)
+    stats = algo.reduce_blocks(algo.iter_blocks(self.probs, self.confs,
+                                                block_size=4), N)
+    self.assertEqual(stats.n_samples, len(self.probs))
+    self.assertEqual(stats.n_valid.tolist(), valid.sum(axis=0).tolist())
+    sums = np.where(valid[:, np.newaxis], self.probs, 0).sum(
+      axis=0, dtype=np.float64)
+    self.assertTrue(np.allclose(stats.sums, sums))
+    counts = valid.sum(axis=0), np.rint(sums).astype(np.int32)
+    self.assertTrue(np.allclose(stats.maf(), algo.maf(None, counts)))
+    self.assertTrue(np.allclose(stats.hwe(), algo.hwe(None, counts)))
+
+  def test_reduce_genotypes(self):
+    for processes in 1, 3:
+      self.__check_stats(algo.reduce_genotypes(
+        self.probs, self.confs, block_size=10, processes=processes))
+    paths = [os.path.join(self.wd, '%s.npy' % k) for k in 'probs', 'confs']
+    np.save(paths[0], self.probs)
+    np.save(paths[1], self.confs)
+    self.__check_stats(algo.reduce_genotypes(paths[0], paths[1],
+                                             block_size=10, processes=3))
+    self.__check_stats(algo.reduce_genotypes(paths[0], self.confs,
+                                             block_size=10, processes=3))
+
+
+class TestHwe(unittest.TestCase):
+
+  def setUp(self):
+    rs = np.random.RandomState(0)
+    self.N = 60
+    n_markers = 2000
+    freqs = rs.random_sample(n_markers) ** 3
+    genotypes = np.array([rs.multinomial(self.N, [f**2, 2*f*(1-f), (1-f)**2])
+                          for f in freqs])
+    n_a = 2*genotypes[:, 0] + genotypes[:, 1]
+    n_a = np.minimum(n_a, 2*self.N - n_a)
+    # hwe_scalar does not support markers with a single minor allele
+    keep = n_a != 1
+    self.n_a, self.n_ab = n_a[keep], genotypes[keep, 1]
+
+  def test_against_scalar(self):
+    expected = np.array([algo.hwe_scalar(a, ab, self.N)
+                         for a, ab in it.izip(self.n_a, self.n_ab)])
+    for _ in xrange(2):  # the second time, from the cache
+      res = algo.hwe_exact(self.n_a, self.n_ab, self.N)
+      self.assertEqual(res.shape, expected.shape)
+      self.assertTrue(np.allclose(res, expected, rtol=1e-6, atol=1e-12))
+    res = algo.hwe_exact(2*self.N - self.n_a, self.n_ab, self.N)
+    self.assertTrue(np.allclose(res, expected, rtol=1e-6, atol=1e-12))
+    self.assertTrue(np.allclose(
+      algo.hwe_exact(self.n_a[:20], self.n_ab[:20], [[self.N], [self.N]]),
+      [expected[:20], expected[:20]], rtol=1e-6, atol=1e-12))
+    self.assertTrue(np.isnan(algo.hwe_exact([4, 4], [5, 1], self.N)).all())
+
+  def test_hwe(self):
+    homs = np.vstack([(self.n_a - self.n_ab) // 2,
+                      (2*self.N - self.n_a - self.n_ab) // 2])
+    counts = self.N, homs.astype(np.int32)
+    self.assertTrue(np.allclose(algo.hwe(None, counts),
+                                algo.hwe_vector(self.n_a, self.n_ab, self.N)))
+
+  def test_performance(self):
+    n_markers = 10**6
+    n_a = np.tile(self.n_a, n_markers // len(self.n_a) + 1)[:n_markers]
+    n_ab = np.tile(self.n_ab, n_markers // len(self.n_ab) + 1)[:n_markers]
+    for name in 'hwe_vector', 'hwe_exact':
+      t0 = time.time()
+      getattr(algo, name)(n_a, n_ab, self.N)
+      print
+      print "%s: finished in %.3f s" % (name, time.time()-t0)
+
+
 class TestGenerateData(unittest.TestCase):
 
   SIZE = 10000
@@ -84,7 +250,15 @@ def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestProjectToDiscreteGenotype('test_no_threshold'))
   suite.addTest(TestProjectToDiscreteGenotype('test_threshold'))
+  suite.addTest(TestProjectToDiscreteGenotypes('test_against_single'))
+  suite.addTest(TestProjectToDiscreteGenotypes('test_memmap'))
   suite.addTest(TestCountHomozigotes('test_no_threshold'))
+  suite.addTest(TestGenotypeStats('test_blocks'))
+  suite.addTest(TestGenotypeStats('test_reduce_genotypes'))
+  suite.addTest(TestGenotypeStats('test_nan'))
+  suite.addTest(TestHwe('test_against_scalar'))
+  suite.addTest(TestHwe('test_hwe'))
+  #suite.addTest(TestHwe('test_performance'))
   suite.addTest(TestGenerateData('runTest'))
   return suite
 
@@ -11,6 +11,7 @@ import numpy as np
 
 from bl.vl.kb import KnowledgeBase as KB
 from bl.vl.genotype.io import PedWriter
+import bl.vl.genotype.algo as algo
 
 from common import UTCommon
 
@@ -139,17 +140,77 @@ class TestPedWriter(UTCommon):
             
         base_path = os.path.join(self.wd, "test")
         print "\nwriting to %s*" % base_path
-        family = self.kb.get_individuals(self.study)
+        family = list(self.kb.get_individuals(self.study))
         vcs = vcs_0.union(vcs_1)
-        pw = PedWriter(vcs, base_path=base_path)
+        # blocks smaller than the family, with a partial last one
+        pw = PedWriter(vcs, base_path=base_path, block_size=N_I - 1)
         pw.write_map()
         pw.write_family(self.study.id, family, gds_by_individual)
         pw.close()
+        patterns = {0: 'A A', 1: 'B B', 2: 'A B', 3: '0 0'}
+        origin = vcs.get_field('origin')
+        with open(base_path + '.ped') as f:
+            lines = [l.rstrip('\n').split('\t') for l in f]
+        self.assertEqual(len(lines), len(family))
+        for fields in lines:
+            probs = np.zeros((2, len(vcs)), dtype=np.float32)
+            for mid, ds in gds_by_individual[fields[1]].iteritems():
+                sel = origin['vid'] == mid
+                probs[:, sel], _ = ds.resolve_to_data(origin['vpos'][sel])
+            self.assertEqual(fields[6:], [
+                patterns[x] for x in algo.project_to_discrete_genotype(probs)])
         
+    def test_nan(self):
+        N_I = 3
+        N_M = 8
+        mset, _ = self.create_markers_set_from_stream(N_M)
+        self.kill_list.append(mset)
+        vcs = self.create_variant_call_support(mset, self.reference_genome,
+                                               self.action)
+        self.kill_list.append(vcs)
+        gds_by_individual, probs_by_individual = {}, {}
+        for _ in xrange(N_I):
+            _, enr = self.create_enrollment(study=self.study)
+            self.kill_list.append(enr.save())
+            _, action = self.create_action(self.kb.ActionOnIndividual,
+                                           enr.individual)
+            self.kill_list.append(action.save())
+            action.reload()
+            data_sample = self.create_data_sample(mset,
+                                                  self.make_random_str(),
+                                                  action)
+            self.kill_list.append(data_sample)
+            data_obj, probs, confs = self.create_data_object(data_sample,
+                                                             action,
+                                                             add_nan=True)
+            self.kill_list.append(data_obj)
+            gds_by_individual[enr.individual.id] = data_sample
+            probs_by_individual[enr.individual.id] = probs
+        base_path = os.path.join(self.wd, "test")
+        family = list(self.kb.get_individuals(self.study))
+        pw = PedWriter(vcs, base_path=base_path, block_size=2)
+        pw.write_family(self.study.id, family, gds_by_individual)
+        pw.close()
+        patterns = {0: 'A A', 1: 'B B', 2: 'A B', 3: '0 0'}
+        with open(base_path + '.ped') as f:
+            lines = [l.rstrip('\n').split('\t') for l in f]
+        self.assertEqual(len(lines), len(family))
+        for fields in lines:
+            probs = probs_by_individual[fields[1]]
+            missing = np.isnan(probs).any(axis=0)
+            self.assertTrue(missing.any())
+            genotypes = np.array(fields[6:])
+            self.assertTrue((genotypes[missing] == '0 0').all())
+            codes = algo.project_to_discrete_genotype(probs)
+            self.assertTrue((codes[missing] == 3).all())
+            self.assertEqual(genotypes.tolist(),
+                             [patterns[x] for x in codes])
+
 def suite():
   suite = unittest.TestSuite()
   #suite.addTest(TestPedWriter('test_base'))
   suite.addTest(TestPedWriter('test_multi'))  
+  suite.addTest(TestPedWriter('test_nan'))
   return suite
 
 
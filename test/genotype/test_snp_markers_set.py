@@ -3,15 +3,18 @@
 
 import unittest, time, os, random
 import itertools as it
-import tempfile
+import tempfile, shutil
 import numpy as np
 
 from bl.vl.kb import KnowledgeBase as KB
+from bl.vl.kb import mimetypes
 from bl.vl.kb.drivers.omero.genomics import MSET_TABLE_COLS_DTYPE
+from bl.vl.kb.drivers.omero.markers_index import MarkersIndex
 
 from common import UTCommon
 
 import bl.vl.genotype.io as gio
+import bl.vl.genotype.algo as algo
 
 OME_HOST = os.getenv('OME_HOST', 'localhost')
 OME_USER = os.getenv('OME_USER', 'root')
@@ -72,6 +75,30 @@ class markers_set(UTCommon):
     self.assertAlmostEqual(np.sum(np.abs(probs - probs_1)), 0.0)
     self.assertAlmostEqual(np.sum(np.abs(confs - confs_1)), 0.0)
 
+  def test_read_ssc_many(self):
+    N, S = 16, 5
+    mset, rows = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    fns, expected = [], []
+    for i in xrange(S):
+      probs, confs = self.make_fake_data(N)
+      fn = tempfile.NamedTemporaryFile().name
+      self.make_fake_ssc(mset, rows['label'], 'ffoo-%d' % i, probs, confs, fn)
+      fns.append(fn)
+      expected.append((probs, confs))
+    fns.insert(2, tempfile.NamedTemporaryFile().name)  # missing file
+    blocks = list(gio.read_ssc_many(fns, mset, block_size=2, processes=2))
+    self.assertEqual([len(sel) for sel, _, _ in blocks], [2, 2, 1])
+    selected = sum((sel for sel, _, _ in blocks), [])
+    self.assertEqual(selected, [0, 1, 3, 4, 5])
+    probs_1 = np.concatenate([p for _, p, _ in blocks])
+    confs_1 = np.concatenate([c for _, _, c in blocks])
+    for (probs, confs), p, c in it.izip(expected, probs_1, confs_1):
+      self.assertAlmostEqual(np.sum(np.abs(probs - p)), 0.0)
+      self.assertAlmostEqual(np.sum(np.abs(confs - c)), 0.0)
+    for fn in fns[:2] + fns[3:]:
+      os.unlink(fn)
+
   def test_gdo(self):
     N = 32
     mset, _ = self.create_markers_set(N)
@@ -97,6 +124,271 @@ class markers_set(UTCommon):
       self.assertTrue((confs[indices] == x['confidence']).all())
       self.assertEqual(i, 0)
 
+  def test_add_gdos(self):
+    N, S = 32, 5
+    mset, _ = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    data_samples = []
+    for i in xrange(S):
+      ds = self.create_data_sample(mset, 'foo-data-%d' % i, self.action)
+      self.kill_list.append(ds)
+      data_samples.append(ds)
+    probs_block = np.empty((S, 2, N), dtype=np.float32)
+    confs_block = np.empty((S, N), dtype=np.float32)
+    for i in xrange(S):
+      probs_block[i], confs_block[i] = self.make_fake_data(N)
+    dos = self.kb.genomics.add_gdos(self.action, data_samples,
+                                    probs_block, confs_block, batch_size=2)
+    self.kill_list.extend(dos)
+    self.assertEqual(len(dos), S)
+    for ds, do, probs, confs in it.izip(data_samples, dos,
+                                        probs_block, confs_block):
+      self.assertEqual(do.sample.id, ds.id)
+      probs1, confs1 = ds.resolve_to_data()
+      self.assertTrue((probs == probs1).all())
+      self.assertTrue((confs == confs1).all())
+    self.assertRaises(ValueError, self.kb.genomics.add_gdos, self.action,
+                      data_samples, probs_block[:, :, 1:], confs_block)
+    order = [3, 0, 4, 2, 1]
+    s = self.kb.genomics.get_gdo_iterator(
+      mset, data_samples=[data_samples[i] for i in order], batch_size=2
+      )
+    for i, x in it.izip(order, s):
+      self.assertEqual(x['vid'], dos[i].path.split('/')[1][len('vid='):])
+      self.assertTrue((probs_block[i] == x['probs']).all())
+      self.assertTrue((confs_block[i] == x['confidence']).all())
+
+  def test_gdo_blocks(self):
+    N, S = 30, 3
+    mset, _ = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    data_samples = []
+    for i in xrange(S + 1):
+      ds = self.create_data_sample(mset, 'foo-data-%d' % i, self.action)
+      self.kill_list.append(ds)
+      data_samples.append(ds)
+    probs_block = np.empty((S + 1, 2, N), dtype=np.float32)
+    confs_block = np.empty((S + 1, N), dtype=np.float32)
+    for i in xrange(S + 1):
+      probs_block[i], confs_block[i] = self.make_fake_data(N)
+    dos = self.kb.genomics.add_gdos(self.action, data_samples[:S],
+                                    probs_block[:S], confs_block[:S])
+    self.kill_list.extend(dos)
+    self.kb.genomics.build_gdo_blocks(mset, block_size=4)
+    self.kill_list.append(self.kb.genomics.add_gdo_data_object(
+      self.action, data_samples[S], probs_block[S], confs_block[S]))
+    layout = self.kb.genomics._get_gdo_blocks_layout(mset.id)
+    self.assertEqual(layout['coverage'], S + 1)
+    indices = [9, 1, 2, 29]
+    self.assertFalse(
+      self.kb.genomics._select_gdo_blocks_layout(mset.id, indices) is None
+      )
+    for s in (self.kb.genomics.get_gdo_iterator(mset, indices=indices),
+              self.kb.genomics.get_gdo_iterator(
+                mset, data_samples=data_samples, indices=indices)):
+      for i, x in enumerate(s):
+        self.assertTrue((probs_block[i][:, indices] == x['probs']).all())
+        self.assertTrue((confs_block[i][indices] == x['confidence']).all())
+      self.assertEqual(i, S)
+    self.kb.genomics.drop_gdo_blocks(mset)
+
+  def test_quantized_gdo(self):
+    N = 32
+    mset, _ = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    data_sample = self.create_data_sample(mset, 'foo-data', self.action)
+    self.kill_list.append(data_sample)
+    probs, confs = self.make_fake_data(N, add_nan=True)
+    do = self.kb.genomics.add_gdo_data_object(self.action, data_sample,
+                                              probs, confs, encoding='uint8')
+    self.kill_list.append(do)
+    self.assertEqual(do.mimetype, mimetypes.GDO_QTABLE)
+    probs1, confs1 = data_sample.resolve_to_data()
+    self.assertTrue((np.isnan(probs) == np.isnan(probs1)).all())
+    nans = np.isnan(probs)
+    self.assertTrue(np.abs(probs[~nans] - probs1[~nans]).max() <= 1.0/254)
+    self.assertTrue(np.abs(confs - confs1).max() <= 1.0/254)
+    indices = slice(N/4, N/2)
+    s = self.kb.genomics.get_gdo_iterator(
+      mset, data_samples=[data_sample], indices=indices
+      )
+    for i, x in enumerate(s):
+      self.assertTrue((np.isnan(probs1[:,indices]) ==
+                       np.isnan(x['probs'])).all())
+      self.assertTrue((confs1[indices] == x['confidence']).all())
+    self.assertEqual(i, 0)
+
+  def test_quantize_gdos(self):
+    N = 32
+    mset, _ = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    data_sample = self.create_data_sample(mset, 'foo-data', self.action)
+    self.kill_list.append(data_sample)
+    do, probs, confs = self.create_data_object(data_sample, self.action)
+    self.kill_list.append(do)
+    self.assertEqual(self.kb.genomics.quantize_gdos(mset, 'uint16'), 1)
+    self.assertEqual(self.kb.genomics.quantize_gdos(mset, 'uint16'), 0)
+    do.reload()
+    self.assertEqual(do.mimetype, mimetypes.GDO_QTABLE)
+    self.assertEqual(self.kb.genomics.get_gdo_encoding(do.path), 'uint16')
+    probs1, confs1 = data_sample.resolve_to_data()
+    self.assertTrue(np.abs(probs - probs1).max() <= 1.0/65534)
+    self.assertTrue(np.abs(confs - confs1).max() <= 1.0/65534)
+
+  def test_materialize(self):
+    N, S = 32, 5
+    mset, _ = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    data_samples = []
+    for i in xrange(S):
+      ds = self.create_data_sample(mset, 'foo-data-%d' % i, self.action)
+      self.kill_list.append(ds)
+      data_samples.append(ds)
+    probs_block = np.empty((S, 2, N), dtype=np.float32)
+    confs_block = np.empty((S, N), dtype=np.float32)
+    for i in xrange(S):
+      probs_block[i], confs_block[i] = self.make_fake_data(N)
+    self.kill_list.extend(self.kb.genomics.add_gdos(
+      self.action, data_samples, probs_block, confs_block))
+    out = os.path.join(tempfile.mkdtemp(), 'gdos')
+    order = [4, 2, 0, 1, 3]
+    indices = slice(N/4, N/2)
+    probs, confs, index = self.kb.genomics.materialize(
+      mset, [data_samples[i] for i in order], indices=indices, out=out,
+      batch_size=2, n_threads=2)
+    self.assertEqual(probs.shape, (S, 2, N/4))
+    self.assertEqual(confs.shape, (S, N/4))
+    for i in order:
+      j = index[data_samples[i].id]
+      self.assertTrue((probs_block[i][:, indices] == probs[j]).all())
+      self.assertTrue((confs_block[i][indices] == confs[j]).all())
+    vids = np.load('%s-samples.npy' % out)
+    self.assertEqual(list(vids), [data_samples[i].id for i in order])
+    self.assertTrue(
+      (np.load('%s-probs.npy' % out, mmap_mode='r') == probs).all()
+      )
+
+  def test_gdo_cache(self):
+    N = 32
+    mset, _ = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    data_sample = self.create_data_sample(mset, 'foo-data', self.action)
+    self.kill_list.append(data_sample)
+    data_obj, probs, confs = self.create_data_object(data_sample, self.action)
+    self.kill_list.append(data_obj)
+    cache_dir = tempfile.mkdtemp()
+    self.kb.genomics.enable_gdo_cache(cache_dir)
+    try:
+      for _ in xrange(2):
+        probs1, confs1 = data_sample.resolve_to_data()
+        self.assertTrue((probs == probs1).all())
+        self.assertTrue((confs == confs1).all())
+      s = self.kb.genomics.get_gdo_iterator(mset, data_samples=[data_sample],
+                                            indices=[1, 5])
+      for x in s:
+        self.assertTrue((probs[:, [1, 5]] == x['probs']).all())
+      stats = self.kb.genomics.get_gdo_cache_stats()
+      self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+    finally:
+      self.kb.genomics.disable_gdo_cache()
+      shutil.rmtree(cache_dir)
+
+  def test_resolve_many(self):
+    data_samples, expected = [], {}
+    for N in 16, 32:
+      mset, _ = self.create_markers_set(N)
+      self.kill_list.append(mset)
+      for i in xrange(2):
+        ds = self.create_data_sample(mset, 'foo-data-%d-%d' % (N, i),
+                                     self.action)
+        self.kill_list.append(ds)
+        do, probs, confs = self.create_data_object(ds, self.action)
+        self.kill_list.append(do)
+        data_samples.append(ds)
+        expected[ds.id] = probs, confs
+    data_samples = [data_samples[i] for i in (2, 0, 3, 1)]
+    res = list(self.kb.genomics.resolve_many(data_samples, batch_size=3))
+    self.assertEqual([r[0].id for r in res], [ds.id for ds in data_samples])
+    for ds, probs1, confs1 in res:
+      probs, confs = expected[ds.id]
+      self.assertTrue((probs == probs1).all())
+      self.assertTrue((confs == confs1).all())
+
+  def test_marker_stats(self):
+    N, S = 32, 6
+    mset, _ = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    stats = self.kb.genomics.get_marker_stats(mset)
+    self.assertEqual(stats['n_samples'], 0)
+    self.assertTrue((stats['n_called'] == 0).all())
+    self.assertTrue(self.kb.genomics.get_marker_qc(mset) is None)
+    data_samples = []
+    for i in xrange(S):
+      ds = self.create_data_sample(mset, 'foo-data-%d' % i, self.action)
+      self.kill_list.append(ds)
+      data_samples.append(ds)
+    probs_block = np.empty((S, 2, N), dtype=np.float32)
+    confs_block = np.empty((S, N), dtype=np.float32)
+    for i in xrange(S):
+      probs_block[i], confs_block[i] = self.make_fake_data(N)
+    probs_block[1, 0, 3] = np.nan
+    probs_block[2, :, 5] = np.nan
+    valid = ~np.isnan(probs_block).any(axis=1)
+    sums = np.where(valid[:, np.newaxis], probs_block, 0).sum(
+      axis=0, dtype=np.float64)
+    # gdos added by another action go to a different row
+    action = self.kb.create_an_action(self.study)
+    self.kill_list.append(action)
+    dos = self.kb.genomics.add_gdos(self.action, data_samples[:-2],
+                                    probs_block[:-2], confs_block[:-2])
+    self.kill_list.extend(dos)
+    for i in S - 2, S - 1:
+      self.kill_list.append(self.kb.genomics.add_gdo_data_object(
+        action, data_samples[i], probs_block[i].copy(),
+        confs_block[i].copy()))
+    def check(stats, threshold):
+      self.assertEqual(stats['n_samples'], S)
+      self.assertAlmostEqual(stats['threshold'], threshold)
+      self.assertTrue((stats['n_valid'] == valid.sum(axis=0)).all())
+      self.assertTrue(np.allclose(stats['sum_AA'], sums[0]))
+      self.assertTrue(np.allclose(stats['sum_BB'], sums[1]))
+      n_called = (confs_block <= threshold).sum(axis=0)
+      self.assertTrue((stats['n_called'] == n_called).all())
+    check(self.kb.genomics.get_marker_stats(mset), 0.05)
+    qc = self.kb.genomics.get_marker_qc(mset)
+    expected = algo.reduce_genotypes(probs_block, confs_block, 0.05)
+    self.assertTrue(np.allclose(qc['maf'], expected.maf()))
+    self.assertTrue(np.allclose(qc['hwe'], expected.hwe()))
+    self.assertTrue(np.allclose(qc['call_rate'], expected.call_rate()))
+    check(self.kb.genomics.recompute_marker_stats(mset, self.action,
+                                                  threshold=0.5), 0.5)
+    self.kb.genomics.drop_marker_stats(mset)
+    self.assertTrue(self.kb.genomics.get_marker_stats(mset) is None)
+
+  def test_markers_index(self):
+    N = 32
+    mset, rows = self.create_markers_set(N)
+    self.kill_list.append(mset)
+    root = tempfile.mkdtemp()
+    try:
+      mindex = MarkersIndex(self.kb.genomics, mset, root)
+      self.assertEqual(len(mindex), N)
+      for k in 'label', 'index', 'permutation':
+        self.assertTrue((mindex[k] == rows[k]).all())
+      labels = ['M%d' % i for i in (17, 3, 30)] + ['NOT-A-MARKER']
+      self.assertEqual(list(mindex.lookup(labels)), [17, 3, 30, -1])
+      self.assertEqual(mindex.get('M5'), (rows['index'][5],
+                                          rows['permutation'][5]))
+      self.assertRaises(KeyError, mindex.get, 'NOT-A-MARKER')
+      masks = self.kb.genomics.get_markers_array_rows(mset)['mask']
+      self.assertTrue((mindex.get_masks([2, 7]) == masks[[2, 7]]).all())
+      self.assertTrue((mindex.get_masks() == masks).all())
+      mtime = os.path.getmtime(mindex.path)
+      mindex = MarkersIndex(self.kb.genomics, mset, root)
+      self.assertEqual(os.path.getmtime(mindex.path), mtime)
+      self.assertEqual(list(mindex.lookup(labels)), [17, 3, 30, -1])
+    finally:
+      shutil.rmtree(root)
 
   def test_speed(self):
     ref_genome = 'g' + ('%f' % time.time())[-14:]
@@ -155,7 +447,17 @@ def suite():
   suite = unittest.TestSuite()
   suite.addTest(markers_set('test_creation_destruction'))
   suite.addTest(markers_set('test_read_ssc'))
+  suite.addTest(markers_set('test_read_ssc_many'))
   suite.addTest(markers_set('test_gdo'))
+  suite.addTest(markers_set('test_add_gdos'))
+  suite.addTest(markers_set('test_gdo_blocks'))
+  suite.addTest(markers_set('test_quantized_gdo'))
+  suite.addTest(markers_set('test_quantize_gdos'))
+  suite.addTest(markers_set('test_materialize'))
+  suite.addTest(markers_set('test_gdo_cache'))
+  suite.addTest(markers_set('test_resolve_many'))
+  suite.addTest(markers_set('test_markers_index'))
+  suite.addTest(markers_set('test_marker_stats'))
   #--
   ## suite.addTest(markers_set('test_speed'))
   ## suite.addTest(markers_set('test_speed_gdo'))
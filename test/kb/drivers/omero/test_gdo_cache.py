@@ -0,0 +1,72 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import os, unittest, tempfile, shutil, hashlib
+import numpy as np
+
+from bl.vl.kb.drivers.omero.gdo_cache import GdoCache
+
+
+def make_entry(n, seed):
+  data = np.random.RandomState(seed).random_sample(n).astype(np.float32)
+  return hashlib.sha1(data.tostring()).hexdigest(), data
+
+
+class TestGdoCache(unittest.TestCase):
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def test_get_put(self):
+    cache = GdoCache(self.root)
+    sha1, data = make_entry(30, 0)
+    self.assertEqual(cache.get(sha1), None)
+    self.assertFalse(cache.put('0' * 40, data, 'V0'))
+    self.assertTrue(cache.put(sha1, data, 'V0'))
+    op_vid, cached = cache.get(sha1)
+    self.assertEqual(op_vid, 'V0')
+    self.assertTrue((cached == data).all())
+    stats = cache.stats()
+    self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    self.assertEqual(len(GdoCache(self.root)), 1)
+
+  def test_corrupted_entry(self):
+    sha1, data = make_entry(30, 0)
+    GdoCache(self.root).put(sha1, data, 'V0')
+    fn = os.path.join(self.root, os.listdir(self.root)[0])
+    with open(fn, 'r+b') as f:
+      f.seek(-4, os.SEEK_END)
+      f.write('\0\0\0\0')
+    cache = GdoCache(self.root)
+    self.assertEqual(cache.get(sha1), None)
+    self.assertEqual(len(cache), 0)
+    self.assertEqual(os.listdir(self.root), [])
+
+  def test_eviction(self):
+    entries = [make_entry(1000, i) for i in xrange(3)]
+    cache = GdoCache(self.root, max_size=2 * 4000 + 500)
+    for sha1, data in entries[:2]:
+      cache.put(sha1, data, 'V0')
+    os.utime(os.path.join(self.root, '%s.V0.npy' % entries[0][0]), (0, 0))
+    cache.put(entries[2][0], entries[2][1], 'V0')
+    self.assertEqual(len(cache), 2)
+    self.assertTrue(cache.size <= cache.max_size)
+    self.assertEqual(cache.get(entries[0][0]), None)
+    for sha1, _ in entries[1:]:
+      self.assertFalse(cache.get(sha1) is None)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestGdoCache('test_get_put'))
+  suite.addTest(TestGdoCache('test_corrupted_entry'))
+  suite.addTest(TestGdoCache('test_eviction'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
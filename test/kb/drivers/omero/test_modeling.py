@@ -0,0 +1,92 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest
+from bl.vl.kb.drivers.omero.modeling import LookupCache
+
+
+class Clock(object):
+
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+class Foo(object):
+  pass
+
+
+class Bar(Foo):
+  pass
+
+
+class Other(object):
+  pass
+
+
+class TestLookupCache(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = Clock()
+    self.cache = LookupCache(ttl=10, clock=self.clock)
+    self.n_loads = 0
+
+  def loader(self, value):
+    def load():
+      self.n_loads += 1
+      return value
+    return load
+
+  def test_read_through(self):
+    for _ in xrange(3):
+      self.assertEqual(self.cache.get(Foo, 'a', self.loader('A')), 'A')
+    self.assertEqual(self.n_loads, 1)
+    self.assertEqual(self.cache.get(Foo, 'b', self.loader(None)), None)
+    self.assertEqual(self.cache.get(Foo, 'b', self.loader('B')), None)
+    self.assertEqual(self.n_loads, 2)
+    stats = self.cache.stats()
+    self.assertEqual((stats['hits'], stats['misses']), (3, 2))
+    self.assertAlmostEqual(stats['hit_ratio'], 0.6)
+    self.assertEqual(stats['size'], 2)
+
+  def test_ttl(self):
+    self.cache.get(Foo, 'a', self.loader('A'))
+    self.clock.now = 9.9
+    self.cache.get(Foo, 'a', self.loader('A'))
+    self.assertEqual(self.n_loads, 1)
+    self.clock.now = 10.0
+    self.assertEqual(self.cache.get(Foo, 'a', self.loader('A2')), 'A2')
+    self.assertEqual(self.n_loads, 2)
+
+  def test_invalidate(self):
+    self.cache.get(Foo, 'a', self.loader('A'))
+    self.cache.get(Bar, 'b', self.loader('B'))
+    self.cache.get(Other, 'c', self.loader('C'))
+    self.cache.invalidate(Bar())
+    self.assertEqual(len(self.cache), 1)
+    self.cache.get(Foo, 'a', self.loader('A'))
+    self.cache.get(Bar, 'b', self.loader('B'))
+    self.assertEqual(self.n_loads, 5)
+    self.cache.invalidate(Foo())
+    self.assertEqual(len(self.cache), 2)
+    self.cache.invalidate()
+    self.assertEqual(len(self.cache), 0)
+
+  def test_bad_ttl(self):
+    self.assertRaises(ValueError, LookupCache, 0)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestLookupCache('test_read_through'))
+  suite.addTest(TestLookupCache('test_ttl'))
+  suite.addTest(TestLookupCache('test_invalidate'))
+  suite.addTest(TestLookupCache('test_bad_ttl'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
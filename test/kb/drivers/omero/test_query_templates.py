@@ -0,0 +1,106 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest
+
+import bl.vl.kb.drivers.omero.wrapper as wp
+from bl.vl.kb.drivers.omero.query_templates import QueryTemplate, \
+     QueryRegistry
+
+
+class FakeParameters(dict):
+
+  def page(self, offset, limit):
+    self['__page__'] = (offset, limit)
+
+
+class FakeKB(object):
+
+  def __init__(self, results):
+    self.results = results
+    self.calls = []
+    self.factory = self
+
+  def wrap(self, o):
+    return o
+
+  def ome_query_params(self, conf):
+    return FakeParameters(conf)
+
+  def ome_operation(self, operation, action, query, pars):
+    self.calls.append((action, query, pars))
+    return self.results.pop(0)
+
+
+class TestQueryTemplate(unittest.TestCase):
+
+  def test_validation(self):
+    bad = [
+      ("from Study st where st.label = 'foo'", {}),
+      ('from Study st where st.label like "%foo"', {}),
+      ('from Study st where st.label = :label', {}),
+      ('from Study st', {'label': wp.STRING}),
+      ('from Study st where st.label = :label', {'label': 'nosuchtype'}),
+      ('from Study st where st.label in (:l)', {'l': [wp.STRING, wp.LONG]}),
+      ]
+    for hql, params in bad:
+      self.assertRaises(ValueError, QueryTemplate, 'q', hql, params)
+
+  def test_render(self):
+    t = QueryTemplate('q', 'from {table} o where o.{field} = :v',
+                      {'v': None})
+    self.assertEqual(t.slots, frozenset(['table', 'field']))
+    hql = t.render(table='Study', field='label')
+    self.assertEqual(hql, 'from Study o where o.label = :v')
+    self.assertTrue(t.render(table='Study', field='label') is hql)
+    self.assertRaises(ValueError, t.render, table='Study')
+    self.assertRaises(ValueError, t.render, table='Study',
+                      field='label = 1 or 1')
+
+  def test_bind(self):
+    t = QueryTemplate('q', 'from Study st where st.vid in (:vids)',
+                      {'vids': [wp.STRING]})
+    kb = FakeKB([])
+    pars = t.bind(kb, {'vids': ['V1', 'V2']})
+    self.assertEqual(sorted(pars), ['vids'])
+    self.assertRaises(ValueError, t.bind, kb, {})
+    self.assertRaises(ValueError, t.bind, kb, {'vids': [], 'foo': 1})
+
+
+class TestQueryRegistry(unittest.TestCase):
+
+  def test_register(self):
+    reg = QueryRegistry(FakeKB([]))
+    t = reg.register('q', 'from Study st')
+    self.assertTrue(reg.register('q', '  from   Study st ') is t)
+    self.assertRaises(ValueError, reg.register, 'q', 'from Device d')
+    self.assertRaises(ValueError, reg.find, 'nosuchquery')
+
+  def test_run(self):
+    kb = FakeKB([None, 'x', ['a', 'b'], ['c']])
+    reg = QueryRegistry(kb)
+    reg.register('q', 'from {table} o where o.label = :label order by o.id',
+                 {'label': wp.STRING})
+    self.assertEqual(reg.find('q', {'label': 'l'}, table='Study'), None)
+    self.assertEqual(reg.find('q', {'label': 'l'}, table='Study'), 'x')
+    res = list(reg.iter_all('q', {'label': 'l'}, page_size=2, table='Study'))
+    self.assertEqual(res, ['a', 'b', 'c'])
+    self.assertEqual([c[2]['__page__'] for c in kb.calls[2:]],
+                     [(0, 2), (2, 2)])
+    self.assertEqual(len(set(c[1] for c in kb.calls)), 1)
+    self.assertEqual(reg.stats()['q']['calls'], 4)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestQueryTemplate('test_validation'))
+  suite.addTest(TestQueryTemplate('test_render'))
+  suite.addTest(TestQueryTemplate('test_bind'))
+  suite.addTest(TestQueryRegistry('test_register'))
+  suite.addTest(TestQueryRegistry('test_run'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
@@ -0,0 +1,54 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest
+import numpy as np
+
+from bl.vl.kb.drivers.omero.vcs_chunks import encode_chunk, decode_chunk
+
+
+class TestVcsChunks(unittest.TestCase):
+
+  def test_round_trip(self):
+    n = 1000
+    rs = np.random.RandomState(0)
+    records = np.zeros(n, dtype=[('index', '<i8'), ('vid', '|S10'),
+                                 ('vpos', '<i8'), ('score', '<f4'),
+                                 ('flag', '|b1'), ('count', '<u4')])
+    records['index'] = np.sort(rs.randint(0, 10 * n, n))
+    records['vid'] = ['V%06d' % i for i in rs.randint(0, 5, n)]
+    records['vpos'] = rs.randint(-2**40, 2**40, n)
+    records['score'] = rs.random_sample(n)
+    records['flag'] = rs.randint(0, 2, n)
+    records['count'] = rs.randint(0, 2**32 - 1, n)
+    for r in records, records[:1], records[:0]:
+      data = encode_chunk(r)
+      self.assertTrue(isinstance(data, str))
+      decoded = decode_chunk(data, r.dtype)
+      self.assertEqual(decoded.dtype, r.dtype)
+      self.assertEqual(decoded.tolist(), r.tolist())
+
+  def test_compression(self):
+    n = 10000
+    nodes = np.zeros(n, dtype=[('chrom', '<i8'), ('pos', '<i8')])
+    nodes['chrom'] = np.arange(n) // 1000 + 1
+    nodes['pos'] = np.arange(n) % 1000 * 137 + 5
+    origin = np.zeros(n, dtype=[('index', '<i8'), ('vid', '|S34'),
+                                ('vpos', '<i8')])
+    origin['index'] = np.arange(n)
+    origin['vid'] = 'V0123456789ABCDEF0123456789ABCDEF'
+    origin['vpos'] = np.arange(n)
+    for r in nodes, origin:
+      self.assertTrue(len(encode_chunk(r)) < r.nbytes / 10)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestVcsChunks('test_round_trip'))
+  suite.addTest(TestVcsChunks('test_compression'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
@@ -1,7 +1,7 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
-import os, unittest, logging
+import os, unittest, logging, time
 logging.basicConfig(level=logging.ERROR)
 
 from bl.vl.kb import KnowledgeBase as KB
@@ -103,6 +103,38 @@ class TestKB(KBObjectCreator):
     self.kill_list.append(action.save())
     self.check_object(action, conf, self.kb.ActionOnDataSample)
 
+  def test_iter_objects(self):
+    studies = []
+    for _ in xrange(3):
+      _, s = self.create_study()
+      self.kill_list.append(s.save())
+      studies.append(s)
+    vids = set(s.id for s in studies)
+    seen = [s.id for s in self.kb.iter_objects(self.kb.Study, page_size=2)]
+    self.assertEqual(len(seen), len(set(seen)))
+    self.assertTrue(vids.issubset(seen))
+    query = 'from Study st where st.vid in (:v0, :v1, :v2) order by st.id'
+    params = dict(('v%d' % i, s.id) for i, s in enumerate(studies))
+    res = list(self.kb.iter_query(query, params, page_size=1))
+    self.assertEqual([s.id for s in res], [s.id for s in studies])
+
+  def test_count(self):
+    prefix = 'count-%f' % time.time()
+    for i in xrange(3):
+      conf = {'label': '%s-%d' % (prefix, i),
+              'description': 'group-%d' % (i % 2)}
+      self.kill_list.append(self.kb.factory.create(self.kb.Study,
+                                                   conf).save())
+    where = 'o.label like :prefix'
+    params = {'prefix': '%s-%%' % prefix}
+    self.assertEqual(self.kb.count(self.kb.Study, where, params), 3)
+    self.assertTrue(self.kb.count(self.kb.Study) >= 3)
+    counts = self.kb.group_count(self.kb.Study, ['description'],
+                                 where, params)
+    self.assertEqual(counts, {('group-0',): 2, ('group-1',): 1})
+    self.assertRaises(ValueError, self.kb.group_count, self.kb.Study,
+                      ['label; drop'])
+
 
 def suite():
   suite = unittest.TestSuite()
@@ -116,6 +148,8 @@ def suite():
   suite.addTest(TestKB('test_action_on_vessel'))
   suite.addTest(TestKB('test_action_on_data_sample'))
   suite.addTest(TestKB('test_action_on_data_collection_item'))
+  suite.addTest(TestKB('test_iter_objects'))
+  suite.addTest(TestKB('test_count'))
   return suite
 
 
@@ -64,12 +64,28 @@ class TestKB(KBObjectCreator):
     self.kb.delete(e)
     self.assertEqual(self.kb.get_enrollment(study, conf['studyCode']), None)
 
+  def test_get_enrollments(self):
+    _, study = self.create_study()
+    self.kill_list.append(study.save())
+    codes = []
+    for i in xrange(3):
+      conf, e = self.create_enrollment(study=study,
+                                       st_code='st-code-%d-%s' % (i, study.id))
+      self.kill_list.append(e.save())
+      codes.append(conf['studyCode'])
+    res = self.kb.get_enrollments(study, codes + ['not-there'], batch_size=2)
+    self.assertEqual(sorted(res), sorted(codes))
+    for c in codes:
+      self.assertEqual(res[c].studyCode, c)
+      self.assertTrue(res[c].individual.is_loaded())
+
 
 def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestKB('test_individual'))
   suite.addTest(TestKB('test_enrollment'))
   suite.addTest(TestKB('test_enrollment_ops'))
+  suite.addTest(TestKB('test_get_enrollments'))
   return suite
 
 
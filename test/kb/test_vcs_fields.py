@@ -85,8 +85,87 @@ class TestVCS(KBObjectCreator):
         s = vcs.selection((tuple(nodes[1]), tuple(nodes[-1])))
         self.assertTrue(np.alltrue(nodes[1:-1] == s.get_nodes()))
         self.assertEqual(len(s.get_nodes()), len(s.get_fields()['origin']))
+
+    def test_selections(self):
+        VariantCallSupport = self.kb.VariantCallSupport
+        nodes = np.array([(1, 1), (1, 2), (1, 13), (2, 1), (2, 3), (2, 25)],
+                        dtype=VariantCallSupport.NODES_DTYPE)
+        field = np.array([(i, 'V%06d' % i, i) for i in range(len(nodes))],
+                         dtype=[('index', '<i4'),
+                                ('source', '|S%d' % VID_SIZE), ('pos', '<i4')])
+        action = self.create_action()
+        reference_genome = self.create_reference_genome(action)
+        conf = {'referenceGenome' : reference_genome,
+                'label' : vlu.make_random_str(),
+                'status' : self.kb.DataSampleStatus.USABLE,
+                'action': action}
+        vcs = self.kb.factory.create(VariantCallSupport, conf)
+        vcs.define_support(nodes)
+        vcs.define_field('origin', field)
+        ranges = [((1, 0), (1, 10)), ((1, 2), (2, 2)), ((3, 0), (4, 0)),
+                  ((2, 3), (1, 0))]
+        sels = vcs.selections(ranges)
+        self.assertEqual(len(sels), len(ranges))
+        for r, s in zip(ranges, sels):
+            s1 = vcs.selection(r)
+            self.assertEqual(s.get_nodes().tolist(), s1.get_nodes().tolist())
+            self.assertEqual(s.get_field('origin').tolist(),
+                             s1.get_field('origin').tolist())
+        self.assertEqual(sels[1].get_nodes().tolist(), [(1, 2), (1, 13), (2, 1)])
+        self.assertEqual(sels[1].get_field('origin')['index'].tolist(),
+                         [0, 1, 2])
+        self.assertEqual(sels[1].get_field('origin')['pos'].tolist(),
+                         [1, 2, 3])
+        self.assertEqual(len(sels[2]), 0)
+        self.assertEqual(len(sels[3]), 0)
+        windows = list(vcs.iter_windows(10))
+        self.assertEqual([r for r, _ in windows],
+                         [((1, 0), (1, 10)), ((1, 10), (1, 20)),
+                          ((2, 0), (2, 10)), ((2, 20), (2, 30))])
+        self.assertEqual([len(w) for _, w in windows], [2, 1, 2, 1])
+        self.assertEqual(sum((w.get_nodes().tolist() for _, w in windows), []),
+                         nodes.tolist())
         
         
+    def test_overlaps(self):
+        VariantCallSupport = self.kb.VariantCallSupport
+        nodes = np.array([(1, 1), (1, 2), (1, 13), (2, 1), (2, 3), (2, 25)],
+                        dtype=VariantCallSupport.NODES_DTYPE)
+        action = self.create_action()
+        reference_genome = self.create_reference_genome(action)
+        conf = {'referenceGenome' : reference_genome,
+                'label' : vlu.make_random_str(),
+                'status' : self.kb.DataSampleStatus.USABLE,
+                'action': action}
+        vcs = self.kb.factory.create(VariantCallSupport, conf)
+        vcs.define_support(nodes)
+        intervals = [((1, 0), (1, 10)), ((1, 2), (1, 14)), ((1, 5), (1, 10)),
+                     ((2, 2), (2, 26)), ((3, 0), (3, 10)), ((2, 3), (2, 3))]
+        def brute_force(ends):
+            pairs = []
+            for i, (s, e) in enumerate(zip(nodes.tolist(), ends)):
+                for j, (b, c) in enumerate(intervals):
+                    if b < e and c > s and b < c:
+                        pairs.append((i, j))
+            return pairs
+        inodes, ivals = vcs.overlaps(intervals)
+        self.assertEqual(zip(inodes.tolist(), ivals.tolist()),
+                         brute_force([(c, p + 1) for c, p in nodes.tolist()]))
+        self.assertEqual(zip(inodes.tolist(), ivals.tolist()),
+                         [(0, 0), (1, 0), (1, 1), (2, 1), (4, 3), (5, 3)])
+        field = np.array([(1, 5), (1, 2), (3, 1), (4, 30)],
+                         dtype=[('index', '<i4'), ('length', '<i4')])
+        vcs.define_field('indel', field)
+        inodes, ivals = vcs.overlaps(intervals, length_field='indel')
+        ends = [(c, p + 1) for c, p in nodes.tolist()]
+        ends[1], ends[4] = (1, 7), (2, 33)
+        self.assertEqual(zip(inodes.tolist(), ivals.tolist()),
+                         brute_force(ends))
+        self.assertTrue((1, 2) in zip(inodes.tolist(), ivals.tolist()))
+        self.assertRaises(ValueError, vcs.overlaps, intervals, 'foo')
+        inodes, ivals = vcs.overlaps([])
+        self.assertEqual((len(inodes), len(ivals)), (0, 0))
+
     def test_union(self):
         action = self.create_action()        
         reference_genome = self.create_reference_genome(action)
@@ -137,6 +216,46 @@ class TestVCS(KBObjectCreator):
         self.assertTrue(np.alltrue(vcs8.get_fields()['origin'] 
                                    == vcs1.get_fields()['origin']))
 
+    def test_union_intersection_all(self):
+        action = self.create_action()
+        reference_genome = self.create_reference_genome(action)
+        VariantCallSupport = self.kb.VariantCallSupport
+        conf = {'referenceGenome' : reference_genome,
+                'status' : self.kb.DataSampleStatus.USABLE,
+                'action': action}
+        all_nodes = [[(1, 1), (1, 2), (1, 3), (2, 1), (2, 3), (2, 4)],
+                     [(1, 3), (2, 1), (2, 2), (2, 3), (3, 1), (3, 2)],
+                     [(1, 1), (1, 3), (2, 1), (2, 3), (4, 1)]]
+        vcs_list = []
+        for k, nodes in enumerate(all_nodes):
+            conf['label'] = vlu.make_random_str()
+            vcs = self.kb.factory.create(VariantCallSupport, conf)
+            nodes = np.array(nodes, dtype=VariantCallSupport.NODES_DTYPE)
+            field = np.array([(i, '%dV%06d' % (k, i), i)
+                              for i in range(len(nodes))],
+                             dtype=[('index', '<i4'),
+                                    ('source', '|S%d' % VID_SIZE),
+                                    ('pos', '<i4')])
+            vcs.define_support(nodes)
+            vcs.define_field('origin', field)
+            vcs_list.append(vcs)
+        for method, method_all in (('union', 'union_all'),
+                                   ('intersection', 'intersection_all')):
+            expected = vcs_list[0]
+            for vcs in vcs_list[1:]:
+                expected = getattr(expected, method)(vcs)
+            res = getattr(VariantCallSupport, method_all)(vcs_list)
+            self.assertEqual(res.get_nodes().tolist(),
+                             expected.get_nodes().tolist())
+            self.assertEqual(res.get_field('origin').tolist(),
+                             expected.get_field('origin').tolist())
+        res = VariantCallSupport.intersection_all(vcs_list)
+        self.assertEqual(res.get_nodes().tolist(), [(1, 3), (2, 1), (2, 3)])
+        self.assertEqual(len(res.get_field('origin')), 9)
+        res = VariantCallSupport.union_all(vcs_list[1:2])
+        self.assertEqual(res.get_nodes().tolist(), all_nodes[1])
+        self.assertRaises(ValueError, VariantCallSupport.union_all, [])
+
     def test_intersection(self):
         action = self.create_action()        
         reference_genome = self.create_reference_genome(action)
@@ -221,7 +340,10 @@ class TestVCS(KBObjectCreator):
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(TestVCS('test_creation'))
-    suite.addTest(TestVCS('test_selection'))    
+    suite.addTest(TestVCS('test_selection'))
+    suite.addTest(TestVCS('test_selections'))
+    suite.addTest(TestVCS('test_overlaps'))
+    suite.addTest(TestVCS('test_union_intersection_all'))
     suite.addTest(TestVCS('test_union'))        
     suite.addTest(TestVCS('test_intersection'))        
     suite.addTest(TestVCS('test_complement'))            
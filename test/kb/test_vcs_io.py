@@ -9,6 +9,8 @@ import numpy as np
 logging.basicConfig(level=logging.ERROR)
 
 from bl.vl.kb import KnowledgeBase as KB
+from bl.vl.kb import mimetypes
+from bl.vl.kb.drivers.omero import vcs_chunks
 from kb_object_creator import KBObjectCreator
 
 import bl.vl.utils as vlu
@@ -85,9 +87,157 @@ class TestVCS(KBObjectCreator):
             for x, y in it.izip(a, b):
                 self.assertEqual(x, y)
 
+    def test_lazy_restore(self):
+        VariantCallSupport = self.kb.VariantCallSupport
+        nodes = np.array([(1, 1), (1, 2), (1, 3), (2, 1), (2, 3), (3, 5)],
+                         dtype=VariantCallSupport.NODES_DTYPE)
+        origin = np.array([(i, 'V%06d' % i, i) for i in range(len(nodes))],
+                          dtype=[('index', '<i8'),
+                                 ('source', '|S%d' % VID_SIZE),
+                                 ('pos', '<i8')])
+        snp = np.array([(i, 10 * i) for i in (0, 2, 3, 5)],
+                       dtype=[('index', '<i8'), ('score', '<i8')])
+        action = self.create_action()
+        reference_genome = self.create_reference_genome(action)
+        label = vlu.make_random_str()
+        conf = {'referenceGenome' : reference_genome,
+                'label' : label,
+                'status' : self.kb.DataSampleStatus.USABLE,
+                'action': action}
+        vcs = self.kb.factory.create(VariantCallSupport, conf)
+        vcs.define_support(nodes)
+        vcs.define_fields({'origin': origin, 'snp': snp})
+        vcs.save()
+        self.kill_list.append(vcs)
+        region = ((1, 2), (2, 2))
+        expected = vcs.selection(region)
+        self.kb.del_from_cache(vcs.ome_obj)
+        vcs2 = self.kb.genomics.get_vcs_by_label(label, region=region)
+        self.assertTrue(np.alltrue(vcs2.get_nodes() == expected.get_nodes()))
+        for k in 'origin', 'snp':
+            self.assertEqual(vcs2.get_field(k).tolist(),
+                             expected.get_field(k).tolist())
+        self.kb.del_from_cache(vcs.ome_obj)
+        vcs3 = self.kb.genomics.get_vcs_by_label(label, fields=['snp'])
+        self.assertEqual(sorted(vcs3.get_fields()), ['snp'])
+        self.assertTrue(vcs3.get_field('origin') is None)
+        self.assertEqual(vcs3.get_field('snp').tolist(), snp.tolist())
+        self.kb.del_from_cache(vcs.ome_obj)
+        vcs4 = self.kb.genomics.get_vcs_by_label(label,
+                                                 region=((4, 0), (5, 0)))
+        self.assertEqual(len(vcs4), 0)
+        self.assertEqual(len(vcs4.get_field('snp')), 0)
+        self.kb.del_from_cache(vcs.ome_obj)
+        self.assertRaises(ValueError, self.kb.genomics.get_vcs_by_label,
+                          label, fields=['foo'])
+
+    def test_chunked_storage(self):
+        VariantCallSupport = self.kb.VariantCallSupport
+        n = 50
+        nodes = np.zeros(n, dtype=VariantCallSupport.NODES_DTYPE)
+        nodes['chrom'] = np.arange(n) // 10 + 1
+        nodes['pos'] = np.arange(n) % 10 * 3 + 1
+        origin = np.array([(i, 'V%06d' % (i % 3), i) for i in range(n)],
+                          dtype=[('index', '<i8'),
+                                 ('source', '|S%d' % VID_SIZE),
+                                 ('pos', '<i8')])
+        snp = np.array([(i, 10 * i) for i in range(0, n, 4)],
+                       dtype=[('index', '<i8'), ('score', '<i8')])
+        action = self.create_action()
+        reference_genome = self.create_reference_genome(action)
+        label = vlu.make_random_str()
+        conf = {'referenceGenome' : reference_genome,
+                'label' : label,
+                'status' : self.kb.DataSampleStatus.USABLE,
+                'action': action}
+        vcs = self.kb.factory.create(VariantCallSupport, conf)
+        vcs.define_support(nodes)
+        vcs.define_fields({'origin': origin, 'snp': snp})
+        chunk_size = vcs_chunks.CHUNK_SIZE
+        vcs_chunks.CHUNK_SIZE = 7
+        try:
+            self.kb.genomics.register_vcs(vcs, mimetypes.VCS_CHUNKS)
+            self.kill_list.append(vcs)
+        finally:
+            vcs_chunks.CHUNK_SIZE = chunk_size
+        dos = self.kb.get_data_objects(vcs)
+        self.assertEqual([do.mimetype for do in dos], [mimetypes.VCS_CHUNKS])
+        for region in None, ((2, 4), (4, 2)), ((7, 0), (8, 0)):
+            self.kb.del_from_cache(vcs.ome_obj)
+            vcs3 = self.kb.genomics.get_vcs_by_label(label, region=region)
+            expected = vcs if region is None else vcs.selection(region)
+            self.assertEqual(vcs3.get_nodes().tolist(),
+                             expected.get_nodes().tolist())
+            for k in 'origin', 'snp':
+                self.assertEqual(vcs3.get_field(k).tolist(),
+                                 expected.get_field(k).tolist())
+        self.kb.del_from_cache(vcs.ome_obj)
+        vcs4 = self.kb.genomics.get_vcs_by_label(label)
+        self.kb.genomics.convert_vcs_storage(vcs4, mimetypes.VCS_TABLES)
+        dos = self.kb.get_data_objects(vcs)
+        self.assertEqual([do.mimetype for do in dos], [mimetypes.VCS_TABLES])
+        self.kb.del_from_cache(vcs.ome_obj)
+        vcs5 = self.kb.genomics.get_vcs_by_label(label)
+        self.assertEqual(vcs5.get_field('origin').tolist(), origin.tolist())
+        self.assertEqual(self.kb.genomics.convert_vcs_storage(
+            vcs5, mimetypes.VCS_TABLES), None)
+        do = self.kb.genomics.convert_vcs_storage(vcs5)
+        self.assertEqual(do.mimetype, mimetypes.VCS_CHUNKS)
+        self.kb.del_from_cache(vcs.ome_obj)
+        vcs6 = self.kb.genomics.get_vcs_by_label(label, fields=['snp'])
+        self.assertEqual(vcs6.get_nodes().tolist(), nodes.tolist())
+        self.assertEqual(vcs6.get_field('snp').tolist(), snp.tolist())
+
+    def test_restored_set_operations(self):
+        VariantCallSupport = self.kb.VariantCallSupport
+        action = self.create_action()
+        reference_genome = self.create_reference_genome(action)
+        vcs_list, labels = [], []
+        for positions in [(1, 2, 3, 5), (2, 3, 4)]:
+            nodes = np.array([(1, p) for p in positions],
+                             dtype=VariantCallSupport.NODES_DTYPE)
+            origin = np.array([(i, 'V%06d' % p, p)
+                               for i, p in enumerate(positions)],
+                              dtype=[('index', '<i8'),
+                                     ('source', '|S%d' % VID_SIZE),
+                                     ('pos', '<i8')])
+            label = vlu.make_random_str()
+            conf = {'referenceGenome' : reference_genome,
+                    'label' : label,
+                    'status' : self.kb.DataSampleStatus.USABLE,
+                    'action': action}
+            vcs = self.kb.factory.create(VariantCallSupport, conf)
+            vcs.define_support(nodes)
+            vcs.define_field('origin', origin)
+            vcs.save()
+            self.kill_list.append(vcs)
+            vcs_list.append(vcs)
+            labels.append(label)
+        expected = {'union': vcs_list[0].union(vcs_list[1]),
+                    'intersection': vcs_list[0].intersection(vcs_list[1]),
+                    'complement': vcs_list[0].complement(vcs_list[1])}
+        for vcs in vcs_list:
+            self.kb.del_from_cache(vcs.ome_obj)
+        vcs1, vcs2 = [self.kb.genomics.get_vcs_by_label(l) for l in labels]
+        for method, res in expected.iteritems():
+            vcs3 = getattr(vcs1, method)(vcs2)
+            self.assertEqual(vcs3.get_nodes().tolist(),
+                             res.get_nodes().tolist())
+            self.assertEqual(vcs3.get_field('origin').tolist(),
+                             res.get_field('origin').tolist())
+        vcs3 = VariantCallSupport.union_all([vcs1, vcs2])
+        self.assertEqual(vcs3.get_nodes().tolist(),
+                         expected['union'].get_nodes().tolist())
+        vcs1.define_field('snp', np.array([(0, 10)], dtype=[('index', '<i8'),
+                                                           ('score', '<i8')]))
+        self.assertEqual(vcs1.get_field('snp').tolist(), [(0, 10)])
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(TestVCS('test_save_restore'))
+    suite.addTest(TestVCS('test_lazy_restore'))
+    suite.addTest(TestVCS('test_chunked_storage'))
+    suite.addTest(TestVCS('test_restored_set_operations'))
     return suite
 
 
@@ -61,7 +61,50 @@ class TestIndexIntersect(unittest.TestCase):
     print
     print "finished in %.1f s" % (time.time()-t0)
 
-class TestArgsortSplit(unittest.TestCase):        
+class TestIndexIntersectSorted(unittest.TestCase):
+
+  def test_against_index_intersect(self):
+    cases = [
+      (np.array(list('abcqxz')), np.array(list('12ab34'))[[0, 1, 4, 5, 2, 3]]),
+      (np.arange(0, 100, 3), np.arange(0, 50, 2)),
+      (np.arange(10), np.arange(20, 30)),
+      (np.arange(5, 8), np.arange(10)),
+      ]
+    for a1, a2 in cases:
+      a2 = np.sort(a2)
+      for x, y in (a1, a2), (a2, a1):
+        i1, i2 = np_ext.index_intersect_sorted(x, y)
+        j1, j2 = np_ext.index_intersect(x, y)
+        self.assertEqual(i1.tolist(), j1.tolist())
+        self.assertEqual(i2.tolist(), j2.tolist())
+        self.assertTrue((x[i1] == y[i2]).all())
+    i1, i2 = np_ext.index_intersect_sorted(np.arange(3), np.arange(0))
+    self.assertEqual((i1.size, i2.size), (0, 0))
+
+  def test_exceptions(self):
+    a1 = np.array([1, 3, 5, 10])
+    for a in np.array([1, 5, 2, 10]), np.array([1, 3, 3, 10]):
+      self.assertRaises(ValueError, np_ext.index_intersect_sorted, a1, a,
+                        False)
+    self.assertRaises(ValueError, np_ext.index_intersect_sorted, a1,
+                      np.array([1., 2.]))
+
+  def test_performance(self):
+    size = 1000000
+    offset = size/10000
+    a1 = np.arange(offset, size)
+    a2 = np.arange(offset + size)
+    for f in np_ext.index_intersect, np_ext.index_intersect_sorted:
+      t0 = time.time()
+      f(a1, a2)
+      print
+      print "%s: finished in %.3f s" % (f.__name__, time.time()-t0)
+    t0 = time.time()
+    np_ext.index_intersect_sorted(a1, a2, assume_sorted=False)
+    print "index_intersect_sorted, checked: finished in %.3f s" % (
+      time.time()-t0)
+
+class TestArgsortSplit(unittest.TestCase):
 
   def test_basics(self):
     cases = [(np.array([1, 3, 2, 1, 0, 3, 0, 4, 3, 2]),
@@ -73,13 +116,48 @@ class TestArgsortSplit(unittest.TestCase):
       for s1, s2 in it.izip(splits, res):
         self.assertTrue((s1==s2).all())
 
+class TestSortedLookup(unittest.TestCase):
+
+  def test_basics(self):
+    a = np.array(['M%d' % i for i in xrange(20)])
+    order = a.argsort()
+    keys = ['M7', 'M19', 'foo', 'M0', 'Z', 'A', 'M190']
+    pos = np_ext.sorted_lookup(a[order], keys, order)
+    self.assertEqual(pos.tolist(), [7, 19, -1, 0, -1, -1, -1])
+    pos = np_ext.sorted_lookup(a[order], keys)
+    self.assertTrue((a[order][pos[pos >= 0]] == ['M7', 'M19', 'M0']).all())
+    empty = np.array([], dtype=a.dtype)
+    self.assertEqual(np_ext.sorted_lookup(empty, keys).tolist(), [-1] * 7)
+
+class TestMergeSorted(unittest.TestCase):
+
+  def test_basics(self):
+    arrays = [np.array([1, 4, 9]), np.array([2, 3, 4]), np.array([], int),
+              np.array([0, 4, 10, 11]), np.array([5])]
+    merged, positions = np_ext.merge_sorted(arrays)
+    self.assertEqual(merged.tolist(), sorted(sum(map(list, arrays), [])))
+    self.assertEqual(len(positions), len(arrays))
+    for a, pos in it.izip(arrays, positions):
+      self.assertTrue((merged[pos] == a).all())
+    self.assertEqual(sorted(np.hstack(positions).tolist()),
+                     range(len(merged)))
+    merged, positions = np_ext.merge_sorted([np.array([1, 3])])
+    self.assertEqual(merged.tolist(), [1, 3])
+    self.assertEqual(positions[0].tolist(), [0, 1])
+    self.assertRaises(ValueError, np_ext.merge_sorted, [])
+
 def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestIndexIntersect('test_simple_array'))
   suite.addTest(TestIndexIntersect('test_record_array'))
   suite.addTest(TestIndexIntersect('test_exceptions'))
+  suite.addTest(TestIndexIntersectSorted('test_against_index_intersect'))
+  suite.addTest(TestIndexIntersectSorted('test_exceptions'))
   suite.addTest(TestArgsortSplit('test_basics'))  
+  suite.addTest(TestSortedLookup('test_basics'))
+  suite.addTest(TestMergeSorted('test_basics'))
   #suite.addTest(TestIndexIntersect('test_performance'))
+  #suite.addTest(TestIndexIntersectSorted('test_performance'))
   return suite
 
 